@@ -1,200 +1,482 @@
+import json
 import logging
 import os
+from datetime import datetime, timedelta
 from json import JSONDecodeError
-from pathlib import Path
+from typing import Iterator, Tuple, Iterable, Optional
 
-from flask import Flask, jsonify, request, redirect, abort
+from flask import Flask, Blueprint, current_app, jsonify, request, redirect, abort, Response, stream_with_context
 from flask_cors import CORS
 from flask_httpauth import HTTPTokenAuth
-from flask_migrate import Migrate
-
-from api.errors import LoggedError
-from api.handlers import handle_slug_reservation, handle_shorten_url_with_custom_slug, shorten_url_collision_check, \
-    handle_get_slugs_for_company
-from api.ignored_headers import ConfigIgnoredHeaders
+from werkzeug.local import LocalProxy
+
+from api.archive import ArchivedCodes, register_archive_command
+from api.bloom import BloomFilter
+from api.cache import LRUCache
+from api.clicks import ClickCounter, ClickEventLog
+from api.dedupe import register_dedupe_command
+from api.errors import LoggedError, LinkExpired
+from api.export import register_export_command
+from api.handlers import handle_slug_reservation, handle_shorten_url_with_custom_slug, \
+    shorten_urls, handle_get_slugs_for_company, claim_custom_slug, stream_shorten_urls, \
+    handle_resolve_urls, handle_get_click_stats
+from api.ignored_headers import ConfigIgnoredHeaders, PreviewClassifier
+from api.json_provider import FastJSONProvider
+from api.logs import install_log_queue, parse_sample_rates
+from api.metrics import register_metrics, REGISTRY, GaugeFunction, REDIRECTS
 from api.models import db
-from api.repos import config_app_with_db, UrlEntryRepo, SlugReservationRepo
+from api.replicas import ReplicaSet, register_heartbeat
+from api.repos import config_app_with_db, UrlEntryRepo, SlugReservationRepo, CodeCounterRepo, ClickRollupRepo, \
+    replica_urls
+from api.rollup import register_rollup_command
+from api.short_func import BlockLeasedURLShortener, UUID4BasedURLShortener, URLShortener
+from api.snapshot import RedirectSnapshot, register_snapshot
+from api.sweeper import register_sweeper, register_purger
+from api.validation import RequestValidators, SchemaError
+from api.warmup import warm_up
+
+# the key of the Services of the application in app.extensions
+EXTENSION_NAME = "url_shortener"
 
-# app initialization
-app = Flask(__name__)
-CORS(app)
 
-# load os config:
-app.config["ReservationDuration"] = int(os.environ["ReservationDurationInSeconds"])
+def load_config(flask_app: Flask):
+    """
+    Reads the configuration of the application from the environment variables
+    """
+    flask_app.config["ReservationDuration"] = int(os.environ["ReservationDurationInSeconds"])
+    flask_app.config["ClickWriteBehind"] = os.environ.get("ClickWriteBehind", "false").lower() == "true"
+    flask_app.config["ClickFlushSize"] = int(os.environ.get("ClickFlushSize", "1000"))
+    flask_app.config["ClickFlushIntervalInSeconds"] = float(os.environ.get("ClickFlushIntervalInSeconds", "1"))
+    flask_app.config["ClickEventLog"] = os.environ.get("ClickEventLog", "false").lower() == "true"
+    flask_app.config["ClickRollupLagInSeconds"] = float(os.environ.get("ClickRollupLagInSeconds", "60"))
+    flask_app.config["UrlCacheSize"] = int(os.environ.get("UrlCacheSize", "0"))
+    flask_app.config["UrlCacheNegativeTTLInSeconds"] = float(os.environ.get("UrlCacheNegativeTTLInSeconds", "5"))
+    flask_app.config["UrlShortener"] = os.environ.get("UrlShortener", "uuid4")
+    flask_app.config["CodeFilterCapacity"] = int(os.environ.get("CodeFilterCapacity", "0"))
+    flask_app.config["CodeFilterFalsePositiveRate"] = float(os.environ.get("CodeFilterFalsePositiveRate", "0.01"))
+    flask_app.config["CodeLeaseSize"] = int(os.environ.get("CodeLeaseSize", "1000"))
+    flask_app.config["ShortenStreamChunkSize"] = int(os.environ.get("ShortenStreamChunkSize", "500"))
+    flask_app.config["ShortenIdempotent"] = os.environ.get("ShortenIdempotent", "false").lower() == "true"
+    flask_app.config["ReservationSweepIntervalInSeconds"] = float(
+        os.environ.get("ReservationSweepIntervalInSeconds", "0"))
+    flask_app.config["ReservationSweepBatchSize"] = int(os.environ.get("ReservationSweepBatchSize", "1000"))
+    flask_app.config["ExpiredUrlPurgeIntervalInSeconds"] = float(
+        os.environ.get("ExpiredUrlPurgeIntervalInSeconds", "0"))
+    flask_app.config["ExpiredUrlPurgeBatchSize"] = int(os.environ.get("ExpiredUrlPurgeBatchSize", "1000"))
+    flask_app.config["RedirectSnapshotPath"] = os.environ.get("RedirectSnapshotPath", "")
+    flask_app.config["RedirectSnapshotCheckIntervalInSeconds"] = float(
+        os.environ.get("RedirectSnapshotCheckIntervalInSeconds", "5"))
+    flask_app.config["RedirectSnapshotRebuildIntervalInSeconds"] = float(
+        os.environ.get("RedirectSnapshotRebuildIntervalInSeconds", "0"))
+    flask_app.config["PreviewRulesCacheSize"] = int(os.environ.get("PreviewRulesCacheSize", "10000"))
+    flask_app.config["PreviewRulesCheckIntervalInSeconds"] = float(
+        os.environ.get("PreviewRulesCheckIntervalInSeconds", "5"))
+    flask_app.config["AllowedTokens"] = {os.environ["UrlShortenerAllowedKey"]: "no-security"}
+    flask_app.config["WarmUp"] = os.environ.get("WarmUp", "false").lower() == "true"
+    flask_app.config["WarmUpConnections"] = int(os.environ.get("WarmUpConnections", "5"))
+    flask_app.config["WarmUpCacheEntries"] = int(os.environ.get("WarmUpCacheEntries", "1000"))
+    flask_app.config["LogQueueSize"] = int(os.environ.get("LogQueueSize", "10000"))
+    flask_app.config["LogFormat"] = os.environ.get("LogFormat", "json")
+    flask_app.config["LogLevel"] = os.environ.get("LogLevel", "INFO").upper()
+    flask_app.config["LogSampleRates"] = parse_sample_rates(os.environ.get("LogSampleRates", ""))
+    flask_app.config["ArchiveAfterDays"] = float(os.environ.get("ArchiveAfterDays", "90"))
+    flask_app.config["ArchiveFilterCapacity"] = int(os.environ.get("ArchiveFilterCapacity", "0"))
+    flask_app.config["ArchiveFilterFalsePositiveRate"] = float(
+        os.environ.get("ArchiveFilterFalsePositiveRate", "0.01"))
+    flask_app.config["ArchiveFilterCheckIntervalInSeconds"] = float(
+        os.environ.get("ArchiveFilterCheckIntervalInSeconds", "5"))
+    flask_app.config["DatabaseReplicaUrls"] = replica_urls()
+    flask_app.config["ReplicaMaxLagInSeconds"] = float(os.environ.get("ReplicaMaxLagInSeconds", "5"))
+    flask_app.config["ReplicaCheckIntervalInSeconds"] = float(os.environ.get("ReplicaCheckIntervalInSeconds", "1"))
+    flask_app.config["ReplicaHeartbeatIntervalInSeconds"] = float(
+        os.environ.get("ReplicaHeartbeatIntervalInSeconds", "1"))
+
+
+class Services:
+    """
+    The objects shared by the requests of an application, built by create_app from its configuration
+    """
+    click_counter: Optional[ClickCounter]
+    click_log: Optional[ClickEventLog]
+    url_cache: Optional[LRUCache]
+    code_filter: Optional[BloomFilter]
+    archived_codes: Optional[ArchivedCodes]
+    redirect_snapshot: Optional[RedirectSnapshot]
+    replicas: Optional[ReplicaSet]
+    url_entry_repo: UrlEntryRepo
+    slug_repo: SlugReservationRepo
+    click_rollup_repo: ClickRollupRepo
+    url_shortener: URLShortener
+    preview_classifier: PreviewClassifier
+    validators: RequestValidators
+
+    def __init__(self, flask_app: Flask):
+        config = flask_app.config
+        self.click_counter = ClickCounter(flask_app, db) if config["ClickWriteBehind"] else None
+        self.click_log = ClickEventLog(flask_app, db) if config["ClickEventLog"] else None
+        self.url_cache = LRUCache(config["UrlCacheSize"], negative_ttl=config["UrlCacheNegativeTTLInSeconds"]) \
+            if config["UrlCacheSize"] > 0 else None
+        self.code_filter = BloomFilter(config["CodeFilterCapacity"], config["CodeFilterFalsePositiveRate"]) \
+            if config["CodeFilterCapacity"] > 0 else None
+        self.archived_codes = ArchivedCodes(config["ArchiveFilterCapacity"], config["ArchiveFilterFalsePositiveRate"],
+                                            config["ArchiveFilterCheckIntervalInSeconds"]) \
+            if config["ArchiveFilterCapacity"] > 0 else None
+        self.redirect_snapshot = RedirectSnapshot(config["RedirectSnapshotPath"],
+                                                  config["RedirectSnapshotCheckIntervalInSeconds"]) \
+            if config["RedirectSnapshotPath"] else None
+        self.replicas = ReplicaSet.from_urls(
+            config["DatabaseReplicaUrls"], config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+            config["ReplicaMaxLagInSeconds"], config["ReplicaCheckIntervalInSeconds"]) \
+            if config["DatabaseReplicaUrls"] else None
+        self.url_entry_repo = UrlEntryRepo(flask_app, db, self.click_counter, self.url_cache, self.code_filter,
+                                           self.redirect_snapshot, self.click_log, self.replicas,
+                                           self.archived_codes)
+        self.slug_repo = SlugReservationRepo(flask_app, db, self.replicas)
+        self.click_rollup_repo = ClickRollupRepo(flask_app, db)
+
+        # url shortener configuration
+        if config["UrlShortener"] == "block-leased":
+            self.url_shortener = BlockLeasedURLShortener(CodeCounterRepo(flask_app, db).lease,
+                                                         os.environ["CodeGeneratorKey"], config["CodeLeaseSize"])
+        else:
+            self.url_shortener = UUID4BasedURLShortener
+        self.preview_classifier = ConfigIgnoredHeaders(flask_app)
+        self.validators = RequestValidators()
+
+    def register_metrics(self):
+        """
+        Registers the gauges of the in-memory structures
+        """
+        url_cache, code_filter, redirect_snapshot = self.url_cache, self.code_filter, self.redirect_snapshot
+        if url_cache is not None:
+            REGISTRY.register(GaugeFunction("url_cache_events", "Hits and misses of the url cache",
+                                            lambda: {("hit",): url_cache.hits, ("miss",): url_cache.misses},
+                                            ("event",)))
+            REGISTRY.register(GaugeFunction("url_cache_size", "Number of entries in the url cache",
+                                            lambda: url_cache.stats()["size"]))
+        if code_filter is not None:
+            REGISTRY.register(GaugeFunction("code_filter", "State of the Bloom filter of the codes in use",
+                                            lambda: {(k,): v for k, v in code_filter.stats().items()}, ("stat",)))
+        archived_codes = self.archived_codes
+        if archived_codes is not None:
+            REGISTRY.register(GaugeFunction("archived_codes", "State of the Bloom filter of the archived codes",
+                                            lambda: {(k,): v for k, v in archived_codes.stats().items()},
+                                            ("stat",)))
+        if redirect_snapshot is not None:
+            REGISTRY.register(GaugeFunction("redirect_snapshot", "State of the shared redirect snapshot",
+                                            lambda: {(k,): v for k, v in redirect_snapshot.stats().items()},
+                                            ("stat",)))
+        if self.click_counter is not None:
+            REGISTRY.register(GaugeFunction("click_counter_pending", "Number of urls with clicks waiting to be written",
+                                            self.click_counter.pending_size))
+        if self.click_log is not None:
+            REGISTRY.register(GaugeFunction("click_event_log_pending", "Number of click events waiting to be written",
+                                            self.click_log.pending_size))
+        replicas = self.replicas
+        if replicas is not None:
+            REGISTRY.register(GaugeFunction("replica_lag_seconds", "Last measured lag of each read replica",
+                                            lambda: {(k,): v for k, v in replicas.lags().items()}, ("replica",)))
+        rule_hits = self.preview_classifier.rule_hits
+        REGISTRY.register(GaugeFunction("preview_rule_hits", "Number of redirects ignored by each preview rule",
+                                        lambda: {(k,): v for k, v in rule_hits.items()}, ("rule",)))
+
+
+class LazyMigrate:
+    """
+    Stands for the Flask-Migrate extension in app.extensions["migrate"], until the flask db commands read it:
+    flask_migrate imports alembic, which the serving path does not need
+    """
+
+    def __init__(self, flask_app: Flask, database):
+        self.app = flask_app
+        self.db = database
 
-# database configuration
-config_app_with_db(app, db)
-url_entry_repo = UrlEntryRepo(app, db)
-slug_repo = SlugReservationRepo(app, db)
-Migrate(app, db)
-ConfigIgnoredHeaders(app)
+    def __getattr__(self, name: str):
+        from flask_migrate import Migrate
+        # replaces this object in app.extensions
+        Migrate(self.app, self.db)
+        return getattr(self.app.extensions["migrate"], name)
 
-app.logger.setLevel(logging.INFO)
+
+def create_app(config: Optional[dict] = None) -> Flask:
+    """
+    Builds the application: the configuration is read from the environment variables, then updated with config
+    :param config: the values that override the environment variables
+    :return: the application, with its Services in app.extensions[EXTENSION_NAME]
+    """
+    flask_app = Flask(__name__)
+    flask_app.json = FastJSONProvider(flask_app)
+    CORS(flask_app)
+    load_config(flask_app)
+    flask_app.config.update(config or {})
+    if flask_app.config["LogQueueSize"] > 0:
+        # before the first use of flask_app.logger, so that Flask does not add its own handler
+        log_handler = install_log_queue(flask_app.config["LogQueueSize"], flask_app.config["LogSampleRates"],
+                                        flask_app.config["LogFormat"] == "json")
+        REGISTRY.register(GaugeFunction("log_queue_size", "Number of log records waiting to be written",
+                                        log_handler.queue.qsize))
+
+    # database configuration
+    config_app_with_db(flask_app, db)
+    register_metrics(flask_app, db)
+    services = Services(flask_app)
+    flask_app.extensions[EXTENSION_NAME] = services
+    services.register_metrics()
+    flask_app.extensions["migrate"] = LazyMigrate(flask_app, db)
+
+    register_export_command(flask_app, services.url_entry_repo, services.slug_repo)
+    register_sweeper(flask_app, services.slug_repo)
+    register_purger(flask_app, services.url_entry_repo)
+    register_snapshot(flask_app, services.url_entry_repo)
+    register_dedupe_command(flask_app, services.url_entry_repo)
+    register_rollup_command(flask_app, services.click_rollup_repo)
+    register_archive_command(flask_app, services.url_entry_repo)
+    if services.replicas is not None:
+        register_heartbeat(flask_app, lambda: db.get_engine(flask_app))
+    flask_app.register_blueprint(bp)
+    flask_app.logger.setLevel(flask_app.config["LogLevel"])
+
+    if flask_app.config["WarmUp"]:
+        warm_up(flask_app, services.url_entry_repo)
+    return flask_app
+
+
+def _service(name: str) -> LocalProxy:
+    """
+    :return: the named attribute of the Services of the current application
+    """
+    return LocalProxy(lambda: getattr(current_app.extensions[EXTENSION_NAME], name))
+
+
+bp = Blueprint("api", __name__)
+url_entry_repo: UrlEntryRepo = _service("url_entry_repo")
+slug_repo: SlugReservationRepo = _service("slug_repo")
+click_rollup_repo: ClickRollupRepo = _service("click_rollup_repo")
+url_shortener: URLShortener = _service("url_shortener")
+preview_classifier: PreviewClassifier = _service("preview_classifier")
+validators: RequestValidators = _service("validators")
 
 # security configuration
 auth = HTTPTokenAuth(scheme="Bearer")
-allowed_tokens = {os.environ["UrlShortenerAllowedKey"]: "no-security"}
+
+
+def _json(message: str) -> Response:
+    # same body as jsonify, which needs an application context
+    return Response(json.dumps(message) + "\n", mimetype="application/json")
+
 
 # declare all the reusable responses
-with app.app_context():
-    # app context is needed for jsonify
-    RESPONSE_SUCCESS_EMPTY = "", 204
-    RESPONSE_BAD_JSON = jsonify("Bad json supplied or ContentType header is not application/json "), 400
-    RESPONSE_BAD_ROOT = jsonify("Bad root type supplied"), 400
-    RESPONSE_MISSING_ARGS = jsonify("Missing arguments"), 400
-    RESPONSE_BAD_ARGUMENT_TYPES_GENERIC = jsonify("Bad argument types"), 400
-    RESPONSE_FAIL_BAD_URL = jsonify("URL too long or not a string"), 400
-    RESPONSE_FAIL_EMPTY_VALUES_GENERIC = jsonify("Empty/Null values for non-nullable params"), 400
-    RESPONSE_FAIL_UNAUTHORIZED_GENERIC = jsonify("No access to the resource"), 403
-    RESPONSE_FAIL_METHOD_NOT_ALLOWED = jsonify("Method not allowed"), 405
-    RESPONSE_FAIL_UNKNOWN = jsonify("Failed for unknown reasons"), 500
+RESPONSE_SUCCESS_EMPTY = "", 204
+RESPONSE_BAD_JSON = _json("Bad json supplied or ContentType header is not application/json "), 400
+RESPONSE_BAD_ROOT = _json("Bad root type supplied"), 400
+RESPONSE_MISSING_ARGS = _json("Missing arguments"), 400
+RESPONSE_BAD_ARGUMENT_TYPES_GENERIC = _json("Bad argument types"), 400
+RESPONSE_FAIL_BAD_URL = _json("URL too long or not a string"), 400
+RESPONSE_FAIL_EMPTY_VALUES_GENERIC = _json("Empty/Null values for non-nullable params"), 400
+RESPONSE_FAIL_UNAUTHORIZED_GENERIC = _json("No access to the resource"), 403
+RESPONSE_FAIL_METHOD_NOT_ALLOWED = _json("Method not allowed"), 405
+RESPONSE_FAIL_UNKNOWN = _json("Failed for unknown reasons"), 500
 
 # LOGGER MESSAGES:
 ftp = "Failed to process, "
-LOG_BAD_JSON = LoggedError(app, ftp + "the request is a bad json")
-LOG_BAD_ROOT = LoggedError(app, ftp + "the root is not of required format, {} needed, found: {}")
-LOG_MISSING_ARGS = LoggedError(app, ftp + "the request is missing arguments {}")
-LOG_BAD_ARGUMENT_TYPES_GENERIC = LoggedError(app, ftp + "the arguments are of the wrong type")
-LOG_BAD_ARGUMENT_TYPES = LoggedError(app, ftp + "the arguments are of the wrong type {} should be {} but is {}")
-LOG_ALREADY_RESERVED = LoggedError(app, ftp + "the resource has already been reserved by somebody else")
-LOG_FAIL_UNKNOWN = LoggedError(app, ftp + "unknown reason, place: {}")
+LOG_BAD_JSON = LoggedError(ftp + "the request is a bad json")
+LOG_BAD_ROOT = LoggedError(ftp + "the root is not of required format, {} needed, found: {}")
+LOG_MISSING_ARGS = LoggedError(ftp + "the request is missing arguments {}")
+LOG_BAD_ARGUMENT_TYPES_GENERIC = LoggedError(ftp + "the arguments are of the wrong type")
+LOG_BAD_ARGUMENT_TYPES = LoggedError(ftp + "the arguments are of the wrong type {} should be {} but is {}")
+LOG_ALREADY_RESERVED = LoggedError(ftp + "the resource has already been reserved by somebody else")
+LOG_FAIL_UNKNOWN = LoggedError(ftp + "unknown reason, place: {}")
 
 API_PREFIX = 'api'
+NDJSON_MIMETYPE = "application/x-ndjson"
 
 
 @auth.verify_token
 def verify_token(token: str) -> str:
-    return allowed_tokens[token] if token in allowed_tokens else None
+    return current_app.config["AllowedTokens"].get(token)
+
+
+class NDJSONError(ValueError):
+    """
+    A line of an application/x-ndjson request that could not be processed
+    """
+
+    def __init__(self, line_number: int, message: str):
+        super().__init__(message)
+        self.line_number = line_number
+
+
+def parse_expires_at(entry: dict) -> Optional[datetime]:
+    """
+    :return: the expires_at of a shorten entry, in the local time of the database columns, None if it is missing
+    :raises ValueError: if it is not an ISO 8601 time
+    """
+    if "expires_at" not in entry:
+        return None
+    expires_at = datetime.fromisoformat(entry["expires_at"])
+    if expires_at.tzinfo is not None:
+        expires_at = expires_at.astimezone().replace(tzinfo=None)
+    return expires_at
+
+
+def read_ndjson_lines(stream) -> Iterator[Tuple[int, object]]:
+    """
+    Reads the request body one line at a time, skipping the empty lines
+    :return: the line numbers (starting at 1) and the decoded json values
+    """
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, current_app.json.loads(line)
+        except ValueError:
+            # JSONDecodeError, UnicodeDecodeError
+            raise NDJSONError(line_number, "the line is not valid json")
+
 
+def read_ndjson_entries(lines: Iterable[Tuple[int, object]]) -> Iterator[Tuple[str, str, Optional[datetime]]]:
+    """
+    Validates the lines of an NDJSON shorten request: each one is an object with the sms_record_id and the
+    original_url strings, and optionally the expires_at time
+    :return: the (sms_record_id, original_url, expires_at) of each line
+    """
+    validate_entry = validators.shorten_entry
+    for line_number, entry in lines:
+        try:
+            validate_entry(entry)
+        except SchemaError as e:
+            if not e.path:
+                raise NDJSONError(line_number, "the entry is not a dictionary")
+            if e.kind != "type":
+                raise NDJSONError(line_number, "the entry needs exactly the keys sms_record_id and original_url, "
+                                               "and optionally expires_at")
+            raise NDJSONError(line_number, "sms_record_id, original_url and expires_at should be strings")
+        try:
+            expires_at = parse_expires_at(entry)
+        except ValueError:
+            raise NDJSONError(line_number, "expires_at should be an ISO 8601 time")
+        yield entry["sms_record_id"], entry["original_url"], expires_at
+
+
+def stream_ndjson_response(slug: str, lines: Iterable[Tuple[int, object]]) -> Response:
+    """
+    Streams one json line per shortened entry, as soon as its chunk is committed. A request line that cannot be
+    processed ends the stream with an {"error", "line"} line: every entry before it has a result, none after it.
+    """
+    def generate():
+        try:
+            for result in stream_shorten_urls(url_entry_repo, slug, read_ndjson_entries(lines),
+                                              current_app.config["ShortenStreamChunkSize"], url_shortener,
+                                              current_app.config["ShortenIdempotent"]):
+                yield current_app.json.dumps(result) + "\n"
+        except NDJSONError as e:
+            current_app.logger.error(f"Failure: line {e.line_number} of the NDJSON request: {e}")
+            yield current_app.json.dumps({"error": str(e), "line": e.line_number}) + "\n"
 
-@app.route(f"/{API_PREFIX}/shorten", methods=["POST"])
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+@bp.route(f"/{API_PREFIX}/shorten", methods=["POST"])
 @auth.login_required
 def shorten_url():
-    response_list = []
+    if request.mimetype == NDJSON_MIMETYPE:
+        return stream_ndjson_response("", read_ndjson_lines(request.stream))
+
     try:
         data = request.json
 
         # Make sure of the proper data format, to prevent any security issues
-        if type(data) is list:
-            # Proper data format
-            for entry in data:
-                # Type of each entry should be dict
-                if type(entry) is dict:
-                    entry: dict
-
-                    allowed_keys = ["sms_record_id", "original_url"]
-                    current_entry_id = None
-                    current_entry_url = None
-
-                    # Parse the current entry
-                    for key, value in entry.items():
-                        if key not in allowed_keys:
-                            # Key not understood
-                            app.logger.error(f"Failure: Key \"{key}\" not understood")
-                            abort(400)
-                        else:
-                            # assign parameters to their proper value
-                            if key == 'original_url':
-                                current_entry_url = value
-                            elif key == "sms_record_id":
-                                current_entry_id = value
-
-                            # If all the parameters have been parsed, shorten and add to the list
-                            if current_entry_id is not None and current_entry_url is not None:
-                                app.logger.info(f"Request to shorten: {current_entry_url}")
-                                shorter_url = shorten_url_collision_check(url_entry_repo, current_entry_id, "",
-                                                                          current_entry_url)
-                                response_list.append({"sms_record_id": current_entry_id,
-                                                      "original_url": current_entry_url,
-                                                      "shortened_url": shorter_url})
-                else:
-                    # The entry is not a dictionary
-                    try:
-                        string_repr = str(entry)
-                        if len(string_repr) > 100:
-                            app.logger.error("Failure: The current entry is not a dictionary, "
-                                             "but the string representation is very long.")
-                        else:
-                            app.logger.error(f"Failure: The current entry \"{string_repr}\" is not a dictionary.")
-                    except Exception:
-                        app.logger.error(
-                            f"Failure: The current entry is not a dictionary, and cannot be converted to string.")
-                    return jsonify("trying to parse the request, encountered a non-dictionary in the main list"), 400
-        else:
-            app.logger.error("Failure: The body of the request was not a list")
-            return jsonify("while trying to parse the request, the root object is not a dictionary"), 400
+        try:
+            validators.shorten(data)
+        except SchemaError as e:
+            if not e.path:
+                current_app.logger.error("Failure: The body of the request was not a list")
+                return jsonify("while trying to parse the request, the root object is not a dictionary"), 400
+            if e.kind == "type" and e.expected == "object":
+                # The entry is not a dictionary
+                try:
+                    string_repr = str(e.value)
+                    if len(string_repr) > 100:
+                        current_app.logger.error("Failure: The current entry is not a dictionary, "
+                                                 "but the string representation is very long.")
+                    else:
+                        current_app.logger.error(f"Failure: The current entry \"{string_repr}\" is not a dictionary.")
+                except Exception:
+                    current_app.logger.error(
+                        f"Failure: The current entry is not a dictionary, and cannot be converted to string.")
+                return jsonify("trying to parse the request, encountered a non-dictionary in the main list"), 400
+            if e.kind == "unknown":
+                # Key not understood
+                current_app.logger.error(f"Failure: Key \"{e.expected}\" not understood")
+                abort(400)
+            if e.kind == "missing":
+                LOG_MISSING_ARGS(e.path)
+            else:
+                LOG_BAD_ARGUMENT_TYPES(e.path, e.expected, str(e.found))
+            return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
+
+        entries_to_shorten = [(entry["sms_record_id"], entry["original_url"]) for entry in data]
+        try:
+            expires = [parse_expires_at(entry) for entry in data]
+        except ValueError:
+            LOG_BAD_ARGUMENT_TYPES("expires_at", "ISO 8601 time", "str")
+            return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
+        current_app.logger.info(f"Request to shorten {len(entries_to_shorten)} urls",
+                                extra={"entries": len(entries_to_shorten)})
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            for _, original_url in entries_to_shorten:
+                current_app.logger.debug(f"Request to shorten: {original_url}")
+
+        # Validation complete, shorten the whole batch at once
+        short_urls = shorten_urls(url_entry_repo, "", entries_to_shorten, url_shortener,
+                                  current_app.config["ShortenIdempotent"], expires)
+        response_list = [{"sms_record_id": sms_record_id, "original_url": original_url, "shortened_url": short_url}
+                         for (sms_record_id, original_url), short_url in zip(entries_to_shorten, short_urls)]
         return jsonify(response_list)
     except JSONDecodeError:
-        app.logger.error("Failed: The request could not be decoded as JSON.")
+        current_app.logger.error("Failed: The request could not be decoded as JSON.")
         return jsonify("either the request is not json (application/json) header, or failed to parse the body to "
                        "a valid json")
 
 
-@app.route(f"/{API_PREFIX}/shorten/custom", methods=["POST"])
+@bp.route(f"/{API_PREFIX}/shorten/custom", methods=["POST"])
 @auth.login_required
 def shorten_url_to_custom():
     """
     Processes the request /shorten/custom/, validating it according to /docs/openapi.json
     :return: the response json
     """
+    if request.mimetype == NDJSON_MIMETYPE:
+        return shorten_url_to_custom_ndjson()
+
     try:
         req = request.json
-        if type(req) is not dict:
-            # bad root
-            LOG_BAD_ROOT("dict", str(type(req)))
-            return RESPONSE_BAD_ROOT
-
-        if "custom_url" not in req:
-            LOG_MISSING_ARGS("custom_url")
-            return RESPONSE_MISSING_ARGS
-        if "custom_url_token" not in req:
-            LOG_MISSING_ARGS("custom_url_token")
-            return RESPONSE_MISSING_ARGS
-        if "urls_to_shorten" not in req:
-            LOG_MISSING_ARGS("urls_to_shorten")
-            return RESPONSE_MISSING_ARGS
+        try:
+            validators.shorten_custom(req)
+        except SchemaError as e:
+            if not e.path:
+                # bad root
+                LOG_BAD_ROOT("object", str(e.found))
+                return RESPONSE_BAD_ROOT
+            if e.kind == "missing":
+                LOG_MISSING_ARGS(e.path)
+                return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC if e.nested else RESPONSE_MISSING_ARGS
+            LOG_BAD_ARGUMENT_TYPES(e.path, e.expected, str(e.found))
+            return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
 
         custom_url = req["custom_url"]
         custom_url_token = req["custom_url_token"]
-        urls_to_shorten = req["urls_to_shorten"]
-
-        if type(custom_url) is not str:
-            LOG_BAD_ARGUMENT_TYPES("custom_url", "str", str(type(custom_url_token)))
+        checked_urls_to_shorten = [(i["original_url"], i["sms_record_id"]) for i in req["urls_to_shorten"]]
+        try:
+            expires = [parse_expires_at(i) for i in req["urls_to_shorten"]]
+        except ValueError:
+            LOG_BAD_ARGUMENT_TYPES("expires_at", "ISO 8601 time", "str")
             return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
 
-        if type(custom_url_token) is not str:
-            LOG_BAD_ARGUMENT_TYPES("custom_url_token", "str", str(type(custom_url_token)))
-            return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
-
-        if type(urls_to_shorten) is not list:
-            LOG_BAD_ARGUMENT_TYPES("urls_to_shorten", "list", str(type(custom_url_token)))
-            return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
-
-        checked_urls_to_shorten = []
-        for ind, i in enumerate(urls_to_shorten):
-            if type(i) is not dict:
-                LOG_BAD_ARGUMENT_TYPES(f"urls_to_shorten[{ind}]", "dict", type(i))
-                return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
-            if "sms_record_id" not in i:
-                LOG_MISSING_ARGS(f"urls_to_shorten[{ind}].sms_record_id")
-                return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
-            if "original_url" not in i:
-                LOG_MISSING_ARGS(f"urls_to_shorten[{ind}].original_url")
-                return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
-            sms_record_id = i['sms_record_id']
-            original_url = i['original_url']
-            if type(sms_record_id) is not str:
-                LOG_BAD_ARGUMENT_TYPES(f'urls_to_shorten[{ind}].sms_record_id', 'str', str(type(sms_record_id)))
-                return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
-
-            if type(original_url) is not str:
-                LOG_BAD_ARGUMENT_TYPES(f'urls_to_shorten[{ind}].original_url', 'str', str(type(original_url)))
-                return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
-            checked_urls_to_shorten.append((original_url, sms_record_id))
-
         # Validation complete
         result = handle_shorten_url_with_custom_slug(slug_repo, url_entry_repo, custom_url_token, custom_url,
-                                                     checked_urls_to_shorten)
+                                                     checked_urls_to_shorten, url_shortener,
+                                                     current_app.config["ShortenIdempotent"], expires)
         # result[0] = shortened_url_list or None, response_status_code
         if result[0] is None:
             # failed to process
@@ -219,7 +501,72 @@ def shorten_url_to_custom():
         return RESPONSE_BAD_JSON
 
 
-@app.route(f"/{API_PREFIX}/reserve-slug", methods=["POST"])
+def shorten_url_to_custom_ndjson():
+    """
+    The application/x-ndjson variant of /shorten/custom/: the first line is the {"custom_url", "custom_url_token"}
+    header, and each of the following lines is an entry of urls_to_shorten. The slug is claimed before the stream
+    starts, so that the errors of the header are returned with their status code.
+    """
+    lines = read_ndjson_lines(request.stream)
+    try:
+        _, header = next(lines)
+    except StopIteration:
+        LOG_MISSING_ARGS("custom_url, custom_url_token")
+        return RESPONSE_MISSING_ARGS
+    except NDJSONError:
+        LOG_BAD_JSON()
+        return RESPONSE_BAD_JSON
+
+    if type(header) is not dict:
+        LOG_BAD_ROOT("dict", str(type(header)))
+        return RESPONSE_BAD_ROOT
+    for key in ("custom_url", "custom_url_token"):
+        if key not in header:
+            LOG_MISSING_ARGS(key)
+            return RESPONSE_MISSING_ARGS
+        if type(header[key]) is not str:
+            LOG_BAD_ARGUMENT_TYPES(key, "str", str(type(header[key])))
+            return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
+
+    custom_url, custom_url_token = header["custom_url"], header["custom_url_token"]
+    status = claim_custom_slug(slug_repo, custom_url_token, custom_url)
+    if status == 400:
+        LOG_BAD_ARGUMENT_TYPES(f'company_name/slug', 'non-empty', f"{custom_url_token}/{custom_url}")
+        return RESPONSE_FAIL_EMPTY_VALUES_GENERIC
+    elif status == 403:
+        LOG_ALREADY_RESERVED()
+        return RESPONSE_FAIL_UNAUTHORIZED_GENERIC
+
+    return stream_ndjson_response(custom_url, lines)
+
+
+@bp.route(f"/{API_PREFIX}/resolve", methods=["POST"])
+@auth.login_required
+def resolve_urls():
+    """
+    Processes the request /resolve/: a list of shortened urls ("code" or "slug/code"), resolved with one query,
+    without increasing the usage stats
+    :return: the response json
+    """
+    try:
+        req = request.json
+        try:
+            validators.resolve(req)
+        except SchemaError as e:
+            if not e.path:
+                LOG_BAD_ROOT("array", str(e.found))
+                return RESPONSE_BAD_ROOT
+            LOG_BAD_ARGUMENT_TYPES(e.path, e.expected, str(e.found))
+            return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
+
+        return jsonify(handle_resolve_urls(url_entry_repo, req))
+
+    except JSONDecodeError:
+        LOG_BAD_JSON()
+        return RESPONSE_BAD_JSON
+
+
+@bp.route(f"/{API_PREFIX}/reserve-slug", methods=["POST"])
 @auth.login_required
 def reserve_slug():
     """
@@ -231,38 +578,33 @@ def reserve_slug():
     # Parse the body, requirements described in docs/openapi.json
     try:
         req = request.json
-        if type(req) is dict:
-            if "companyId" in req and "slug" in req:
-                company_id = req["companyId"]
-                slug = req["slug"]
-                if type(company_id) is str and type(slug) is str:
-                    # Validation complete
-                    reservation = handle_slug_reservation(slug_repo, company_id, slug)
-                    # reservation[0] - success/failure [1] - reason
-                    if reservation[0]:
-                        return RESPONSE_SUCCESS_EMPTY
-                    elif reservation[1] == 400:
-                        # Empty params supplied
-                        LOG_BAD_ARGUMENT_TYPES_GENERIC()
-                        return jsonify(BAD_PARAMS_MSG), 400
-                    else:
-                        LoggedError(app, ftp + "slug already taken")()
-                        return jsonify("Slug already taken"), 409
-                else:
-                    # Bad params supplied
-                    LOG_BAD_ARGUMENT_TYPES_GENERIC()
-                    return jsonify(BAD_PARAMS_MSG), 400
-            else:
+        try:
+            validators.reserve_slug(req)
+        except SchemaError as e:
+            if not e.path:
+                # Root component is not dict
+                LOG_BAD_ROOT("object", e.found)
+                return jsonify("The root component is not a dict"), 400
+            if e.kind == "missing":
                 # Missing required params
-                if "companyId" in req:
-                    LOG_MISSING_ARGS("slug")
-                else:
-                    LOG_MISSING_ARGS("companyId")
-                return jsonify(BAD_PARAMS_MSG), 400
+                LOG_MISSING_ARGS(e.path)
+            else:
+                # Bad params supplied
+                LOG_BAD_ARGUMENT_TYPES_GENERIC()
+            return jsonify(BAD_PARAMS_MSG), 400
+
+        # Validation complete
+        reservation = handle_slug_reservation(slug_repo, req["companyId"], req["slug"])
+        # reservation[0] - success/failure [1] - reason
+        if reservation[0]:
+            return RESPONSE_SUCCESS_EMPTY
+        elif reservation[1] == 400:
+            # Empty params supplied
+            LOG_BAD_ARGUMENT_TYPES_GENERIC()
+            return jsonify(BAD_PARAMS_MSG), 400
         else:
-            # Root component is not dict
-            LOG_BAD_ROOT("dict", type(req))
-            return jsonify("The root component is not a dict"), 400
+            LoggedError(ftp + "slug already taken")()
+            return jsonify("Slug already taken"), 409
 
     except JSONDecodeError:
         # Not a JSON request
@@ -270,7 +612,7 @@ def reserve_slug():
         return jsonify("Failed to parse the json request"), 400
 
 
-@app.route(f"/{API_PREFIX}/slugs", methods=["GET"])
+@bp.route(f"/{API_PREFIX}/slugs", methods=["GET"])
 @auth.login_required
 def handle_get_company_slugs_route():
     """
@@ -292,7 +634,38 @@ def handle_get_company_slugs_route():
     return jsonify(handle_get_slugs_for_company(slug_repo, company_id))
 
 
-@app.route("/<company_slug>/<url>", methods=["GET"])
+@bp.route(f"/{API_PREFIX}/stats", methods=["GET"])
+@auth.login_required
+def handle_get_click_stats_route():
+    """
+    Route description: Returns the hourly clicks of a url, or of a company slug, read from the click rollups
+    Parameters:
+        slug: the company slug (empty or missing for the urls without a slug)
+        code: the shortened url, the stats of the whole slug are returned if missing
+        from, to: ISO 8601 times of the period, the last 7 days by default
+    :return: the json stats, or an error
+    """
+    try:
+        end = datetime.fromisoformat(request.args["to"]) if "to" in request.args else datetime.now()
+        start = datetime.fromisoformat(request.args["from"]) if "from" in request.args else end - timedelta(days=7)
+    except ValueError:
+        LOG_BAD_ARGUMENT_TYPES("from/to", "ISO 8601 time", f"{request.args.get('from')}/{request.args.get('to')}")
+        return RESPONSE_BAD_ARGUMENT_TYPES_GENERIC
+
+    return jsonify(handle_get_click_stats(click_rollup_repo, request.args.get("slug", ""), request.args.get("code"),
+                                          start, end))
+
+
+@bp.route("/metrics", methods=["GET"])
+@auth.login_required
+def metrics():
+    """
+    The metrics of this worker, in the Prometheus text format, see register_metrics
+    """
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/<company_slug>/<url>", methods=["GET"])
 def get_custom_company_url(company_slug: str, url: str):
     """
     Handles the redirect functionality when the user follows a company custom slug
@@ -308,21 +681,25 @@ def get_custom_company_url(company_slug: str, url: str):
     if type(url) is not str or len(url) > 10:
         return "url not found in the database", 404
 
-    # implement a filter for the headers that need to be ignored.
-    # O(1) using a set
-    ignored_header = request.headers.get("User-Agent") not in app.config["PREVIEW_IGNORED_HEADERS"]
+    # the requests of the preview bots are not counted, see ignored-headers.json
+    ignored_header = not preview_classifier.is_preview(request.headers.get("User-Agent"))
 
-    # return the redirect if exists or a 404 if it doesn't
-    long_url = url_entry_repo.by_company_slug_and_shorten_url(company_slug, url, ignored_header)
+    # return the redirect if exists, a 404 if it doesn't, or a 410 if it has expired
+    try:
+        long_url = url_entry_repo.by_company_slug_and_shorten_url(company_slug, url, ignored_header)
+    except LinkExpired:
+        return jsonify("url/company combination has expired"), 410
 
     # url/company not found
     if long_url is None: return jsonify("url/company combination was not found"), 404
 
+    REDIRECTS.inc(kind="counted" if ignored_header else "preview")
+
     # return the redirect
     return redirect(long_url)
 
 
-@app.route("/<url>", methods=["GET"])
+@bp.route("/<url>", methods=["GET"])
 def get_url(url: str):
     """
     Route handler for /<url>. Redirect a user to the longer url stored in the database
@@ -338,22 +715,27 @@ def get_url(url: str):
         # the shorten url is not available with a get method
         abort(405)
 
-    app.logger.info(f"Handling request {url}")
+    current_app.logger.info(f"Handling request {url}")
 
-    ignored_header = request.headers.get("User-Agent") not in app.config["PREVIEW_IGNORED_HEADERS"]
+    ignored_header = not preview_classifier.is_preview(request.headers.get("User-Agent"))
 
-    if ignored_header:
-        app.logger.debug("The header is ignored due to it being present in the ignored-headers.json")
+    if not ignored_header:
+        current_app.logger.debug("The header is ignored due to it being present in the ignored-headers.json")
 
     # try to retrieve the long url
-    long_url = url_entry_repo.by_company_slug_and_shorten_url(None, url, ignored_header)
+    try:
+        long_url = url_entry_repo.by_company_slug_and_shorten_url(None, url, ignored_header)
+    except LinkExpired:
+        return jsonify("url has expired"), 410
 
     # check if the url exists
     if long_url is None: return jsonify("url not found"), 404
 
+    REDIRECTS.inc(kind="counted" if ignored_header else "preview")
+
     # since the url exists, return a redirect
     return redirect(long_url)
 
 
 if __name__ == '__main__':
-    app.run("0.0.0.0", 8000)
+    create_app().run("0.0.0.0", 8000)
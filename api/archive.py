@@ -0,0 +1,154 @@
+import json
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple, TYPE_CHECKING, Union
+
+import click
+from flask import Flask
+
+from api.bloom import BloomFilter
+
+if TYPE_CHECKING:
+    # api.repos reads the segments
+    from api.repos import UrlEntryRepo
+
+
+class ArchivedEntry(NamedTuple):
+    """
+    An entry of an archive segment, with the columns of url_entry_model (the long url resolved)
+    """
+    companySlug: str
+    id: str
+    recordId: Optional[str]
+    longUrl: str
+    used: int
+    lastUsed: Optional[datetime]
+    synced: bool
+
+
+def segment_month(last_used: datetime) -> datetime:
+    """
+    :return: the partition of an entry: the first day of the month in which it was last used
+    """
+    return datetime(last_used.year, last_used.month, 1)
+
+
+def encode_segment(entries: Iterable[ArchivedEntry]) -> bytes:
+    """
+    :return: the entries as a zlib compressed json array of arrays, in the order of the ArchivedEntry fields
+    """
+    rows = [[*x[:5], x.lastUsed.isoformat() if x.lastUsed is not None else None, x.synced] for x in entries]
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode(), 6)
+
+
+def decode_segment(data: bytes) -> Dict[Tuple[str, str], ArchivedEntry]:
+    """
+    :return: (companySlug, id) -> entry, for the entries of an encoded segment
+    """
+    entries = {}
+    for row in json.loads(zlib.decompress(data)):
+        entry = ArchivedEntry(*row[:5], datetime.fromisoformat(row[5]) if row[5] is not None else None, row[6])
+        entries[(entry.companySlug, entry.id)] = entry
+    return entries
+
+
+class ArchivedCodes:
+    """
+    The codes of the archived entries, in a Bloom filter, so that a redirect to a missing url looks up the archive
+    only when its code may be archived. The filter is loaded from the segments created since its last load, at
+    most every check_interval seconds: an entry archived meanwhile answers 404 until the next load. The codes moved
+    back to url_entry_model stay in the filter, they only cost a lookup.
+    """
+    codes: BloomFilter
+    check_interval: float
+    last_segment_id: int
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.01, check_interval: float = 5):
+        """
+        :param capacity: the expected number of archived entries
+        :param false_positive_rate: the target false positive rate at capacity
+        :param check_interval: the minimum number of seconds between two loads
+        """
+        self.codes = BloomFilter(capacity, false_positive_rate)
+        self.check_interval = check_interval
+        # the segments are created in id order by flask archive-entries
+        self.last_segment_id = 0
+        self._loading = False
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def start_load(self) -> Optional[int]:
+        """
+        :return: the id of the last segment loaded, to load the segments after it, None if a load is running or
+            the last one ended less than check_interval seconds ago
+        """
+        with self._lock:
+            if self._loading or \
+                    (self._loaded_at is not None and time.monotonic() - self._loaded_at < self.check_interval):
+                return None
+            self._loading = True
+            return self.last_segment_id
+
+    def load(self, segments: Iterable[Tuple[int, bytes]]) -> Optional[int]:
+        """
+        Adds the codes of the segments to the filter
+        :param segments: the (id, data) of the segments, in id order
+        :return: the id of the last segment, to load the ones after it, None if there was no segment
+        """
+        loaded = None
+        for segment_id, data in segments:
+            for _, short_url in decode_segment(data):
+                self.codes.add(short_url)
+            self.last_segment_id = loaded = segment_id
+        return loaded
+
+    def finish_load(self, complete: bool):
+        """
+        :param complete: whether all the segments were loaded. The filter is trusted once a load is complete, a
+            failed load is continued by the next one
+        """
+        with self._lock:
+            if complete:
+                self.codes.ready = True
+            self._loading = False
+            self._loaded_at = time.monotonic()
+
+    def __contains__(self, short_url: str) -> bool:
+        """
+        :return: False if the code is certainly not archived, True if it may be, or if the filter is not loaded yet
+        """
+        return not self.codes.ready or short_url in self.codes
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        return {**self.codes.stats(), "last_segment_id": self.last_segment_id}
+
+
+def register_archive_command(flask_app: Flask, url_entry_repo: "UrlEntryRepo"):
+    """
+    Adds the command: flask archive-entries [--batch-size N] [--interval SECONDS] [--include-unsynced]
+    """
+
+    @flask_app.cli.command("archive-entries")
+    @click.option("--batch-size", type=int, default=1000, help="the number of entries per transaction")
+    @click.option("--interval", type=float, help="archive again every this many seconds, instead of once")
+    @click.option("--include-unsynced", is_flag=True,
+                  help="also archive the entries that were not exported yet, for the deployments without export")
+    def archive_entries_command(batch_size: int, interval: float, include_unsynced: bool):
+        """
+        Moves the entries that were not used for ArchiveAfterDays days out of url_entry_model, into compressed
+        archive segments, one transaction per batch. Can be interrupted and run again.
+        """
+        while True:
+            cutoff = datetime.now() - timedelta(days=flask_app.config["ArchiveAfterDays"])
+            after, archived = None, 0
+            while True:
+                after, batch = url_entry_repo.archive_batch(after, batch_size, cutoff, include_unsynced)
+                archived += batch
+                if after is None:
+                    break
+            click.echo(f"Archived {archived} entries last used before {cutoff.isoformat()}", err=True)
+            if interval is None:
+                break
+            time.sleep(interval)
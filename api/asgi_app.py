@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Tuple, List
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.utils import redirect
+
+from api.archive import ArchivedCodes
+from api.cache import LRUCache
+from api.clicks import AsyncClickEventLog, AsyncClickCounter
+from api.errors import LinkExpired
+from api.ignored_headers import PreviewClassifier
+from api.logs import install_log_queue, parse_sample_rates
+from api.metrics import REDIRECTS
+from api.replicas import AsyncReplicaSet
+from api.repos import AsyncUrlEntryRepo, database_url, replica_urls
+from api.snapshot import RedirectSnapshot
+
+logger = logging.getLogger("api.asgi")
+
+Response = Tuple[int, List[Tuple[bytes, bytes]], bytes]
+
+
+def _json(status: int, message: str) -> Response:
+    # same body as flask.jsonify
+    return status, [(b"content-type", b"application/json")], (json.dumps(message) + "\n").encode()
+
+
+def _text(status: int, message: str) -> Response:
+    return status, [(b"content-type", b"text/html; charset=utf-8")], message.encode()
+
+
+def _redirect(long_url: str) -> Response:
+    response = redirect(long_url)
+    return response.status_code, [(k.lower().encode("latin-1"), v.encode("latin-1"))
+                                  for k, v in response.headers.items() if k != "Content-Length"], response.get_data()
+
+
+RESPONSE_FAIL_BAD_URL = _json(400, "URL too long or not a string")
+RESPONSE_FAIL_METHOD_NOT_ALLOWED = _json(405, "Method not allowed")
+RESPONSE_METHOD_NOT_ALLOWED = _text(405, "<h1>Method Not Allowed</h1>")
+RESPONSE_NOT_FOUND = _text(404, "<h1>Not Found</h1>")
+RESPONSE_URL_NOT_FOUND = _json(404, "url not found")
+RESPONSE_COMPANY_URL_NOT_FOUND = _json(404, "url/company combination was not found")
+RESPONSE_URL_EXPIRED = _json(410, "url has expired")
+RESPONSE_COMPANY_URL_EXPIRED = _json(410, "url/company combination has expired")
+
+
+class RedirectApp:
+    """
+    ASGI application serving the two redirect routes of api/app.py (get_url and get_custom_company_url), with the
+    same status codes, bodies and preview header handling, on an asyncio database driver and pool.
+    Every other path answers 404: the API routes are served by the WSGI application.
+    """
+    repo: Optional[AsyncUrlEntryRepo]
+    preview_classifier: PreviewClassifier
+
+    def __init__(self):
+        self.repo = None
+        self._startup_lock = asyncio.Lock()
+        self.preview_classifier = PreviewClassifier(Path(__file__).parent.parent / "ignored-headers.json",
+                                                    int(os.environ.get("PreviewRulesCacheSize", "10000")),
+                                                    float(os.environ.get("PreviewRulesCheckIntervalInSeconds", "5")))
+
+    def startup(self):
+        if int(os.environ.get("LogQueueSize", "10000")) > 0:
+            install_log_queue(int(os.environ.get("LogQueueSize", "10000")),
+                              parse_sample_rates(os.environ.get("LogSampleRates", "")),
+                              os.environ.get("LogFormat", "json") == "json")
+        url = database_url(asyncio=True)
+        pool_options = {} if url.startswith("sqlite") else {
+            "pool_size": int(os.environ.get("AsyncPoolSize", "10")),
+            "max_overflow": int(os.environ.get("AsyncPoolMaxOverflow", "10")),
+        }
+        cache_size = int(os.environ.get("UrlCacheSize", "0"))
+        cache = LRUCache(cache_size, negative_ttl=float(os.environ.get("UrlCacheNegativeTTLInSeconds", "5"))) \
+            if cache_size > 0 else None
+        snapshot = RedirectSnapshot(os.environ["RedirectSnapshotPath"],
+                                    float(os.environ.get("RedirectSnapshotCheckIntervalInSeconds", "5"))) \
+            if os.environ.get("RedirectSnapshotPath") else None
+        engine = create_async_engine(url, **pool_options)
+        flush_size = int(os.environ.get("ClickFlushSize", "1000"))
+        flush_interval = float(os.environ.get("ClickFlushIntervalInSeconds", "1"))
+        click_log = AsyncClickEventLog(engine, flush_size, flush_interval) \
+            if os.environ.get("ClickEventLog", "false").lower() == "true" else None
+        click_counter = AsyncClickCounter(engine, flush_size, flush_interval) \
+            if os.environ.get("ClickWriteBehind", "false").lower() == "true" else None
+        replicas = AsyncReplicaSet.from_urls(replica_urls(asyncio=True), pool_options,
+                                             float(os.environ.get("ReplicaMaxLagInSeconds", "5")),
+                                             float(os.environ.get("ReplicaCheckIntervalInSeconds", "1"))) \
+            if replica_urls() else None
+        archive_filter_capacity = int(os.environ.get("ArchiveFilterCapacity", "0"))
+        archived_codes = ArchivedCodes(archive_filter_capacity,
+                                       float(os.environ.get("ArchiveFilterFalsePositiveRate", "0.01")),
+                                       float(os.environ.get("ArchiveFilterCheckIntervalInSeconds", "5"))) \
+            if archive_filter_capacity > 0 else None
+        self.repo = AsyncUrlEntryRepo(engine, cache, snapshot, click_log, click_counter, replicas, archived_codes)
+
+    async def ensure_started(self):
+        # the lock keeps the concurrent first requests from building an engine each
+        async with self._startup_lock:
+            if self.repo is None:
+                self.startup()
+
+    async def shutdown(self):
+        if self.repo is None:
+            return
+        for buffer in (self.repo.click_log, self.repo.click_counter):
+            if buffer is not None:
+                await buffer.stop()
+        if self.repo.archived_codes_load is not None:
+            self.repo.archived_codes_load.cancel()
+            await asyncio.gather(self.repo.archived_codes_load, return_exceptions=True)
+        if self.repo.replicas is not None:
+            await self.repo.replicas.dispose()
+        await self.repo.engine.dispose()
+
+    async def get_url(self, url: str, count: bool) -> Response:
+        if len(url) > 10:
+            return RESPONSE_FAIL_BAD_URL
+        if url == "shorten":
+            return RESPONSE_METHOD_NOT_ALLOWED
+        try:
+            long_url = await self.repo.by_company_slug_and_shorten_url(None, url, count)
+        except LinkExpired:
+            return RESPONSE_URL_EXPIRED
+        if long_url is None:
+            return RESPONSE_URL_NOT_FOUND
+        REDIRECTS.inc(kind="counted" if count else "preview")
+        return _redirect(long_url)
+
+    async def get_custom_company_url(self, company_slug: str, url: str, count: bool) -> Response:
+        if len(url) > 50:
+            return _text(404, "company slug not found in the database")
+        if company_slug == "api":
+            return RESPONSE_FAIL_METHOD_NOT_ALLOWED
+        if len(url) > 10:
+            return _text(404, "url not found in the database")
+        try:
+            long_url = await self.repo.by_company_slug_and_shorten_url(company_slug, url, count)
+        except LinkExpired:
+            return RESPONSE_COMPANY_URL_EXPIRED
+        if long_url is None:
+            return RESPONSE_COMPANY_URL_NOT_FOUND
+        REDIRECTS.inc(kind="counted" if count else "preview")
+        return _redirect(long_url)
+
+    async def handle(self, scope) -> Response:
+        segments = scope["path"].split("/")[1:]
+        if not all(segments) or len(segments) > 2:
+            return RESPONSE_NOT_FOUND
+        if scope["method"] not in ("GET", "HEAD"):
+            return RESPONSE_METHOD_NOT_ALLOWED
+
+        user_agent = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"user-agent"), None)
+        count = not self.preview_classifier.is_preview(user_agent)
+
+        if len(segments) == 1:
+            return await self.get_url(segments[0], count)
+        return await self.get_custom_company_url(segments[0], segments[1], count)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await self.ensure_started()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await self.shutdown()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if self.repo is None:
+            # the server does not support the lifespan protocol: the pending clicks are only written by the flush
+            # task, not at shutdown
+            await self.ensure_started()
+
+        try:
+            status, headers, body = await self.handle(scope)
+        except Exception:
+            logger.exception(f"Failed to process {scope['path']}")
+            status, headers, body = _json(500, "Failed for unknown reasons")
+
+        headers = headers + [(b"content-length", str(len(body)).encode())]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body if scope["method"] != "HEAD" else b""})
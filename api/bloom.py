@@ -0,0 +1,64 @@
+import hashlib
+import math
+import threading
+from typing import Dict, Union
+
+
+class BloomFilter:
+    """
+    Compact set of strings: a lookup can return a false positive ("maybe present"), never a false negative.
+    Sized for capacity entries at the given false positive rate; past the capacity the rate degrades.
+    """
+    capacity: int
+    false_positive_rate: float
+    size_in_bits: int
+    hash_count: int
+    count: int
+    ready: bool
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.01):
+        """
+        :param capacity: the expected number of entries
+        :param false_positive_rate: the target false positive rate at capacity
+        """
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.size_in_bits = max(8, math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size_in_bits / capacity * math.log(2)))
+        self.count = 0
+        # set once the filter holds all the existing entries, until then it should not be trusted
+        self.ready = False
+        self.positives = 0
+        self.negatives = 0
+        self._bits = bytearray((self.size_in_bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, key: str):
+        # double hashing: k positions derived from two 64 bit hashes
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size_in_bits for i in range(self.hash_count)]
+
+    def add(self, key: str):
+        positions = self._positions(key)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        present = all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+        if present:
+            self.positives += 1
+        else:
+            self.negatives += 1
+        return present
+
+    def estimated_false_positive_rate(self) -> float:
+        return (1 - math.exp(-self.hash_count * self.count / self.size_in_bits)) ** self.hash_count
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        return {"count": self.count, "capacity": self.capacity, "memory_bytes": len(self._bits),
+                "hash_count": self.hash_count, "estimated_false_positive_rate": self.estimated_false_positive_rate(),
+                "maybe_present": self.positives, "absent": self.negatives, "ready": int(self.ready)}
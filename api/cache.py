@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Any, Tuple, Optional, Dict
+
+
+class LRUCache:
+    """
+    Thread-safe, bounded LRU cache, with a time to live for the entries.
+    A value of None is a cached miss (negative entry), and it lives for negative_ttl seconds instead of ttl.
+    """
+    max_size: int
+    ttl: Optional[float]
+    negative_ttl: float
+    hits: int
+    misses: int
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None, negative_ttl: float = 5):
+        """
+        :param max_size: the maximum number of entries, the least recently used entries are evicted first
+        :param ttl: the number of seconds a value is kept, None to keep it until it is evicted
+        :param negative_ttl: the number of seconds a cached miss is kept
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        :param key: the key to search for
+        :return: (True, value) if the key is cached (value is None for a cached miss), (False, None) otherwise
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: Hashable, value: Any):
+        """
+        :param key: the key of the entry
+        :param value: the value to be cached, None to cache a miss
+        """
+        ttl = self.negative_ttl if value is None else self.ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "max_size": self.max_size}
@@ -0,0 +1,378 @@
+import asyncio
+import atexit
+import logging
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable, Dict, Tuple, List, Optional
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, and_
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from api.models import UrlEntryModel, ClickEvent
+
+
+# the batched UPDATE of the clicks counters, one parameter set per (companySlug, id), see _click_parameters
+_COUNT_CLICKS = UrlEntryModel.__table__.update().where(and_(
+    UrlEntryModel.__table__.c.companySlug == bindparam("b_company_slug"),
+    UrlEntryModel.__table__.c.id == bindparam("b_id"))).values(
+    used=UrlEntryModel.__table__.c.used + bindparam("b_count"), lastUsed=bindparam("b_last_used"), synced=False)
+
+
+def _click_parameters(payload: Dict[Tuple[str, str], List]) -> Dict[Tuple[str, str], Dict]:
+    """
+    :param payload: (companySlug, id) -> [count, last used] of the drained clicks
+    :return: (companySlug, id) -> the parameters of _COUNT_CLICKS
+    """
+    return {key: {"b_company_slug": key[0], "b_id": key[1], "b_count": count, "b_last_used": last_used}
+            for key, (count, last_used) in payload.items()}
+
+
+def _add_clicks(pending: Dict[Tuple[str, str], List], key: Tuple[str, str], count: int, last_used: datetime):
+    entry = pending.get(key)
+    if entry is None:
+        pending[key] = [count, last_used]
+    else:
+        entry[0] += count
+        entry[1] = max(entry[1], last_used)
+
+
+class WriteBehindBuffer(ABC):
+    """
+    Collects writes in memory and hands them to the database in batches, away from the request thread.
+    A flush is triggered when the buffer reaches max_pending entries, every flush_interval seconds,
+    and once more when the process exits.
+    """
+    app: Flask
+    db: SQLAlchemy
+    max_pending: int
+    flush_interval: float
+
+    def __init__(self, app: Flask, db: SQLAlchemy, max_pending: int, flush_interval: float):
+        self.app = app
+        self.db = db
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._thread = None
+
+    def _ensure_started(self):
+        # the thread is started lazily, so that processes that never serve a request (flask db ..., pre-fork
+        # masters) do not spawn it
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake_up.wait(self.flush_interval)
+            self._wake_up.clear()
+            self.flush()
+
+    def _notify_added(self, pending_size: int):
+        if pending_size >= self.max_pending:
+            self._wake_up.set()
+
+    @abstractmethod
+    def _drain(self):
+        """
+        Swaps out the pending writes, called with the lock held
+        :return: the pending writes, or None if there is nothing to write
+        """
+
+    @abstractmethod
+    def _restore(self, payload):
+        """
+        Puts back the writes of a failed flush, called with the lock held
+        """
+
+    @abstractmethod
+    def _write(self, connection, payload):
+        """
+        Writes the drained payload, inside a transaction
+        """
+
+    def flush(self):
+        """
+        Writes all the pending entries to the database, in a single transaction
+        """
+        with self._flush_lock:
+            with self._lock:
+                payload = self._drain()
+            if not payload:
+                return
+            try:
+                with self.db.get_engine(self.app).begin() as connection:
+                    self._write(connection, payload)
+            except Exception:
+                self.app.logger.exception(f"{type(self).__name__}: flush failed, the entries will be retried")
+                with self._lock:
+                    self._restore(payload)
+
+
+class ClickCounter(WriteBehindBuffer):
+    """
+    Write-behind counter for the redirects: the increments are gathered per (companySlug, id) and flushed
+    as one batched UPDATE, instead of one transaction per click.
+    Configuration (app.config):
+        ClickFlushSize: the number of distinct urls after which the buffer is flushed
+        ClickFlushIntervalInSeconds: the maximum time an increment stays in memory
+    """
+    _pending: Dict[Tuple[str, str], List]
+    # set by UrlEntryRepo: (connection, keys) -> the keys of the archived entries moved back to url_entry_model
+    unarchive: Optional[Callable[[Connection, List[Tuple[str, str]]], List[Tuple[str, str]]]]
+
+    def __init__(self, app: Flask, db: SQLAlchemy):
+        super().__init__(app, db, app.config["ClickFlushSize"], app.config["ClickFlushIntervalInSeconds"])
+        self._pending = {}
+        self.unarchive = None
+
+    def record(self, company_slug: str, short_url: str):
+        """
+        Registers a click for the url, the database will be updated on the next flush
+        :param company_slug: the company slug of the url ("" for the urls without a slug)
+        :param short_url: the shortened url
+        """
+        self._ensure_started()
+        now = datetime.now()
+        with self._lock:
+            _add_clicks(self._pending, (company_slug, short_url), 1, now)
+            pending_size = len(self._pending)
+        self._notify_added(pending_size)
+
+    def pending_size(self) -> int:
+        return len(self._pending)
+
+    def _drain(self):
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def _restore(self, payload: Dict[Tuple[str, str], List]):
+        for key, (count, last_used) in payload.items():
+            _add_clicks(self._pending, key, count, last_used)
+
+    def _write(self, connection, payload: Dict[Tuple[str, str], List]):
+        parameters = _click_parameters(payload)
+        updated = connection.execute(_COUNT_CLICKS, list(parameters.values())).rowcount
+        if self.unarchive is None or (connection.dialect.supports_sane_multi_rowcount and updated == len(payload)):
+            return
+        # an entry archived after its clicks were buffered is not in url_entry_model anymore: move it back, and
+        # update it again. The batched row count is not reliable on every driver, so the archive is checked
+        moved = self.unarchive(connection, list(payload))
+        if moved:
+            connection.execute(_COUNT_CLICKS, [parameters[x] for x in moved])
+
+
+class ClickEventLog(WriteBehindBuffer):
+    """
+    Write-behind append-only log of the redirects: the events are inserted into click_event as one batched
+    INSERT per flush. Uses the ClickFlushSize (number of events) and ClickFlushIntervalInSeconds of ClickCounter.
+    """
+    _pending: List[Dict]
+
+    def __init__(self, app: Flask, db: SQLAlchemy):
+        super().__init__(app, db, app.config["ClickFlushSize"], app.config["ClickFlushIntervalInSeconds"])
+        self._pending = []
+        self._insert_stmt = ClickEvent.__table__.insert()
+
+    def record(self, company_slug: str, short_url: str, preview: bool):
+        """
+        Registers a redirect of the url, the event will be inserted on the next flush
+        :param company_slug: the company slug of the url ("" for the urls without a slug)
+        :param short_url: the shortened url
+        :param preview: whether the redirect was requested by an ignored preview header
+        """
+        self._ensure_started()
+        event = {"at": datetime.now(), "companySlug": company_slug, "code": short_url, "preview": preview}
+        with self._lock:
+            self._pending.append(event)
+            pending_size = len(self._pending)
+        self._notify_added(pending_size)
+
+    def pending_size(self) -> int:
+        return len(self._pending)
+
+    def _drain(self):
+        pending, self._pending = self._pending, []
+        return pending
+
+    def _restore(self, payload: List[Dict]):
+        self._pending[:0] = payload
+
+    def _write(self, connection, payload: List[Dict]):
+        connection.execute(self._insert_stmt, payload)
+
+
+class AsyncWriteBehindBuffer(ABC):
+    """
+    asyncio counterpart of WriteBehindBuffer, for the ASGI redirect server: the pending writes are handed to the
+    database from a task of the event loop, every flush_interval seconds or once max_pending entries are waiting.
+    stop() writes the last entries when the server shuts down.
+    """
+    engine: AsyncEngine
+    max_pending: int
+    flush_interval: float
+
+    def __init__(self, engine: AsyncEngine, max_pending: int, flush_interval: float):
+        self.engine = engine
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        # created in the event loop, by the first record
+        self._wake_up: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._wake_up = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake_up.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake_up.clear()
+            await self.flush()
+
+    def _notify_added(self, pending_size: int):
+        if pending_size >= self.max_pending:
+            self._wake_up.set()
+
+    @abstractmethod
+    def _drain(self):
+        """
+        Swaps out the pending writes
+        :return: the pending writes, or None if there is nothing to write
+        """
+
+    @abstractmethod
+    def _restore(self, payload):
+        """
+        Puts back the writes of a failed flush
+        """
+
+    @abstractmethod
+    async def _write(self, connection, payload):
+        """
+        Writes the drained payload, inside a transaction
+        """
+
+    async def flush(self):
+        """
+        Writes all the pending entries to the database, in a single transaction
+        """
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            payload = self._drain()
+            if not payload:
+                return
+            try:
+                async with self.engine.begin() as connection:
+                    await self._write(connection, payload)
+            except Exception:
+                logging.getLogger("api.asgi").exception(
+                    f"{type(self).__name__}: flush failed, the entries will be retried")
+                self._restore(payload)
+
+    async def stop(self):
+        """
+        Stops the flush task, and writes the pending entries
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+
+class AsyncClickCounter(AsyncWriteBehindBuffer):
+    """
+    asyncio counterpart of ClickCounter: the clicks are gathered per (companySlug, id) and written as one batched
+    UPDATE per flush
+    """
+    _pending: Dict[Tuple[str, str], List]
+    # set by AsyncUrlEntryRepo, same as ClickCounter.unarchive, run on the sync connection of the transaction
+    unarchive: Optional[Callable[[Connection, List[Tuple[str, str]]], List[Tuple[str, str]]]]
+
+    def __init__(self, engine: AsyncEngine, max_pending: int, flush_interval: float):
+        super().__init__(engine, max_pending, flush_interval)
+        self._pending = {}
+        self.unarchive = None
+
+    def record(self, company_slug: str, short_url: str):
+        """
+        Same as ClickCounter.record, called from the event loop
+        """
+        self._ensure_started()
+        _add_clicks(self._pending, (company_slug, short_url), 1, datetime.now())
+        self._notify_added(len(self._pending))
+
+    def pending_size(self) -> int:
+        return len(self._pending)
+
+    def _drain(self):
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def _restore(self, payload: Dict[Tuple[str, str], List]):
+        for key, (count, last_used) in payload.items():
+            _add_clicks(self._pending, key, count, last_used)
+
+    async def _write(self, connection, payload: Dict[Tuple[str, str], List]):
+        parameters = _click_parameters(payload)
+        updated = (await connection.execute(_COUNT_CLICKS, list(parameters.values()))).rowcount
+        if self.unarchive is None or (connection.dialect.supports_sane_multi_rowcount and updated == len(payload)):
+            return
+        # see ClickCounter._write
+        moved = await connection.run_sync(self.unarchive, list(payload))
+        if moved:
+            await connection.execute(_COUNT_CLICKS, [parameters[x] for x in moved])
+
+
+class AsyncClickEventLog(AsyncWriteBehindBuffer):
+    """
+    asyncio counterpart of ClickEventLog: the events are inserted into click_event as one batched INSERT per flush
+    """
+    _pending: List[Dict]
+
+    def __init__(self, engine: AsyncEngine, max_pending: int, flush_interval: float):
+        super().__init__(engine, max_pending, flush_interval)
+        self._pending = []
+        self._insert_stmt = ClickEvent.__table__.insert()
+
+    def record(self, company_slug: str, short_url: str, preview: bool):
+        """
+        Same as ClickEventLog.record, called from the event loop
+        """
+        self._ensure_started()
+        self._pending.append({"at": datetime.now(), "companySlug": company_slug, "code": short_url,
+                              "preview": preview})
+        self._notify_added(len(self._pending))
+
+    def pending_size(self) -> int:
+        return len(self._pending)
+
+    def _drain(self):
+        pending, self._pending = self._pending, []
+        return pending
+
+    def _restore(self, payload: List[Dict]):
+        self._pending[:0] = payload
+
+    async def _write(self, connection, payload: List[Dict]):
+        await connection.execute(self._insert_stmt, payload)
@@ -0,0 +1,25 @@
+import click
+from flask import Flask
+
+from api.repos import UrlEntryRepo
+
+
+def register_dedupe_command(flask_app: Flask, url_entry_repo: UrlEntryRepo):
+    """
+    Adds the command: flask dedupe-long-urls [--batch-size N]
+    """
+
+    @flask_app.cli.command("dedupe-long-urls")
+    @click.option("--batch-size", type=int, default=1000)
+    def dedupe_long_urls_command(batch_size: int):
+        """
+        Moves the long urls of the entries created before the deduplication into the long_url table, one
+        transaction per batch. Can be interrupted and run again.
+        """
+        after, moved = None, 0
+        while True:
+            after, batch = url_entry_repo.dedupe_long_urls(after, batch_size)
+            moved += batch
+            if after is None:
+                break
+        click.echo(f"Moved {moved} long urls", err=True)
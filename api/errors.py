@@ -1,13 +1,17 @@
-from flask import Flask
+from flask import current_app
 
 
 class LoggedError:
-    app: Flask
     msg: str
 
-    def __init__(self, app: Flask, msg: str):
-        self.app = app
+    def __init__(self, msg: str):
         self.msg = msg
 
     def __call__(self, *args, **kwargs):
-        self.app.logger.error(self.msg.format(*args))
+        current_app.logger.error(self.msg.format(*args))
+
+
+class LinkExpired(Exception):
+    """
+    Raised by the redirect lookups for an entry whose expiresAt has passed, answered with 410 Gone
+    """
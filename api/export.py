@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+import os
+import stat
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import List, Dict, Type, TextIO, Any
+
+import click
+from flask import Flask
+from sqlalchemy.engine import Row
+
+from api.repos import UrlEntryRepo, SlugReservationRepo
+
+
+class ExportSink(ABC):
+    """
+    Destination of the exported rows. The rows of a batch are marked as synced only after flush() returns,
+    so a sink must have persisted them by then.
+    """
+    output: TextIO
+
+    def __init__(self, output: TextIO):
+        self.output = output
+
+    @abstractmethod
+    def write(self, rows: List[Dict[str, Any]]):
+        """
+        Writes a batch of rows, persisted by the next flush()
+        """
+
+    def flush(self):
+        self.output.flush()
+        try:
+            fileno = self.output.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            # in memory
+            return
+        if fileno > 2 and stat.S_ISREG(os.fstat(fileno).st_mode):
+            # a file, not stdout/stderr or a pipe, which cannot be synced
+            os.fsync(fileno)
+
+
+class NDJSONSink(ExportSink):
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self.output.writelines(json.dumps(row, default=str) + "\n" for row in rows)
+
+
+class CSVSink(ExportSink):
+
+    def __init__(self, output: TextIO):
+        super().__init__(output)
+        self._writer = None
+        # a resumed export appends to the existing file, without a header. stdout and the pipes are not seekable,
+        # they always get one
+        self._header_written = output.seekable() and output.tell() > 0
+
+    def write(self, rows: List[Dict[str, Any]]):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self.output, fieldnames=list(rows[0].keys()))
+        if not self._header_written:
+            self._writer.writeheader()
+            self._header_written = True
+        self._writer.writerows(rows)
+
+
+# the available --format values, a new sink is registered by adding it here
+SINKS: Dict[str, Type[ExportSink]] = {"ndjson": NDJSONSink, "csv": CSVSink}
+
+
+def _serialize(row: Row) -> Dict[str, Any]:
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row._mapping.items()}
+
+
+def export_unsynced(repo, sink: ExportSink, batch_size: int, key=lambda row: row) -> int:
+    """
+    Streams the unsynced rows of the repo to the sink, batch by batch, marking each batch as synced once the sink
+    has flushed it. Only one batch is held in memory. After a crash the rows of the interrupted batch are still
+    unsynced, and are exported again by the next run (at-least-once delivery).
+    :param repo: UrlEntryRepo or SlugReservationRepo
+    :param sink: the destination of the rows
+    :param batch_size: the number of rows read, written and marked at once
+    :param key: the keyset pagination key of a row
+    :return: the number of exported rows
+    """
+    exported = 0
+    after = None
+    while True:
+        rows = repo.unsynced_batch(after, batch_size)
+        if not rows:
+            return exported
+        sink.write([_serialize(x) for x in rows])
+        sink.flush()
+        repo.mark_synced(rows)
+        exported += len(rows)
+        after = key(rows[-1])
+
+
+def register_export_command(flask_app: Flask, url_entry_repo: UrlEntryRepo, slug_repo: SlugReservationRepo):
+    """
+    Adds the command: flask export-unsynced {urls|reservations} [--format ndjson|csv] [--output FILE]
+    """
+
+    @flask_app.cli.command("export-unsynced")
+    @click.argument("table", type=click.Choice(["urls", "reservations"]))
+    @click.option("--format", "sink_format", type=click.Choice(list(SINKS)), default="ndjson")
+    @click.option("--output", type=click.File("a"), default="-", help="the file the rows are appended to")
+    @click.option("--batch-size", type=int, default=1000)
+    def export_unsynced_command(table: str, sink_format: str, output: TextIO, batch_size: int):
+        """
+        Exports the rows with synced = false, and marks them as synced.
+        """
+        sink = SINKS[sink_format](output)
+        if table == "urls":
+            exported = export_unsynced(url_entry_repo, sink, batch_size, lambda row: (row.companySlug, row.id))
+        else:
+            exported = export_unsynced(slug_repo, sink, batch_size, lambda row: row.slug)
+        click.echo(f"Exported {exported} {table}", err=True)
@@ -1,11 +1,13 @@
 from dataclasses import dataclass, asdict
 from datetime import datetime
-from typing import Tuple, Optional, List, Union
+from itertools import islice, repeat
+from typing import Tuple, Optional, List, Union, Iterable, Iterator
 
+from api.metrics import COLLISION_RETRIES
 from api.repos import SlugReservationRepo
 
-from api.repos import UrlEntryRepo
-from api.short_func import UUID4BasedURLShortener
+from api.repos import UrlEntryRepo, ClickRollupRepo
+from api.short_func import UUID4BasedURLShortener, URLShortener
 
 
 @dataclass
@@ -34,36 +36,144 @@ def handle_slug_reservation(slug_repo: SlugReservationRepo, company_id: str, slu
     if slug in _RESERVED_SLUGS:
         return False, 409
 
-    # Find the reservation
-    existing_reservation = slug_repo.by_id(slug)
-
-    if existing_reservation is None:
-        # create the reservation
-        slug_repo.add(company_id, slug)
-        return True, 204
-
-    elif existing_reservation.by == company_id:
-        if not existing_reservation.permanent:
-            # the company owns the reservation, refresh it
-            slug_repo.refresh(existing_reservation)
-        return True, 204
-    elif not existing_reservation.permanent and existing_reservation.expires < datetime.now():
-        slug_repo.change_reservation(existing_reservation, company_id)
+    # reserved, refreshed or taken over (if it has expired) in a single statement
+    if slug_repo.reserve(company_id, slug):
         return True, 204
 
     # The reservation exists, but is not owned by the company requesting it
     return False, 409
 
 
-def shorten_url_collision_check(url_repo: UrlEntryRepo, sms_record_id: str, slug: Optional[str], long_url: str) -> str:
-    shorter_url = UUID4BasedURLShortener.get_shorter_url_for(long_url)
-    while not url_repo.add(sms_record_id, long_url, shorter_url, slug):
-        shorter_url = UUID4BasedURLShortener.get_shorter_url_for(long_url)
-    return shorter_url
+def shorten_urls_collision_check(url_repo: UrlEntryRepo, slug: Optional[str], entries: List[Tuple[str, str]],
+                                 shortener: URLShortener = UUID4BasedURLShortener,
+                                 expires: Optional[List[Optional[datetime]]] = None) -> List[str]:
+    """
+    Shortens a whole batch of urls: the codes are generated for the batch, checked with one query, only the
+    colliding ones are regenerated, and the batch is inserted in a single transaction.
+    :param url_repo: the url entry repo
+    :param slug: the company slug of the urls
+    :param entries: list[sms_record_id, long_url] to be shortened
+    :param shortener: the generator of the codes
+    :param expires: the expiry of each entry, in the same order, None for the entries that never expire
+    :return: the shortened urls, in the same order as the entries
+    """
+    if len(entries) == 0:
+        return []
+
+    if shortener.is_collision_free():
+        # no check needed, the insert can only fail on a code generated by a previous (random) shortener
+        short_urls = shortener.get_shorter_urls_for(len(entries))
+        if url_repo.add_many(entries, short_urls, slug, expires):
+            return short_urls
+
+    while True:
+        short_urls = shortener.get_shorter_urls_for(len(entries))
+
+        # only the regenerated codes have to be checked again
+        accepted = set()
+        to_check = list(range(len(entries)))
+        while to_check:
+            taken = url_repo.existing_short_urls([short_urls[i] for i in to_check])
+            colliding = []
+            for i in to_check:
+                if short_urls[i] in taken or short_urls[i] in accepted:
+                    colliding.append(i)
+                else:
+                    accepted.add(short_urls[i])
+            COLLISION_RETRIES.inc(len(colliding))
+            for i, short_url in zip(colliding, shortener.get_shorter_urls_for(len(colliding))):
+                short_urls[i] = short_url
+            to_check = colliding
+
+        if url_repo.add_many(entries, short_urls, slug, expires):
+            return short_urls
+        # another request took one of the codes after the check, start over
+
+
+def shorten_urls(url_repo: UrlEntryRepo, slug: Optional[str], entries: List[Tuple[str, str]],
+                 shortener: URLShortener = UUID4BasedURLShortener, idempotent: bool = False,
+                 expires: Optional[List[Optional[datetime]]] = None) -> List[str]:
+    """
+    Shortens a batch of urls, see shorten_urls_collision_check
+    :param idempotent: if set, an entry (sms_record_id, long_url) already shortened under the slug gets its
+        existing short url back, with its expiry, and an entry repeated in the batch is shortened once, with the
+        expiry of its first occurrence
+    :param expires: the expiry of each entry, see shorten_urls_collision_check
+    :return: the shortened urls, in the same order as the entries
+    """
+    if not idempotent:
+        return shorten_urls_collision_check(url_repo, slug, entries, shortener, expires)
+
+    short_urls = url_repo.existing_codes(slug, entries)
+    missing = {}
+    for entry, expires_at in zip(entries, expires if expires is not None else repeat(None)):
+        if entry not in short_urls:
+            missing.setdefault(entry, expires_at)
+    short_urls.update(zip(missing, shorten_urls_collision_check(url_repo, slug, list(missing), shortener,
+                                                                list(missing.values()))))
+    return [short_urls[x] for x in entries]
+
+
+def stream_shorten_urls(url_repo: UrlEntryRepo, slug: Optional[str],
+                        entries: Iterable[Tuple[str, str, Optional[datetime]]],
+                        chunk_size: int, shortener: URLShortener = UUID4BasedURLShortener,
+                        idempotent: bool = False) -> Iterator[dict]:
+    """
+    Shortens the entries chunk by chunk, as they are read, so that only one chunk is held in memory at a time.
+    The results of a chunk are yielded once the chunk is committed; an error raised while reading the entries
+    stops the stream, after the entries read before it are shortened and yielded.
+    :param url_repo: the url entry repo
+    :param slug: the company slug of the urls
+    :param entries: iterable[sms_record_id, long_url, expires_at] to be shortened, expires_at None if the entry never
+        expires
+    :param chunk_size: the number of entries inserted in one transaction
+    :param shortener: the generator of the codes
+    :param idempotent: see shorten_urls
+    :return: the shortened urls, in the same order as the entries, with the sms_record_id and the original url
+    """
+    entries = iter(entries)
+    prefix = slug + "/" if slug else ""
+    error = None
+    while error is None:
+        chunk = []
+        try:
+            chunk.extend(islice(entries, chunk_size))
+        except Exception as e:
+            # list.extend keeps the entries read before the error
+            error = e
+        if chunk:
+            short_urls = shorten_urls(url_repo, slug, [x[:2] for x in chunk], shortener, idempotent,
+                                      [x[2] for x in chunk])
+            for (sms_record_id, long_url, _), short_url in zip(chunk, short_urls):
+                yield asdict(ShorteningResult(sms_record_id, long_url, prefix + short_url))
+        elif error is None:
+            return
+    raise error
+
+
+def claim_custom_slug(slug_reservation_repo: SlugReservationRepo, company_token: str, slug: str) -> int:
+    """
+    Makes the reservation of the slug permanent for the company, before urls are shortened with it
+    :param slug_reservation_repo: the repository for slug reservations
+    :param company_token: the company token (crm_org_id) with which to confirm the validity of the custom token
+    :param slug: the slug that will be added to the urls
+    :return: 200 if the company can use the slug, 400 for empty params, 403 if the slug belongs to another company
+    """
+    # check the prerequisites
+    if company_token == "" or slug == "":
+        # neither can be empty
+        return 400
+
+    if not slug_reservation_repo.reserve(company_token, slug, permanent=True):
+        # the slug is reserved by another company, permanently or until its reservation expires => no access
+        return 403
+    return 200
 
 
 def handle_shorten_url_with_custom_slug(slug_reservation_repo: SlugReservationRepo, url_entry_repo: UrlEntryRepo,
-                                        company_token: str, slug: str, urls_to_shorten: List[Tuple[str, str]]
+                                        company_token: str, slug: str, urls_to_shorten: List[Tuple[str, str]],
+                                        shortener: URLShortener = UUID4BasedURLShortener, idempotent: bool = False,
+                                        expires: Optional[List[Optional[datetime]]] = None
                                         ) -> Tuple[Optional[List[dict]], int]:
     """
     Handles the shortening of the url, adding it to a custom slug; returns the shortened url
@@ -72,34 +182,49 @@ def handle_shorten_url_with_custom_slug(slug_reservation_repo: SlugReservationRe
     :param company_token: the company token (crm_org_id) with which to confirm the validity of the custom token
     :param slug: the slug that will be added to the url
     :param urls_to_shorten: list[original_url, smd_record_id] that will be shortened
+    :param shortener: the generator of the codes
+    :param idempotent: see shorten_urls
+    :param expires: the expiry of each url, see shorten_urls
     :return: the list of shortened urls, with the long url, the shortened url, and the sms_record_id
     """
 
-    # check the prerequisites
-    if company_token == "" or slug == "":
-        # neither can be empty
-        return None, 400
-
-    reservation = slug_reservation_repo.by_id(slug)
-    if reservation is not None:
-        if company_token != reservation.by and (reservation.permanent or reservation.expires > datetime.now()):
-            # the token is not reserved, and has not expired or is permanent => no access
-            return None, 403
-        if company_token != reservation.by and reservation.expires < datetime.now():
-            slug_reservation_repo.change_reservation(reservation, company_token)
-
-    slug_reservation_repo.reserve_permanently(reservation)
-
-    return_list: List[ShorteningResult] = []
+    status = claim_custom_slug(slug_reservation_repo, company_token, slug)
+    if status != 200:
+        return None, status
 
     # the slug is available
-    for long_url, sms_record_id in urls_to_shorten:
-        shorter_url = slug + "/" + shorten_url_collision_check(url_entry_repo, sms_record_id, slug, long_url)
-        return_list.append(ShorteningResult(sms_record_id, long_url, shorter_url))
+    short_urls = shorten_urls(url_entry_repo, slug, [(sms_record_id, long_url)
+                                                     for long_url, sms_record_id in urls_to_shorten],
+                              shortener, idempotent, expires)
+    return_list: List[ShorteningResult] = [
+        ShorteningResult(sms_record_id, long_url, slug + "/" + short_url)
+        for (long_url, sms_record_id), short_url in zip(urls_to_shorten, short_urls)
+    ]
 
     return [asdict(x) for x in return_list], 200
 
 
+def handle_resolve_urls(url_repo: UrlEntryRepo, urls: List[str]) -> List[dict]:
+    """
+    Resolves the shortened urls back to the original urls, without changing their usage stats
+    :param url_repo: the url entry repo
+    :param urls: the shortened urls, as "code" or "slug/code"
+    :return: for each url, in the same order: the original url, used and lastUsed, or None values if not found
+    """
+    keys = [tuple(url.split("/", 1)) if "/" in url else ("", url) for url in urls]
+    found = url_repo.resolve_many(keys)
+    results = []
+    for url, key in zip(urls, keys):
+        row = found.get(key)
+        results.append({
+            "shortened_url": url,
+            "original_url": row.longUrl if row is not None else None,
+            "used": row.used if row is not None else None,
+            "lastUsed": row.lastUsed.isoformat() if row is not None and row.lastUsed is not None else None,
+        })
+    return results
+
+
 def handle_get_slugs_for_company(slug_repo: SlugReservationRepo, companyId: str) -> Union[List[str], int]:
     """
     :param slug_repo: the repository interface for the slug reservations
@@ -108,3 +233,23 @@ def handle_get_slugs_for_company(slug_repo: SlugReservationRepo, companyId: str)
     """
     return slug_repo.by_company_not_expired(companyId)
 
+
+def handle_get_click_stats(rollup_repo: ClickRollupRepo, company_slug: str, code: Optional[str], start: datetime,
+                           end: datetime) -> dict:
+    """
+    :param rollup_repo: the repository of the click rollups
+    :param company_slug: the company slug of the url(s)
+    :param code: the shortened url, None for all the urls of the company slug
+    :param start: the start of the period (included)
+    :param end: the end of the period (excluded)
+    :return: the clicks and previews of each hour of the period with redirects, and their totals
+    """
+    hours = [{"hour": x.hour.isoformat(), "clicks": x.clicks, "previews": x.previews}
+             for x in rollup_repo.hourly(company_slug, code, start, end)]
+    return {
+        "slug": company_slug,
+        "code": code,
+        "clicks": sum(x["clicks"] for x in hours),
+        "previews": sum(x["previews"] for x in hours),
+        "hours": hours,
+    }
@@ -1,22 +1,205 @@
 import json
+import logging
+import os
+import re
+import threading
+import time
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Dict, Tuple, Union
 
 from flask import Flask
 
+from api.cache import LRUCache
 
-def ConfigIgnoredHeaders(flask_app: Flask):
+logger = logging.getLogger("api.ignored_headers")
+
+RULE_TYPES = ("exact", "prefix", "substring", "regex")
+# the memo value of a user agent that matches no rule (None is a cached miss for the LRUCache)
+_NO_RULE = ""
+# a numbered group reference: \1 to \99, but not an octal escape such as \123
+_GROUP_REFERENCE = re.compile(r"\\(?![0-7]{3})([1-9][0-9]?)")
+# the group of a conditional: (?(1)yes|no)
+_GROUP_CONDITION = re.compile(r"\(\?\(([0-9]+)\)")
+
+
+def _shift_group_references(pattern: str, offset: int) -> str:
+    """
+    Renumbers the numbered group references of a regex rule, for the groups before its own in the combined regex
+    of compile_rules. The escapes in a character class are characters, not references.
+    :param offset: the number of groups before the first group of the rule
+    :raises re.error: if a reference goes past \\99, the highest that can be written
+    """
+    shifted, i, in_class = [], 0, False
+    while i < len(pattern):
+        reference = _GROUP_REFERENCE.match(pattern, i) if not in_class else None
+        condition = _GROUP_CONDITION.match(pattern, i) if not in_class else None
+        if reference is not None:
+            number = int(reference.group(1)) + offset
+            if number > 99:
+                raise re.error(f"the group reference {reference.group()} would become \\{number}")
+            # in a group, so that a digit after the reference is not read as part of it
+            shifted.append(f"(?:\\{number})")
+            i = reference.end()
+        elif condition is not None:
+            shifted.append(f"(?({int(condition.group(1)) + offset})")
+            i = condition.end()
+        elif pattern[i] == "\\":
+            shifted.append(pattern[i:i + 2])
+            i += 2
+        elif in_class:
+            in_class = pattern[i] != "]"
+            shifted.append(pattern[i])
+            i += 1
+        elif pattern[i] == "[":
+            # a ] right after [ or [^ is a character of the class
+            start = re.match(r"\[\^?\]?", pattern[i:]).group()
+            shifted.append(start)
+            i += len(start)
+            in_class = True
+        else:
+            shifted.append(pattern[i])
+            i += 1
+    return "".join(shifted)
+
+
+def parse_rules(entries: List[Union[str, dict]]) -> List[Tuple[str, str, str]]:
+    """
+    Validates the entries of the ignored-headers.json file. An entry is either a string, matched exactly, or an
+    object {"type": "exact" | "prefix" | "substring" | "regex", "pattern": str, "name": optional str}.
+    The invalid entries are skipped, with a warning.
+    :return: the (name, type, pattern) of the valid rules
+    """
+    rules = []
+    for entry in entries:
+        if type(entry) is str:
+            entry = {"type": "exact", "pattern": entry}
+        if type(entry) is not dict or entry.get("type") not in RULE_TYPES or type(entry.get("pattern")) is not str:
+            logger.warning(f"Ignoring the preview rule {entry!r}: not a string or a {{type, pattern}} object")
+            continue
+        if entry["type"] == "regex":
+            try:
+                # compiled as it appears in compile_rules, which rejects the global flags such as (?i)
+                if re.compile(f"(?P<r0>{_shift_group_references(entry['pattern'], 1)})").groupindex.keys() != {"r0"}:
+                    raise re.error("named groups are not supported")
+            except re.error as e:
+                logger.warning(f"Ignoring the preview rule {entry!r}: {e}")
+                continue
+        rules.append((str(entry.get("name") or f"{entry['type']}:{entry['pattern']}"), entry["type"], entry["pattern"]))
+    return rules
+
+
+def compile_rules(rules: List[Tuple[str, str, str]]) -> Optional[re.Pattern]:
     """
-    Loads the ignored-headers.json file into the config values of the application
+    Compiles the rules into a single regex, with one named group per rule, so that a user agent is matched
+    against all of them in one search. The name of the matched group is "r<index of the rule>". The numbered group
+    references of the regex rules are renumbered for their position in the regex.
+    :return: the regex, None if there are no rules
+    :raises re.error: if the regex cannot be compiled, the rules are then rejected
     """
+    alternatives = []
+    groups = 0
+    for index, (_, rule_type, pattern) in enumerate(rules):
+        # the named group of the rule
+        groups += 1
+        if rule_type == "exact":
+            pattern = r"\A" + re.escape(pattern) + r"\Z"
+        elif rule_type == "prefix":
+            pattern = r"\A" + re.escape(pattern)
+        elif rule_type == "substring":
+            pattern = re.escape(pattern)
+        else:
+            own_groups = re.compile(pattern).groups
+            pattern = _shift_group_references(pattern, groups)
+            groups += own_groups
+        alternatives.append(f"(?P<r{index}>{pattern})")
+    return re.compile("|".join(alternatives)) if alternatives else None
 
-    ignored_headers_file = Path(flask_app.instance_path).parent / "ignored-headers.json"
 
-    if ignored_headers_file.exists():
-        with ignored_headers_file.open("r") as f:
-            headers_list: List[str] = json.load(f)
-            # to ensure data safety, ignore all the non-string entries
-            filter(lambda x: type(x) is str, headers_list)
-            flask_app.config["PREVIEW_IGNORED_HEADERS"] = set(headers_list)
-    else:
-        flask_app.logger.warning("Could not find the ignored-headers.json file. No headers will be ignored")
+class PreviewClassifier:
+    """
+    Recognizes the user agents of the link preview bots, whose requests are redirected but not counted in the
+    stats. The rules are read from the ignored-headers.json file (see parse_rules), and read again on the first
+    request after check_interval seconds if the file changed. The results are memoized per user agent.
+    """
+    path: Path
+    check_interval: float
+    rule_hits: Dict[str, int]
+
+    def __init__(self, path: Path, cache_size: int = 10000, check_interval: float = 5):
+        self.path = path
+        self.check_interval = check_interval
+        # per rule name, kept across reloads
+        self.rule_hits = {}
+        self._memo = LRUCache(cache_size)
+        self._rules: List[Tuple[str, str, str]] = []
+        self._regex: Optional[re.Pattern] = None
+        self._modified: Optional[Tuple[int, int]] = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+        self._reload_if_changed()
+
+    @property
+    def rules(self) -> List[Tuple[str, str, str]]:
+        return self._rules
+
+    def _reload_if_changed(self):
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+                modified = (stat.st_ino, stat.st_mtime_ns)
+            except FileNotFoundError:
+                modified = None
+            if modified == self._modified:
+                return
+            try:
+                if modified is None:
+                    logger.warning(f"Could not find {self.path}. No headers will be ignored")
+                    rules = []
+                else:
+                    with open(self.path, "r") as f:
+                        rules = parse_rules(json.load(f))
+                regex = compile_rules(rules)
+            except (OSError, ValueError, re.error):
+                # keep the previous rules until the file is fixed
+                logger.exception(f"Could not load the preview rules from {self.path}")
+                return
+            self._rules, self._regex, self._modified = rules, regex, modified
+            self._memo.clear()
+
+    def match(self, user_agent: Optional[str]) -> Optional[str]:
+        """
+        :return: the name of the rule matching the user agent, None if it is not a preview bot
+        """
+        if user_agent is None:
+            return None
+        self._reload_if_changed()
+        found, rule = self._memo.get(user_agent)
+        if not found:
+            rules, regex = self._rules, self._regex
+            matched = regex.search(user_agent) if regex is not None else None
+            rule = rules[int(matched.lastgroup[1:])][0] if matched is not None else _NO_RULE
+            self._memo.put(user_agent, rule)
+        if rule == _NO_RULE:
+            return None
+        with self._lock:
+            self.rule_hits[rule] = self.rule_hits.get(rule, 0) + 1
+        return rule
+
+    def is_preview(self, user_agent: Optional[str]) -> bool:
+        return self.match(user_agent) is not None
+
+
+def ConfigIgnoredHeaders(flask_app: Flask) -> PreviewClassifier:
+    """
+    Loads the ignored-headers.json file into the PREVIEW_CLASSIFIER config value of the application
+    """
+    classifier = PreviewClassifier(Path(flask_app.instance_path).parent / "ignored-headers.json",
+                                   flask_app.config["PreviewRulesCacheSize"],
+                                   flask_app.config["PreviewRulesCheckIntervalInSeconds"])
+    flask_app.config["PREVIEW_CLASSIFIER"] = classifier
+    return classifier
@@ -0,0 +1,45 @@
+from typing import Any
+
+from flask import Flask, Response
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    # optional: pip install orjson
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Encodes and decodes the requests and the responses (request.json, jsonify) with orjson when it is installed,
+    and with the json module of the standard library otherwise. The keys are sorted as by the default provider,
+    the datetimes are still formatted by default(), and the non-ASCII characters are written as UTF-8 instead of
+    being escaped. The calls with custom json arguments (indent...) use the standard library.
+    """
+
+    def __init__(self, app: Flask):
+        super().__init__(app)
+        if orjson is not None:
+            self._options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def _orjson_options(self) -> int:
+        return self._options | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode()
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            # pretty printed
+            return super().response(*args, **kwargs)
+        body = orjson.dumps(self._prepare_response_obj(args, kwargs), default=self.default,
+                            option=self._orjson_options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,172 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from api.json_provider import orjson
+from api.metrics import LOG_RECORDS_DROPPED
+
+# the attributes of every LogRecord, the others were passed with extra= and are written as fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+TEXT_FORMAT = "[%(asctime)s] %(levelname)s in %(module)s: %(message)s"
+
+
+def parse_sample_rates(value: str) -> Dict[int, float]:
+    """
+    :param value: the fraction of the records kept per level, as in "INFO=0.1,DEBUG=0"
+    :return: the fraction per level number
+    """
+    rates = {}
+    for item in filter(None, (x.strip() for x in value.split(","))):
+        level, rate = item.split("=")
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    for level in rates:
+        if type(level) is not int:
+            raise ValueError(f"Unknown log level in {value!r}")
+    return rates
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats a record as a single json line: time, level, logger, module, message, the fields passed with extra=,
+    and the traceback of the exceptions
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = "".join(traceback.format_exception(*record.exc_info))
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if orjson is not None:
+            return orjson.dumps(entry, default=str).decode()
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a random fraction of the records of the sampled levels, the records of the other levels are all kept
+    """
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno)
+        if rate is None or rate >= 1 or random.random() < rate:
+            return True
+        LOG_RECORDS_DROPPED.inc(level=record.levelname, reason="sampled")
+        return False
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Hands the records to a background thread through a queue of at most max_size records, so that the request
+    threads never wait for the formatting and the writes. When the queue is full, the record is dropped and counted.
+    The writer thread is started in the process that logs, so that the forked workers start their own.
+    """
+    listener: QueueListener
+    max_size: int
+
+    def __init__(self, target: logging.Handler, max_size: int):
+        # SimpleQueue is implemented in C, and its size is checked before each put instead of under a lock: a few
+        # records over max_size can be queued by concurrent threads
+        super().__init__(queue.SimpleQueue())
+        self.target = target
+        self.max_size = max_size
+        self.listener = QueueListener(self.queue, target, respect_handler_level=True)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # the thread of the parent process does not exist in a forked child
+                self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+                self.listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only merges the arguments, which may change after the call, the formatting is done by the writer thread.
+        # The other handlers get the same record, merging the arguments does not change their output
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            # the traceback holds the frames of the request, format it now, in a copy that the other handlers do
+            # not see
+            record = copy.copy(record)
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        self._ensure_started()
+        if self.queue.qsize() >= self.max_size:
+            LOG_RECORDS_DROPPED.inc(level=record.levelname, reason="queue_full")
+            return
+        self.queue.put_nowait(record)
+
+    def stop(self):
+        """
+        Writes the records still in the queue, and stops the writer thread
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                self.listener.stop()
+                self._pid = None
+
+
+_handler: Optional[BoundedQueueHandler] = None
+
+
+def install_log_queue(max_size: int = 10000, sample_rates: Optional[Dict[int, float]] = None,
+                      json_format: bool = True, stream=None) -> BoundedQueueHandler:
+    """
+    Adds a BoundedQueueHandler to the root logger, whose thread writes to stream (stderr by default). The loggers
+    of the application propagate to it, and Flask does not add its own handler. Installing it again replaces the
+    previous one.
+    :param max_size: the number of records that can wait in the queue, the next ones are dropped
+    :param sample_rates: the fraction of the records kept, per level (see parse_sample_rates)
+    :param json_format: whether the records are written as json lines, or in the format of Flask
+    """
+    global _handler
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+        _handler.stop()
+
+    target = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    target.setFormatter(JSONFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+    _handler = BoundedQueueHandler(target, max_size)
+    if sample_rates:
+        _handler.addFilter(SamplingFilter(sample_rates))
+    root.addHandler(_handler)
+    return _handler
+
+
+@atexit.register
+def _flush_log_queue():
+    if _handler is not None:
+        _handler.stop()
@@ -0,0 +1,234 @@
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Tuple, Dict, List, Callable, Optional, Union
+
+from flask import Flask, g, request, Response, has_request_context
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+LabelValues = Tuple[str, ...]
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f"{name}=\"{_escape(str(value))}\"" for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(ABC):
+    """
+    A metric in the Prometheus text format, with an optional fixed list of label names
+    """
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(labels[x] for x in self.labels)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """
+        :return: the sample lines of the metric, in the Prometheus text format
+        """
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}",
+                          *self.samples()])
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in values]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # per label values: [count per bucket (the last one is +Inf)], sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def samples(self) -> List[str]:
+        samples = []
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "le=\"+Inf\"" if bound == float("inf") else f"le=\"{bound!r}\""
+                samples.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            samples.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            samples.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return samples
+
+
+class GaugeFunction(Metric):
+    """
+    Gauge read from a function when the metrics are rendered. The function returns the value, or a dict of
+    label values -> value for a labelled gauge.
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], Union[float, Dict[LabelValues, float]]],
+                 labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def samples(self) -> List[str]:
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in values.items()]
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        # re-registering replaces the metric, so that a new application can register its own gauges
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(x.render() for x in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Time spent processing a request, per route", ("route", "method")))
+REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "Number of requests, per route and status code", ("route", "method", "status")))
+DB_TIME = REGISTRY.register(Histogram(
+    "db_time_per_request_seconds", "Time spent in SQLAlchemy statements during a request, per route", ("route",)))
+DB_STATEMENTS = REGISTRY.register(Counter(
+    "db_statements_total", "Number of SQL statements, per route", ("route",)))
+POOL_CHECKOUT_WAIT = REGISTRY.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a connection from the pool"))
+COLLISION_RETRIES = REGISTRY.register(Counter(
+    "shorten_collision_retries_total", "Number of codes regenerated because they were already in use"))
+REDIRECTS = REGISTRY.register(Counter(
+    "redirects_total", "Number of redirects served, counted in the stats or ignored as previews", ("kind",)))
+
+LOG_RECORDS_DROPPED = REGISTRY.register(Counter(
+    "log_records_dropped_total", "Number of log records not written, sampled out or dropped with the queue full",
+    ("level", "reason")))
+RESERVATIONS_SWEPT = REGISTRY.register(Histogram(
+    "reservation_sweep_deleted_rows", "Number of expired slug reservations deleted per sweep",
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000)))
+EXPIRED_URLS_PURGED = REGISTRY.register(Histogram(
+    "expired_url_purge_deleted_rows", "Number of expired urls deleted per purge",
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000)))
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records the time spent waiting for a connection in POOL_CHECKOUT_WAIT
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+def _route() -> str:
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"]
+    if has_request_context() and "db_time" in g:
+        g.db_time += elapsed
+        g.db_statements += 1
+
+
+def register_metrics(flask_app: Flask, db: Optional[SQLAlchemy] = None):
+    """
+    Instruments the application (request latency and database time per route, pool checkout wait), read from
+    REGISTRY by the /metrics route. The metrics are kept per process: with several gunicorn workers, each scrape
+    reads the worker that answers it.
+    """
+    if db is not None and not flask_app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        # read by Flask-SQLAlchemy when it creates the engine, on the first query
+        flask_app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})["poolclass"] = TimedQueuePool
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+    @flask_app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.db_time = 0.0
+        g.db_statements = 0
+
+    def record(status: int):
+        # popped, so that a request is recorded once
+        start = g.pop("request_start")
+        route = _route()
+        REQUEST_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method)
+        REQUESTS.inc(route=route, method=request.method, status=str(status))
+        DB_TIME.observe(g.db_time, route=route)
+        DB_STATEMENTS.inc(g.db_statements, route=route)
+
+    @flask_app.after_request
+    def record_request_metrics(response: Response) -> Response:
+        if "request_start" in g:
+            record(response.status_code)
+        return response
+
+    @flask_app.teardown_request
+    def record_failed_request_metrics(exception: Optional[BaseException]):
+        # an exception propagated to the WSGI server (PROPAGATE_EXCEPTIONS, debug mode) skips the after_request
+        # hooks; the server answers 500
+        if exception is not None and "request_start" in g:
+            record(500)
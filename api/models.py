@@ -1,3 +1,4 @@
+import hashlib
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -8,13 +9,32 @@ db = SQLAlchemy()
 
 
 class UrlEntryModel(db.Model):
+    __table_args__ = (
+        # the short urls are unique across the company slugs, the collision check looks them up by id alone. The
+        # uniqueness is enforced here: the code filter of a worker does not know the codes of the other workers
+        db.Index("ix_url_entry_model_id", "id", unique=True),
+        # the rows that still have to be exported
+        db.Index("ix_url_entry_model_unsynced", "companySlug", "id",
+                 postgresql_where=db.text("synced IS NOT TRUE"), sqlite_where=db.text("synced IS NOT TRUE")),
+        # UrlEntryRepo.existing_codes, for the idempotent shortening
+        db.Index("ix_url_entry_model_record_id", "recordId"),
+        # the entries that expire, in the order in which they expire
+        db.Index("ix_url_entry_model_expires_at", "expiresAt",
+                 postgresql_where=db.text('"expiresAt" IS NOT NULL'), sqlite_where=db.text('"expiresAt" IS NOT NULL')),
+    )
+
     companySlug = db.Column(db.String, primary_key=True)
     id = db.Column(db.String, primary_key=True)  # Same as the url
     recordId = db.Column(db.String)
+    # set on the rows created before the long urls were deduplicated, see longUrlHash
     longUrl = db.Column(db.String)
+    # LongUrl.hash of the long url, which is stored once for all the entries
+    longUrlHash = db.Column(db.LargeBinary)
     used = db.Column(db.BIGINT)
     lastUsed = db.Column(db.TIMESTAMP)
     synced = db.Column(db.Boolean)
+    # the redirects answer 410 from this time on, and flask purge-expired deletes the entry; NULL never expires
+    expiresAt = db.Column(db.TIMESTAMP, nullable=True)
 
     def __init__(self, companySlug: str, oId: str, recordId: str, url: str, used: int, lastUsed: datetime):
         self.companySlug = companySlug if companySlug is not None else ""
@@ -29,6 +49,23 @@ class UrlEntryModel(db.Model):
         return f"<{self.companySlug}/{self.id}/{self.longUrl}/{self.used}/{self.lastUsed}>"
 
 
+class LongUrl(db.Model):
+    """
+    The long urls, stored once however many entries point to them
+    hash: the sha256 of the url, see long_url_hash
+    url: the long url
+    """
+    hash = db.Column(db.LargeBinary, primary_key=True)
+    url = db.Column(db.String, nullable=False)
+
+    def __repr__(self):
+        return f"<LongUrl {self.url}>"
+
+
+def long_url_hash(url: str) -> bytes:
+    return hashlib.sha256(url.encode()).digest()
+
+
 class SlugReservation(db.Model):
     """
     Slug Reservation:
@@ -43,6 +80,17 @@ class SlugReservation(db.Model):
     expires: if the reservation is permanent, it will never expire (null), else the deadline
         after which the company loses the reservation
     """
+    __table_args__ = (
+        # SlugReservationRepo.by_company_not_expired
+        db.Index("ix_slug_reservation_by", "by", "permanent", "expires"),
+        # the rows that still have to be exported
+        db.Index("ix_slug_reservation_unsynced", "slug",
+                 postgresql_where=db.text("synced IS NOT TRUE"), sqlite_where=db.text("synced IS NOT TRUE")),
+        # the temporary reservations, in the order in which they expire
+        db.Index("ix_slug_reservation_expires", "expires",
+                 postgresql_where=db.text("permanent IS NOT TRUE"), sqlite_where=db.text("permanent IS NOT TRUE")),
+    )
+
     slug = db.Column(db.String, primary_key=True)
     by = db.Column(db.String, nullable=False)
     permanent = db.Column(db.Boolean)
@@ -60,6 +108,7 @@ class SlugReservation(db.Model):
         self.created = created if created is not None else datetime.now()
         reservation_duration = app.config["ReservationDuration"] if app is not None else 900
         self.expires = (self.created + timedelta(seconds=reservation_duration)) if expires is None else expires
+        self.synced = False
 
     def __repr__(self):
         return f"<SlugReservation \"{self.slug}\" by \"{self.by}\">"
@@ -67,3 +116,110 @@ class SlugReservation(db.Model):
     def refresh(self, app: Optional[Flask] = None):
         reservation_duration = app.config["ReservationDuration"] if app is not None else 900
         self.expires = datetime.now() + timedelta(seconds=reservation_duration)
+        self.synced = False
+
+
+class CodeCounter(db.Model):
+    """
+    Counter from which the workers lease ranges of values for the BlockLeasedURLShortener
+    name: the name of the counter
+    value: the first value that has not been leased yet
+    """
+    name = db.Column(db.String, primary_key=True)
+    value = db.Column(db.BIGINT, nullable=False)
+
+    def __repr__(self):
+        return f"<CodeCounter \"{self.name}\" at {self.value}>"
+
+
+class ClickEvent(db.Model):
+    """
+    Append-only log of the redirects, written in batches by the ClickEventLog
+    id: the order in which the events were written, the rollups are computed up to an id
+    at: the time of the redirect
+    companySlug, code: the url that was followed
+    preview: whether the request came from an ignored preview header (not counted in used)
+    """
+    # sqlite only autoincrements an INTEGER primary key
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True, autoincrement=True)
+    at = db.Column(db.TIMESTAMP, nullable=False)
+    companySlug = db.Column(db.String, nullable=False)
+    code = db.Column(db.String, nullable=False)
+    preview = db.Column(db.Boolean, nullable=False)
+
+
+class ClickRollupCode(db.Model):
+    """
+    Number of redirects per url and hour, aggregated from the ClickEvent log
+    """
+    companySlug = db.Column(db.String, primary_key=True)
+    code = db.Column(db.String, primary_key=True)
+    hour = db.Column(db.TIMESTAMP, primary_key=True)
+    clicks = db.Column(db.BIGINT, nullable=False)
+    previews = db.Column(db.BIGINT, nullable=False)
+
+
+class ClickRollupCompany(db.Model):
+    """
+    Number of redirects per company slug and hour, aggregated from the ClickEvent log
+    """
+    companySlug = db.Column(db.String, primary_key=True)
+    hour = db.Column(db.TIMESTAMP, primary_key=True)
+    clicks = db.Column(db.BIGINT, nullable=False)
+    previews = db.Column(db.BIGINT, nullable=False)
+
+
+class RollupState(db.Model):
+    """
+    Progress of a rollup job
+    name: the name of the job
+    lastEventId: the id of the last event included in the rollups
+    """
+    name = db.Column(db.String, primary_key=True)
+    lastEventId = db.Column(db.BIGINT, nullable=False)
+
+
+class ArchiveSegment(db.Model):
+    """
+    A batch of url entries moved out of url_entry_model by flask archive-entries, compressed together
+    id: referenced by the ArchiveIndex rows of its entries
+    month: the first day of the month in which its entries were last used, the segments are partitioned by it
+    created: the time when the segment was written
+    count: the number of entries in the segment
+    data: the entries, see api.archive.encode_segment
+    """
+    __table_args__ = (
+        db.Index("ix_archive_segment_month", "month"),
+    )
+
+    # sqlite only autoincrements an INTEGER primary key
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True, autoincrement=True)
+    month = db.Column(db.TIMESTAMP, nullable=False)
+    created = db.Column(db.TIMESTAMP, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+class ArchiveIndex(db.Model):
+    """
+    The segment of each archived entry. An entry that is used again is moved back to url_entry_model, and its row
+    is deleted from the index: its copy in the segment is then ignored.
+    """
+    __table_args__ = (
+        # looked up by id alone, like ix_url_entry_model_id: an id is either in url_entry_model or here
+        db.Index("ix_archive_index_id", "id"),
+    )
+
+    companySlug = db.Column(db.String, primary_key=True)
+    id = db.Column(db.String, primary_key=True)
+    segmentId = db.Column(db.BIGINT, nullable=False)
+
+
+class ReplicaHeartbeat(db.Model):
+    """
+    Written on the primary every ReplicaHeartbeatIntervalInSeconds, and read on the replicas to measure their lag
+    name: "primary"
+    at: the time of the last heartbeat
+    """
+    name = db.Column(db.String, primary_key=True)
+    at = db.Column(db.TIMESTAMP, nullable=False)
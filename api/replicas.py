@@ -0,0 +1,214 @@
+import itertools
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from flask import Flask
+from sqlalchemy import select, create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from api.models import ReplicaHeartbeat
+
+# the name of the heartbeat row written on the primary
+HEARTBEAT_NAME = "primary"
+
+
+def write_heartbeat(engine: Engine, now: Optional[datetime] = None):
+    """
+    Sets the time of the heartbeat row on the primary, which the replicas receive with the rest of its changes
+    """
+    table = ReplicaHeartbeat.__table__
+    now = now if now is not None else datetime.now()
+    for _ in range(2):
+        try:
+            with engine.begin() as connection:
+                if connection.execute(table.update().where(table.c.name == HEARTBEAT_NAME).values(at=now)).rowcount:
+                    return
+                connection.execute(table.insert().values(name=HEARTBEAT_NAME, at=now))
+                return
+        except IntegrityError:
+            # another worker created the row at the same time, the update will find it now
+            continue
+
+
+class ReplicaSet:
+    """
+    The read replicas of the database, used in turn by the read-only lookups. The lag of a replica is the age of the
+    heartbeat row it has received from the primary (see HeartbeatWriter), read again at most every check_interval
+    seconds; a replica lagging by more than max_lag seconds, or that cannot be reached, is skipped until its next
+    check. Without a fresh replica, the lookups read the primary.
+    """
+    engines: List[Engine]
+    max_lag: float
+    check_interval: float
+
+    def __init__(self, engines: List[Engine], max_lag: float, check_interval: float = 1):
+        self.engines = engines
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lags = [float("inf")] * len(engines)
+        self._checked_at = [float("-inf")] * len(engines)
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_urls(cls, urls: List[str], engine_options: dict, max_lag: float,
+                  check_interval: float = 1) -> "ReplicaSet":
+        """
+        :param engine_options: the create_engine options of the replicas, except the sqlite ones
+        """
+        return cls([create_engine(url, **({} if url.startswith("sqlite") else engine_options)) for url in urls],
+                   max_lag, check_interval)
+
+    def _check(self, index: int):
+        if time.monotonic() - self._checked_at[index] < self.check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at[index] < self.check_interval:
+                return
+            self._checked_at[index] = time.monotonic()
+            table = ReplicaHeartbeat.__table__
+            try:
+                with self.engines[index].connect() as connection:
+                    at = connection.execute(select(table.c.at).where(table.c.name == HEARTBEAT_NAME)).scalar()
+            except SQLAlchemyError:
+                at = None
+            self._lags[index] = (datetime.now() - at).total_seconds() if at is not None else float("inf")
+
+    def engine(self) -> Optional[Engine]:
+        """
+        :return: the next replica whose lag is within max_lag, None if there is none
+        """
+        start = next(self._next)
+        for offset in range(len(self.engines)):
+            index = (start + offset) % len(self.engines)
+            self._check(index)
+            if self._lags[index] <= self.max_lag:
+                return self.engines[index]
+        return None
+
+    def failed(self, engine: Engine):
+        """
+        Skips a replica that failed a query, until its next check
+        """
+        index = self.engines.index(engine)
+        with self._lock:
+            self._lags[index] = float("inf")
+            self._checked_at[index] = time.monotonic()
+
+    def lags(self) -> Dict[str, float]:
+        """
+        :return: the last measured lag of each replica, by its index in DATABASE_REPLICA_URLS
+        """
+        return {str(index): lag for index, lag in enumerate(self._lags)}
+
+
+class AsyncReplicaSet:
+    """
+    asyncio counterpart of ReplicaSet, for the ASGI redirect server: the heartbeats are read on the async engines of
+    the replicas, from the event loop. The heartbeat is written by the workers of the WSGI application.
+    """
+    engines: List[AsyncEngine]
+    max_lag: float
+    check_interval: float
+
+    def __init__(self, engines: List[AsyncEngine], max_lag: float, check_interval: float = 1):
+        self.engines = engines
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lags = [float("inf")] * len(engines)
+        self._checked_at = [float("-inf")] * len(engines)
+        self._next = itertools.count()
+
+    @classmethod
+    def from_urls(cls, urls: List[str], engine_options: dict, max_lag: float,
+                  check_interval: float = 1) -> "AsyncReplicaSet":
+        """
+        :param engine_options: the create_async_engine options of the replicas, except the sqlite ones
+        """
+        return cls([create_async_engine(url, **({} if url.startswith("sqlite") else engine_options)) for url in urls],
+                   max_lag, check_interval)
+
+    async def _check(self, index: int):
+        if time.monotonic() - self._checked_at[index] < self.check_interval:
+            return
+        # set before the query, so that the coroutines that run meanwhile do not check it again
+        self._checked_at[index] = time.monotonic()
+        table = ReplicaHeartbeat.__table__
+        try:
+            async with self.engines[index].connect() as connection:
+                at = (await connection.execute(select(table.c.at).where(table.c.name == HEARTBEAT_NAME))).scalar()
+        except SQLAlchemyError:
+            at = None
+        self._lags[index] = (datetime.now() - at).total_seconds() if at is not None else float("inf")
+
+    async def engine(self) -> Optional[AsyncEngine]:
+        """
+        Same as ReplicaSet.engine
+        """
+        start = next(self._next)
+        for offset in range(len(self.engines)):
+            index = (start + offset) % len(self.engines)
+            await self._check(index)
+            if self._lags[index] <= self.max_lag:
+                return self.engines[index]
+        return None
+
+    def failed(self, engine: AsyncEngine):
+        """
+        Same as ReplicaSet.failed
+        """
+        index = self.engines.index(engine)
+        self._lags[index] = float("inf")
+        self._checked_at[index] = time.monotonic()
+
+    async def dispose(self):
+        for engine in self.engines:
+            await engine.dispose()
+
+
+class HeartbeatWriter:
+    """
+    Writes the heartbeat on the primary every interval seconds, in a daemon thread of each worker, so that the
+    replicas can tell how far behind they are
+    """
+    app: Flask
+    primary: Callable[[], Engine]
+    interval: float
+
+    def __init__(self, app: Flask, primary: Callable[[], Engine], interval: float):
+        self.app = app
+        self.primary = primary
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_started(self):
+        # started by the first request, so that processes that never serve one (flask db ..., pre-fork masters)
+        # do not spawn the thread
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    write_heartbeat(self.primary())
+            except Exception:
+                self.app.logger.exception("Failed to write the replica heartbeat")
+            time.sleep(self.interval)
+
+
+def register_heartbeat(flask_app: Flask, primary: Callable[[], Engine]):
+    """
+    Starts the HeartbeatWriter of each worker, every ReplicaHeartbeatIntervalInSeconds
+    """
+    writer = HeartbeatWriter(flask_app, primary, flask_app.config["ReplicaHeartbeatIntervalInSeconds"])
+    flask_app.before_request(writer.ensure_started)
@@ -1,18 +1,169 @@
+import asyncio
+import logging
 import os
-from datetime import datetime
-from typing import Optional, List
+import re
+import threading
+from datetime import datetime, timedelta
+from itertools import repeat
+from typing import Optional, List, Set, Tuple, Dict, Iterator
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select, text, tuple_, bindparam, and_, or_, func, Table, case
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
 
-from api.models import UrlEntryModel, SlugReservation
+from api.archive import ArchivedCodes, ArchivedEntry, decode_segment, encode_segment, segment_month
+from api.bloom import BloomFilter
+from api.cache import LRUCache
+from api.clicks import ClickCounter, ClickEventLog, AsyncClickEventLog, AsyncClickCounter
+from api.errors import LinkExpired
+from api.models import UrlEntryModel, SlugReservation, CodeCounter, LongUrl, long_url_hash, ClickEvent, \
+    ClickRollupCode, ClickRollupCompany, RollupState, ArchiveSegment, ArchiveIndex
+from api.replicas import ReplicaSet, AsyncReplicaSet
+from api.snapshot import RedirectSnapshot
 
+# maximum number of values in a single IN (...) clause
+_IN_CHUNK_SIZE = 500
+# written exactly as the predicate of the partial indexes, so that they are used
+_UNSYNCED = text("synced IS NOT TRUE")
+_TEMPORARY = text("permanent IS NOT TRUE")
+_EXPORTED_URL_ENTRY_COLUMNS = ["companySlug", "id", "recordId", "longUrl", "used", "lastUsed"]
+# the long url of an entry: stored in the entry itself by the rows created before the deduplication, in long_url
+# for the others
+_WITH_LONG_URL = UrlEntryModel.__table__.outerjoin(
+    LongUrl.__table__, LongUrl.__table__.c.hash == UrlEntryModel.__table__.c.longUrlHash)
+_LONG_URL = func.coalesce(UrlEntryModel.__table__.c.longUrl, LongUrl.__table__.c.url).label("longUrl")
+# the redirect lookup of an entry
+_LOOKUP = select(_LONG_URL, UrlEntryModel.__table__.c.expiresAt).select_from(_WITH_LONG_URL).where(
+    UrlEntryModel.__table__.c.companySlug == bindparam("company_slug"),
+    UrlEntryModel.__table__.c.id == bindparam("short_url"))
+_EXPORTED_SLUG_RESERVATION_COLUMNS = ["slug", "by", "permanent", "created", "expires"]
+# the segment of an archived entry
+_ARCHIVED_SEGMENT = select(ArchiveSegment.__table__.c.data).select_from(ArchiveIndex.__table__.join(
+    ArchiveSegment.__table__, ArchiveSegment.__table__.c.id == ArchiveIndex.__table__.c.segmentId)).where(
+    ArchiveIndex.__table__.c.companySlug == bindparam("company_slug"),
+    ArchiveIndex.__table__.c.id == bindparam("short_url"))
+# the next segments loaded in the archived codes
+_SEGMENTS_AFTER = select(ArchiveSegment.__table__.c.id, ArchiveSegment.__table__.c.data).where(
+    ArchiveSegment.__table__.c.id > bindparam("after")).order_by(ArchiveSegment.__table__.c.id).limit(100)
 
-def config_app_with_db(flask_app: Flask, db: SQLAlchemy):
-    url = os.environ["DATABASE_URL"]
+
+def database_url(asyncio: bool = False) -> str:
+    """
+    :param asyncio: whether to select the asyncio driver of the database (asyncpg, aiosqlite)
+    :return: the SQLAlchemy url of the database from the DATABASE_URL environment variable
+    """
+    return _sqlalchemy_url(os.environ["DATABASE_URL"], asyncio)
+
+
+def replica_urls(asyncio: bool = False) -> List[str]:
+    """
+    :param asyncio: see database_url
+    :return: the SQLAlchemy urls of the read replicas, from the comma separated DATABASE_REPLICA_URLS environment
+        variable
+    """
+    return [_sqlalchemy_url(x.strip(), asyncio) for x in os.environ.get("DATABASE_REPLICA_URLS", "").split(",")
+            if x.strip()]
+
+
+def _sqlalchemy_url(url: str, asyncio: bool = False) -> str:
     if url.startswith("postgres://"):
         url = url.replace("postgres://", "postgresql://", 1)
-    flask_app.config["SQLALCHEMY_DATABASE_URI"] = url
+    if asyncio:
+        url = re.sub(r"^postgresql(\+\w+)?://", "postgresql+asyncpg://", url)
+        url = re.sub(r"^sqlite(\+\w+)?://", "sqlite+aiosqlite://", url)
+    return url
+
+
+def insert_ignore(dialect_name: str, table: Table):
+    """
+    :return: an INSERT of the table that skips the rows whose primary key is already present
+    """
+    if dialect_name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect_name == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return table.insert().prefix_with("IGNORE")
+
+
+def _cache_entry(long_url: Optional[str], expires_at: Optional[datetime]):
+    """
+    :return: the value cached for an entry: its long url, with its expiry if it expires
+    """
+    return (long_url, expires_at) if long_url is not None and expires_at is not None else long_url
+
+
+def _cached_entry(cache: Optional[LRUCache], key: Tuple[str, str]) -> Tuple[bool, Optional[str], Optional[datetime]]:
+    """
+    :return: whether the entry is cached, its long url (None for a cached miss) and its expiry. An entry that has
+        expired is dropped and reported as not cached: once it is purged, its code can be issued again for another
+        url, so it is read again from the database
+    """
+    if cache is None:
+        return False, None, None
+    found, long_url = cache.get(key)
+    long_url, expires_at = long_url if type(long_url) is tuple else (long_url, None)
+    if expires_at is not None and expires_at <= datetime.now():
+        cache.invalidate(key)
+        return False, None, None
+    return found, long_url, expires_at
+
+
+def _check_expiry(short_url: str, expires_at: Optional[datetime]):
+    if expires_at is not None and expires_at <= datetime.now():
+        raise LinkExpired(short_url)
+
+
+def unarchive_statements(dialect_name: str, entry: ArchivedEntry) -> List[Tuple[object, dict]]:
+    """
+    :return: the (statement, parameters) that move an archived entry back to url_entry_model, to be executed in one
+        transaction. The entry may have been moved back by another worker in the meantime.
+    """
+    url_hash = long_url_hash(entry.longUrl)
+    index = ArchiveIndex.__table__
+    return [
+        (insert_ignore(dialect_name, LongUrl.__table__), {"hash": url_hash, "url": entry.longUrl}),
+        (insert_ignore(dialect_name, UrlEntryModel.__table__),
+         {"companySlug": entry.companySlug, "id": entry.id, "recordId": entry.recordId, "longUrlHash": url_hash,
+          "used": entry.used, "lastUsed": entry.lastUsed, "synced": entry.synced}),
+        (index.delete().where(index.c.companySlug == entry.companySlug, index.c.id == entry.id), {}),
+    ]
+
+
+def unarchive_many(connection, keys: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    Moves the archived entries among keys back to url_entry_model, in the transaction of the connection, with one
+    query per chunk of _IN_CHUNK_SIZE urls
+    :param keys: the (companySlug, id) of the entries, archived or not
+    :return: the (companySlug, id) of the entries moved back
+    """
+    index, segments = ArchiveIndex.__table__, ArchiveSegment.__table__
+    wanted = set(keys)
+    short_urls = list({x[1] for x in wanted})
+    moved = []
+    for start in range(0, len(short_urls), _IN_CHUNK_SIZE):
+        chunk = short_urls[start:start + _IN_CHUNK_SIZE]
+        rows = connection.execute(select(index.c.companySlug, index.c.id, index.c.segmentId, segments.c.data)
+                                  .select_from(index.join(segments, segments.c.id == index.c.segmentId))
+                                  .where(index.c.id.in_(chunk))).all()
+        decoded: Dict[int, Dict[Tuple[str, str], ArchivedEntry]] = {}
+        for row in rows:
+            key = (row.companySlug, row.id)
+            if key not in wanted:
+                continue
+            if row.segmentId not in decoded:
+                decoded[row.segmentId] = decode_segment(row.data)
+            for statement, parameters in unarchive_statements(connection.dialect.name, decoded[row.segmentId][key]):
+                connection.execute(statement, parameters)
+            moved.append(key)
+    return moved
+
+
+def config_app_with_db(flask_app: Flask, db: SQLAlchemy):
+    flask_app.config["SQLALCHEMY_DATABASE_URI"] = database_url()
     flask_app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.init_app(flask_app)
 
@@ -20,93 +171,821 @@ def config_app_with_db(flask_app: Flask, db: SQLAlchemy):
 class Repo:
     db: SQLAlchemy
     app: Flask
+    replicas: Optional[ReplicaSet]
 
-    def __init__(self, app: Flask, db: SQLAlchemy):
+    def __init__(self, app: Flask, db: SQLAlchemy, replicas: Optional[ReplicaSet] = None):
+        """
+        :param replicas: if set, the read-only lookups that tolerate the lag of the replicas are read from them
+        """
         self.db = db
         self.app = app
+        self.replicas = replicas
+
+    def _dialect_name(self) -> str:
+        return self.db.get_engine(self.app).dialect.name
+
+    def _read_replica(self, statement, parameters: Optional[dict] = None) -> Optional[List[Row]]:
+        """
+        Runs a read-only statement on the next replica within the lag guard
+        :return: the rows, None if there is no such replica (or it failed), for the caller to read the primary
+        """
+        engine = self.replicas.engine() if self.replicas is not None else None
+        if engine is None:
+            return None
+        try:
+            with engine.connect() as connection:
+                return connection.execute(statement, parameters or {}).all()
+        except OperationalError:
+            self.app.logger.warning("Failed to read a replica, reading the primary", exc_info=True)
+            self.replicas.failed(engine)
+            return None
 
 
 class UrlEntryRepo(Repo):
+    click_counter: Optional[ClickCounter]
+    cache: Optional[LRUCache]
+    code_filter: Optional[BloomFilter]
+    snapshot: Optional[RedirectSnapshot]
+    click_log: Optional[ClickEventLog]
+    archived_codes: Optional[ArchivedCodes]
+
+    def __init__(self, app: Flask, db: SQLAlchemy, click_counter: Optional[ClickCounter] = None,
+                 cache: Optional[LRUCache] = None, code_filter: Optional[BloomFilter] = None,
+                 snapshot: Optional[RedirectSnapshot] = None, click_log: Optional[ClickEventLog] = None,
+                 replicas: Optional[ReplicaSet] = None, archived_codes: Optional[ArchivedCodes] = None):
+        """
+        :param click_counter: if set, the redirect stats are buffered and written in batches by the counter,
+            instead of being committed on every redirect
+        :param cache: if set, the (companySlug, id) -> longUrl mappings (and the misses) are cached in memory
+        :param code_filter: if set, the short urls in use are kept in the filter, and only the urls that the filter
+            reports as maybe present are checked against the database
+        :param snapshot: if set, the mappings are looked up in the shared snapshot before the database, which
+            only serves the urls created after the snapshot
+        :param click_log: if set, every redirect is appended to the click event log
+        :param replicas: if set, the redirect lookups that do not update the stats in the request are read from the
+            replicas, and from the primary if the entry is not found there
+        :param archived_codes: if set, a redirect to a missing url only looks up the archive when the code may be
+            archived
+        """
+        super().__init__(app, db, replicas)
+        self.click_counter = click_counter
+        if click_counter is not None:
+            # the entries archived after their clicks were buffered are moved back by the flush
+            click_counter.unarchive = unarchive_many
+        self.cache = cache
+        self.code_filter = code_filter
+        self.snapshot = snapshot
+        self.click_log = click_log
+        self.archived_codes = archived_codes
+        self._code_filter_build_lock = threading.Lock()
+        self._code_filter_build_started = False
+
+    def build_code_filter(self):
+        """
+        Loads all the short urls in the code filter, archived or not, streaming the id columns.
+        The urls inserted by this worker meanwhile are added by add/add_many, the ones inserted by other workers
+        after the scan are unknown: inserting one of them again fails on ix_url_entry_model_id, and the batch is
+        shortened again.
+        """
+        self._code_filter_build_started = True
+        with self.app.app_context():
+            for model in (UrlEntryModel, ArchiveIndex):
+                for row in self.db.session.query(model.id).yield_per(10000):
+                    self.code_filter.add(row.id)
+            self.code_filter.ready = True
+            self.app.logger.info(f"Code filter built: {self.code_filter.stats()}")
+
+    def _code_filter_ready(self) -> bool:
+        """
+        :return: True if the code filter can be trusted, starts building it in the background on the first call
+        """
+        if self.code_filter is None:
+            return False
+        if not self.code_filter.ready and not self._code_filter_build_started:
+            with self._code_filter_build_lock:
+                if not self._code_filter_build_started:
+                    self._code_filter_build_started = True
+                    threading.Thread(target=self.build_code_filter, name="CodeFilterBuild", daemon=True).start()
+        return self.code_filter.ready
+
+    def _register_codes(self, company_slug: str, short_urls: List[str]):
+        for short_url in short_urls:
+            if self.cache is not None:
+                # drop a cached miss for the new url
+                self.cache.invalidate((company_slug, short_url))
+            if self.code_filter is not None:
+                self.code_filter.add(short_url)
 
     def add(self, record_id: str, long_url: str, short_url: str, company_slug: Optional[str] = "") -> bool:
+        return short_url not in self.existing_short_urls([short_url]) and \
+            self.add_many([(record_id, long_url)], [short_url], company_slug)
 
-        # ensure that the company name is never NULL,
-        if UrlEntryModel.query.filter_by(id=short_url).first():
+    def existing_short_urls(self, short_urls: List[str]) -> Set[str]:
+        """
+        Finds which of the short urls are already in use, archived or not, with one query per table and chunk of
+        _IN_CHUNK_SIZE urls. The urls that are not in the code filter are not looked up in url_entry_model: if
+        another worker inserted one since the filter was built, ix_url_entry_model_id rejects it in add_many.
+        The archive is not guarded by the index, so it is always checked.
+        :param short_urls: the short urls to check
+        :return: the subset of short_urls that already exist in the database
+        """
+        maybe_present = [x for x in short_urls if x in self.code_filter] if self._code_filter_ready() else short_urls
+        existing = set()
+        for model, urls in ((UrlEntryModel, maybe_present), (ArchiveIndex, short_urls)):
+            for start in range(0, len(urls), _IN_CHUNK_SIZE):
+                chunk = urls[start:start + _IN_CHUNK_SIZE]
+                existing.update(x.id for x in self.db.session.query(model.id).filter(model.id.in_(chunk)))
+        return existing
+
+    def add_many(self, entries: List[Tuple[str, str]], short_urls: List[str],
+                 company_slug: Optional[str] = "", expires: Optional[List[Optional[datetime]]] = None) -> bool:
+        """
+        Inserts all the entries in a single transaction, as one multi-row insert. Each distinct long url is
+        inserted once in long_url, if it is not there already, and the entries point to it by its hash.
+        :param entries: list[sms_record_id, long_url] to be inserted
+        :param short_urls: the short url of each entry, in the same order
+        :param company_slug: the company slug of all the entries
+        :param expires: the expiry of each entry, in the same order, None for the entries that never expire
+        :return: True if the entries were inserted, False if a short url was taken in the meantime (nothing inserted)
+        """
+        company_slug = "" if company_slug is None else company_slug
+        now = datetime.now()
+        hashes = {long_url: long_url_hash(long_url) for _, long_url in entries}
+        rows = [{"companySlug": company_slug, "id": short_url, "recordId": record_id,
+                 "longUrlHash": hashes[long_url], "used": 0, "lastUsed": now, "synced": False, "expiresAt": expires_at}
+                for (record_id, long_url), short_url, expires_at in zip(
+                    entries, short_urls, expires if expires is not None else repeat(None))]
+        try:
+            # in hash order, so that concurrent batches lock the long urls they share in the same order
+            self.db.session.execute(insert_ignore(self._dialect_name(), LongUrl.__table__),
+                                    sorted(({"hash": h, "url": u} for u, h in hashes.items()), key=lambda x: x["hash"]))
+            self.db.session.execute(UrlEntryModel.__table__.insert(), rows)
+            self.db.session.commit()
+        except IntegrityError:
+            self.db.session.rollback()
             return False
-        new_instance = UrlEntryModel(company_slug, short_url, record_id, long_url, 0, datetime.now())
 
-        self.db.session.add(new_instance)
+        self._register_codes(company_slug, short_urls)
+        return True
+
+    def existing_codes(self, company_slug: Optional[str],
+                       entries: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+        """
+        Finds the entries that were already shortened under the company slug, with one query per chunk of
+        _IN_CHUNK_SIZE sms record ids. The entries created before the deduplication of the long urls
+        (see dedupe_long_urls), the archived entries and the expired entries are not found.
+        :param company_slug: the company slug of the entries
+        :param entries: list[sms_record_id, long_url] to look for
+        :return: (sms_record_id, long_url) -> short url, for the entries that exist
+        """
+        company_slug = "" if company_slug is None else company_slug
+        table = UrlEntryModel.__table__
+        wanted = {(record_id, long_url_hash(long_url)): (record_id, long_url) for record_id, long_url in entries}
+        record_ids = list({record_id for record_id, _ in entries})
+        # an expired entry answers 410, the entry is shortened again
+        not_expired = or_(table.c.expiresAt.is_(None), table.c.expiresAt > datetime.now())
+        found = {}
+        for start in range(0, len(record_ids), _IN_CHUNK_SIZE):
+            chunk = record_ids[start:start + _IN_CHUNK_SIZE]
+            query = select(table.c.id, table.c.recordId, table.c.longUrlHash).where(
+                table.c.recordId.in_(chunk), table.c.companySlug == company_slug, not_expired)
+            for row in self.db.session.execute(query):
+                entry = wanted.get((row.recordId, row.longUrlHash))
+                if entry is not None:
+                    found[entry] = row.id
+        return found
+
+    def dedupe_long_urls(self, after: Optional[Tuple[str, str]], limit: int) -> Tuple[Optional[Tuple[str, str]], int]:
+        """
+        Moves the long urls of a batch of entries created before the deduplication into long_url, in one transaction
+        :param after: the (companySlug, id) of the last entry of the previous batch, None for the first batch
+        :param limit: the number of entries read, in (companySlug, id) order
+        :return: the (companySlug, id) to continue after, None once all the entries were read, and the number of
+            entries moved
+        """
+        table = UrlEntryModel.__table__
+        query = select(table.c.companySlug, table.c.id, table.c.longUrl)
+        if after is not None:
+            query = query.where(tuple_(table.c.companySlug, table.c.id) > tuple_(*after))
+        rows = self.db.session.execute(query.order_by(table.c.companySlug, table.c.id).limit(limit)).all()
+        legacy = [x for x in rows if x.longUrl is not None]
+        if legacy:
+            hashes = {x.longUrl: long_url_hash(x.longUrl) for x in legacy}
+            self.db.session.execute(insert_ignore(self._dialect_name(), LongUrl.__table__),
+                                    sorted(({"hash": h, "url": u} for u, h in hashes.items()), key=lambda x: x["hash"]))
+            self.db.session.execute(
+                table.update().where(table.c.companySlug == bindparam("slug"), table.c.id == bindparam("code"))
+                .values(longUrlHash=bindparam("hash"), longUrl=None),
+                [{"slug": x.companySlug, "code": x.id, "hash": hashes[x.longUrl]} for x in legacy])
+            self.db.session.commit()
+        last = (rows[-1].companySlug, rows[-1].id) if len(rows) == limit else None
+        return last, len(legacy)
+
+    def all_mappings(self) -> Iterator[Tuple[str, str, str]]:
+        """
+        Streams the (companySlug, id, longUrl) of all the entries that never expire, for the redirect snapshot: the
+        entries that expire are looked up in the database, which knows when they expire or were purged
+        """
+        table = UrlEntryModel.__table__
+        result = self.db.session.execute(select(table.c.companySlug, table.c.id, _LONG_URL).select_from(
+            _WITH_LONG_URL).where(table.c.expiresAt.is_(None)).execution_options(stream_results=True,
+                                                                                  yield_per=10000))
+        for row in result:
+            yield row.companySlug, row.id, row.longUrl
+
+    def preload_cache(self, limit: int) -> int:
+        """
+        Loads the most recently used entries in the cache
+        :param limit: the maximum number of entries loaded
+        :return: the number of entries loaded
+        """
+        if self.cache is None:
+            return 0
+        table = UrlEntryModel.__table__
+        rows = self.db.session.execute(select(table.c.companySlug, table.c.id, _LONG_URL, table.c.expiresAt)
+                                       .select_from(_WITH_LONG_URL).where(table.c.lastUsed.isnot(None))
+                                       .order_by(table.c.lastUsed.desc()).limit(limit)).all()
+        for row in rows:
+            self.cache.put((row.companySlug, row.id), _cache_entry(row.longUrl, row.expiresAt))
+        return len(rows)
+
+    def unsynced_batch(self, after: Optional[Tuple[str, str]], limit: int) -> List[Row]:
+        """
+        Keyset pagination over the entries that have not been exported yet, in (companySlug, id) order
+        :param after: the (companySlug, id) of the last entry of the previous batch, None for the first batch
+        :param limit: the maximum number of entries returned
+        :return: the rows, with the columns of _EXPORTED_URL_ENTRY_COLUMNS
+        """
+        table = UrlEntryModel.__table__
+        query = select(*[_LONG_URL if x == "longUrl" else table.c[x] for x in _EXPORTED_URL_ENTRY_COLUMNS]).select_from(
+            _WITH_LONG_URL).where(_UNSYNCED)
+        if after is not None:
+            query = query.where(tuple_(table.c.companySlug, table.c.id) > tuple_(*after))
+        query = query.order_by(table.c.companySlug, table.c.id).limit(limit)
+        return self.db.session.execute(query).all()
+
+    def mark_synced(self, rows: List[Row]):
+        """
+        Marks the exported entries as synced, in one UPDATE. An entry that was used after it was read keeps
+        synced = false, and will be exported again.
+        :param rows: the rows returned by unsynced_batch
+        """
+        table = UrlEntryModel.__table__
+        self.db.session.execute(table.update().where(
+            tuple_(table.c.companySlug, table.c.id, table.c.used).in_([(x.companySlug, x.id, x.used) for x in rows])
+        ).values(synced=True))
         self.db.session.commit()
 
-        return True
+    def delete_expired(self, limit: int) -> int:
+        """
+        Deletes up to limit expired entries, in the order in which they expired, in one statement, so that their
+        codes can be issued again. Their long urls are kept in long_url (see docs/architecture.md)
+        :param limit: the maximum number of entries deleted
+        :return: the number of entries deleted
+        """
+        table = UrlEntryModel.__table__
+        expired = table.c.expiresAt < datetime.now()
+        oldest = select(table.c.companySlug, table.c.id).where(expired).order_by(table.c.expiresAt).limit(limit)
+        result = self.db.session.execute(table.delete().where(tuple_(table.c.companySlug, table.c.id).in_(oldest)))
+        self.db.session.commit()
+        return result.rowcount
+
+    def resolve_many(self, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Row]:
+        """
+        Reads the entries of many short urls, with one query per chunk of _IN_CHUNK_SIZE urls, then reads the
+        missing ones from the archive. The usage stats are not changed, and the archived entries stay archived;
+        with ClickWriteBehind, the clicks that are not flushed yet are not included.
+        :param keys: the (companySlug, id) of the entries
+        :return: (companySlug, id) -> row with the longUrl, used and lastUsed columns, for the entries that exist
+        """
+        table = UrlEntryModel.__table__
+        wanted = set(keys)
+        # filtered on the id alone, which every database serves from ix_url_entry_model_id (sqlite does not use an
+        # index for a (companySlug, id) IN list); the entry of a code asked under another company slug is dropped here
+        short_urls = list({x[1] for x in wanted})
+        found = {}
+        for start in range(0, len(short_urls), _IN_CHUNK_SIZE):
+            chunk = short_urls[start:start + _IN_CHUNK_SIZE]
+            query = select(table.c.companySlug, table.c.id, _LONG_URL, table.c.used, table.c.lastUsed).select_from(
+                _WITH_LONG_URL).where(table.c.id.in_(chunk))
+            found.update(((x.companySlug, x.id), x) for x in self.db.session.execute(query)
+                         if (x.companySlug, x.id) in wanted)
+        if len(found) < len(wanted):
+            found.update(self.archived_entries([x for x in wanted if x not in found]))
+        return found
+
+    def archived_entries(self, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], ArchivedEntry]:
+        """
+        Reads archived entries, with one query per chunk of _IN_CHUNK_SIZE urls in the index, and one per chunk of
+        _IN_CHUNK_SIZE segments
+        :param keys: the (companySlug, id) of the entries
+        :return: (companySlug, id) -> entry, for the entries that are archived
+        """
+        index, segments = ArchiveIndex.__table__, ArchiveSegment.__table__
+        wanted = set(keys)
+        short_urls = list({x[1] for x in wanted})
+        by_segment: Dict[int, List[Tuple[str, str]]] = {}
+        for start in range(0, len(short_urls), _IN_CHUNK_SIZE):
+            chunk = short_urls[start:start + _IN_CHUNK_SIZE]
+            for row in self.db.session.execute(select(index.c.companySlug, index.c.id, index.c.segmentId).where(
+                    index.c.id.in_(chunk))):
+                if (row.companySlug, row.id) in wanted:
+                    by_segment.setdefault(row.segmentId, []).append((row.companySlug, row.id))
+        found = {}
+        segment_ids = list(by_segment)
+        for start in range(0, len(segment_ids), _IN_CHUNK_SIZE):
+            chunk = segment_ids[start:start + _IN_CHUNK_SIZE]
+            for row in self.db.session.execute(select(segments.c.id, segments.c.data).where(segments.c.id.in_(chunk))):
+                entries = decode_segment(row.data)
+                found.update((key, entries[key]) for key in by_segment[row.id])
+        return found
+
+    def _maybe_archived(self, short_url: str) -> bool:
+        """
+        :return: False if the short url is certainly not archived. Loads the segments archived since the last load
+            of the archived codes in the background, when it is due
+        """
+        if self.archived_codes is None:
+            return True
+        after = self.archived_codes.start_load()
+        if after is not None:
+            threading.Thread(target=self.load_archived_codes, args=(after,), name="ArchivedCodesLoad",
+                             daemon=True).start()
+        return short_url in self.archived_codes
+
+    def load_archived_codes(self, after: int):
+        """
+        Adds the codes of the segments created after the segment after to the archived codes, with one query per
+        100 segments
+        """
+        complete = False
+        try:
+            with self.app.app_context():
+                while after is not None:
+                    after = self.archived_codes.load(self.db.session.execute(_SEGMENTS_AFTER, {"after": after}))
+            complete = True
+        except SQLAlchemyError:
+            self.app.logger.warning("Failed to load the archived codes", exc_info=True)
+        finally:
+            self.archived_codes.finish_load(complete)
+
+    def _unarchive(self, company_slug: str, short_url: str) -> Optional[ArchivedEntry]:
+        """
+        Moves an archived entry back to url_entry_model, since it is used again. Its row in archive_index is deleted,
+        its copy in the segment is then ignored
+        :return: the entry, None if it is not archived
+        """
+        data = self.db.session.execute(_ARCHIVED_SEGMENT, {"company_slug": company_slug,
+                                                           "short_url": short_url}).scalar()
+        if data is None:
+            return None
+        entry = decode_segment(data)[(company_slug, short_url)]
+        for statement, parameters in unarchive_statements(self._dialect_name(), entry):
+            self.db.session.execute(statement, parameters)
+        self.db.session.commit()
+        return entry
+
+    def archive_batch(self, after: Optional[Tuple[str, str]], limit: int, cutoff: datetime,
+                      include_unsynced: bool = False) -> Tuple[Optional[Tuple[str, str]], int]:
+        """
+        Moves a batch of the entries last used before cutoff into archive segments, one segment per month of
+        lastUsed, in one transaction. The entries that were never used since the lastUsed column exists, and the
+        entries that expire (deleted by flask purge-expired instead), stay in url_entry_model. The long urls are
+        copied in the segments, and also kept in long_url (see docs/architecture.md).
+        :param after: the (companySlug, id) of the last entry of the previous batch, None for the first batch
+        :param limit: the number of entries moved, in (companySlug, id) order
+        :param cutoff: the entries used at or after this time are kept
+        :param include_unsynced: whether the entries that were not exported yet are archived too, the archive is
+            not exported
+        :return: the (companySlug, id) to continue after, None once all the entries were read, and the number of
+            entries moved
+        """
+        table, index, segments = UrlEntryModel.__table__, ArchiveIndex.__table__, ArchiveSegment.__table__
+        query = select(table.c.companySlug, table.c.id, table.c.recordId, _LONG_URL, table.c.used, table.c.lastUsed,
+                       table.c.synced).select_from(_WITH_LONG_URL).where(table.c.lastUsed < cutoff,
+                                                                          table.c.expiresAt.is_(None))
+        if not include_unsynced:
+            query = query.where(table.c.synced.is_(True))
+        if after is not None:
+            query = query.where(tuple_(table.c.companySlug, table.c.id) > tuple_(*after))
+        # the rows stay locked until the commit: a redirect counted meanwhile finds the entry archived, and moves it
+        # back (see by_company_slug_and_shorten_url)
+        rows = self.db.session.execute(query.order_by(table.c.companySlug, table.c.id).limit(limit)
+                                       .with_for_update(of=table)).all()
+        months: Dict[datetime, List[ArchivedEntry]] = {}
+        for row in rows:
+            months.setdefault(segment_month(row.lastUsed), []).append(ArchivedEntry(*row[:6], bool(row.synced)))
+        now = datetime.now()
+        for month, entries in sorted(months.items()):
+            segment_id = self.db.session.execute(segments.insert().values(
+                month=month, created=now, count=len(entries), data=encode_segment(entries))).inserted_primary_key[0]
+            self.db.session.execute(index.insert(), [{"companySlug": x.companySlug, "id": x.id, "segmentId": segment_id}
+                                                     for x in entries])
+        keys = [(x.companySlug, x.id) for x in rows]
+        for start in range(0, len(keys), _IN_CHUNK_SIZE):
+            self.db.session.execute(table.delete().where(
+                tuple_(table.c.companySlug, table.c.id).in_(keys[start:start + _IN_CHUNK_SIZE])))
+        self.db.session.commit()
+        last = (rows[-1].companySlug, rows[-1].id) if len(rows) == limit else None
+        return last, len(rows)
 
     def by_company_slug_and_shorten_url(self, company_slug: Optional[str], short_url: str,
                                         increase_preview_count: bool) -> Optional[str]:
         """
-        Retrieves the longer url from the database
+        Retrieves the longer url from the database, or from the archive. An archived entry is moved back to
+        url_entry_model, where its usage stats are updated.
         :param company_slug: the company slug to search for
         :param short_url: the shorter url to search for
         :param increase_preview_count: whether to increase the preview count for that entry.
         :return: None if the entry was not found, the long url otherwise
+        :raises LinkExpired: if the entry has expired
         """
         # Ensure that the company slug is never empty
         company_slug = "" if company_slug is None else company_slug
 
-        # Search for the longer url
-        urlEntryModel: UrlEntryModel = UrlEntryModel.query.filter_by(companySlug=company_slug, id=short_url).first()
+        # Search for the longer url, the mapping never changes once written, so it can be cached until the entry
+        # expires
+        found, long_url, expires_at = _cached_entry(self.cache, (company_slug, short_url))
+        if not found and self.snapshot is not None:
+            # shared by the workers, so not copied in the cache
+            long_url = self.snapshot.get(company_slug, short_url)
+            found = long_url is not None
+        if not found:
+            key = {"company_slug": company_slug, "short_url": short_url}
+            # a counted redirect updates the row on the primary in the request, unless the clicks are written behind
+            rows = self._read_replica(_LOOKUP, key) \
+                if not increase_preview_count or self.click_counter is not None else None
+            row = rows[0] if rows else None
+            if row is None:
+                # read your writes: the replica may not have received the entry yet
+                row = self.db.session.execute(_LOOKUP, key).first()
+            long_url, expires_at = (row.longUrl, row.expiresAt) if row is not None else (None, None)
+            if long_url is None and self._maybe_archived(short_url):
+                archived = self._unarchive(company_slug, short_url)
+                long_url = archived.longUrl if archived is not None else None
+            if self.cache is not None:
+                self.cache.put((company_slug, short_url), _cache_entry(long_url, expires_at))
 
         # if the longer url was not found, stop
-        if urlEntryModel is None:
+        if long_url is None:
             return None
+        _check_expiry(short_url, expires_at)
+
+        if self.click_log is not None:
+            self.click_log.record(company_slug, short_url, not increase_preview_count)
 
-        if increase_preview_count:
+        if increase_preview_count and self.click_counter is not None:
+            # Write-behind: the stats will be updated by the next flush
+            self.click_counter.record(company_slug, short_url)
+        elif increase_preview_count:
             # Update the usage stats
-            urlEntryModel.lastUsed = datetime.now()
-            urlEntryModel.used = UrlEntryModel.used + 1
-            urlEntryModel.synced = False
-            self.db.session.commit()
+            for _ in range(2):
+                updated = UrlEntryModel.query.filter_by(companySlug=company_slug, id=short_url).update(
+                    {UrlEntryModel.lastUsed: datetime.now(), UrlEntryModel.used: UrlEntryModel.used + 1,
+                     UrlEntryModel.synced: False}, synchronize_session=False)
+                self.db.session.commit()
+                # archived since it was cached: move it back and count again
+                if updated > 0 or self._unarchive(company_slug, short_url) is None:
+                    break
+
+        return long_url
+
+
+class AsyncUrlEntryRepo:
+    """
+    asyncio counterpart of the redirect lookup of UrlEntryRepo, used by the ASGI redirect server
+    """
+    engine: AsyncEngine
+    cache: Optional[LRUCache]
+    snapshot: Optional[RedirectSnapshot]
+    click_log: Optional[AsyncClickEventLog]
+    click_counter: Optional[AsyncClickCounter]
+    replicas: Optional[AsyncReplicaSet]
+    archived_codes: Optional[ArchivedCodes]
+
+    def __init__(self, engine: AsyncEngine, cache: Optional[LRUCache] = None,
+                 snapshot: Optional[RedirectSnapshot] = None, click_log: Optional[AsyncClickEventLog] = None,
+                 click_counter: Optional[AsyncClickCounter] = None, replicas: Optional[AsyncReplicaSet] = None,
+                 archived_codes: Optional[ArchivedCodes] = None):
+        """
+        :param click_log: if set, every redirect is appended to the click event log
+        :param click_counter: if set, the clicks are written behind, otherwise each one is committed in the request
+        :param replicas: if set, the lookups that tolerate the lag of the replicas are read from them
+        :param archived_codes: if set, a redirect to a missing url only looks up the archive when the code may be
+            archived
+        """
+        self.engine = engine
+        self.cache = cache
+        self.snapshot = snapshot
+        self.click_log = click_log
+        self.click_counter = click_counter
+        if click_counter is not None:
+            click_counter.unarchive = unarchive_many
+        self.replicas = replicas
+        self.archived_codes = archived_codes
+        self.archived_codes_load: Optional[asyncio.Task] = None
+        table = UrlEntryModel.__table__
+        self._lookup = _LOOKUP
+        self._count = table.update().where(
+            (table.c.companySlug == bindparam("company_slug")) & (table.c.id == bindparam("short_url"))).values(
+            used=table.c.used + 1, lastUsed=bindparam("now"), synced=False)
+
+    async def by_company_slug_and_shorten_url(self, company_slug: Optional[str], short_url: str,
+                                              increase_preview_count: bool) -> Optional[str]:
+        """
+        Same as UrlEntryRepo.by_company_slug_and_shorten_url
+        """
+        company_slug = "" if company_slug is None else company_slug
+        key = {"company_slug": company_slug, "short_url": short_url}
+
+        found, long_url, expires_at = _cached_entry(self.cache, (company_slug, short_url))
+        if not found and self.snapshot is not None:
+            long_url = self.snapshot.get(company_slug, short_url)
+            found = long_url is not None
+        if not found:
+            # same as UrlEntryRepo: a counted redirect reads the primary, unless the clicks are written behind
+            row = await self._read_replica(key) \
+                if not increase_preview_count or self.click_counter is not None else None
+            if row is None:
+                async with self.engine.connect() as connection:
+                    row = (await connection.execute(self._lookup, key)).first()
+            long_url, expires_at = (row.longUrl, row.expiresAt) if row is not None else (None, None)
+            if long_url is None and self._maybe_archived(short_url):
+                async with self.engine.begin() as connection:
+                    archived = await self._unarchive(connection, key)
+                long_url = archived.longUrl if archived is not None else None
+            if self.cache is not None:
+                self.cache.put((company_slug, short_url), _cache_entry(long_url, expires_at))
+
+        if long_url is None:
+            return None
+        _check_expiry(short_url, expires_at)
+
+        if self.click_log is not None:
+            self.click_log.record(company_slug, short_url, not increase_preview_count)
+
+        if increase_preview_count and self.click_counter is not None:
+            self.click_counter.record(company_slug, short_url)
+        elif increase_preview_count:
+            now = datetime.now()
+            async with self.engine.begin() as connection:
+                counted = (await connection.execute(self._count, {**key, "now": now})).rowcount
+                if counted == 0 and await self._unarchive(connection, key) is not None:
+                    # archived since it was cached: moved back, count again
+                    await connection.execute(self._count, {**key, "now": now})
+
+        return long_url
+
+    async def _read_replica(self, key: Dict[str, str]) -> Optional[Row]:
+        """
+        Same as Repo._read_replica, for the lookup of the entry
+        :return: the row, None if it is not on the replica or there is no replica to read
+        """
+        engine = await self.replicas.engine() if self.replicas is not None else None
+        if engine is None:
+            return None
+        try:
+            async with engine.connect() as connection:
+                return (await connection.execute(self._lookup, key)).first()
+        except OperationalError:
+            logging.getLogger("api.asgi").warning("Failed to read a replica, reading the primary", exc_info=True)
+            self.replicas.failed(engine)
+            return None
+
+    def _maybe_archived(self, short_url: str) -> bool:
+        """
+        Same as UrlEntryRepo._maybe_archived, loads in a task
+        """
+        if self.archived_codes is None:
+            return True
+        after = self.archived_codes.start_load()
+        if after is not None:
+            self.archived_codes_load = asyncio.get_running_loop().create_task(self.load_archived_codes(after))
+        return short_url in self.archived_codes
 
-        return urlEntryModel.longUrl
+    async def load_archived_codes(self, after: int):
+        """
+        Same as UrlEntryRepo.load_archived_codes
+        """
+        complete = False
+        try:
+            async with self.engine.connect() as connection:
+                while after is not None:
+                    segments = await connection.execute(_SEGMENTS_AFTER, {"after": after})
+                    after = self.archived_codes.load(segments.all())
+            complete = True
+        except SQLAlchemyError:
+            logging.getLogger("api.asgi").warning("Failed to load the archived codes", exc_info=True)
+        finally:
+            self.archived_codes.finish_load(complete)
+
+    async def _unarchive(self, connection, key: Dict[str, str]) -> Optional[ArchivedEntry]:
+        """
+        Same as UrlEntryRepo._unarchive, in the transaction of the connection
+        """
+        data = (await connection.execute(_ARCHIVED_SEGMENT, key)).scalar()
+        if data is None:
+            return None
+        entry = decode_segment(data)[(key["company_slug"], key["short_url"])]
+        for statement, parameters in unarchive_statements(self.engine.dialect.name, entry):
+            await connection.execute(statement, parameters)
+        return entry
 
 
 class SlugReservationRepo(Repo):
 
-    @staticmethod
-    def by_id(_id: str) -> Optional[SlugReservation]:
-        return SlugReservation.query.filter_by(slug=_id).first()
+    def by_company_not_expired(self, companyId: str) -> List[str]:
+        """
+        Reads the slugs of the company, from a replica if there is one within the lag guard: a slug reserved in the
+        last ReplicaMaxLagInSeconds may be missing
+        """
+        table = SlugReservation.__table__
+        query = select(table.c.slug).where(table.c.by == companyId,
+                                           table.c.permanent | (table.c.expires >= datetime.now()))
+        rows = self._read_replica(query)
+        if rows is None:
+            rows = self.db.session.execute(query).all()
+        return list({x.slug for x in rows})
 
-    @staticmethod
-    def by_company_not_expired(companyId: str) -> List[str]:
-        slug_reservations: List[SlugReservation] = SlugReservation.query.filter_by(by=companyId).filter(
-            SlugReservation.permanent | (SlugReservation.expires >= datetime.now())).all()
-        return list({x.slug for x in slug_reservations})
+    def unsynced_batch(self, after: Optional[str], limit: int) -> List[Row]:
+        """
+        Keyset pagination over the reservations that have not been exported yet, in slug order
+        :param after: the slug of the last reservation of the previous batch, None for the first batch
+        :param limit: the maximum number of reservations returned
+        :return: the rows, with the columns of _EXPORTED_SLUG_RESERVATION_COLUMNS
+        """
+        table = SlugReservation.__table__
+        query = select(*[table.c[x] for x in _EXPORTED_SLUG_RESERVATION_COLUMNS]).where(_UNSYNCED)
+        if after is not None:
+            query = query.where(table.c.slug > after)
+        query = query.order_by(table.c.slug).limit(limit)
+        return self.db.session.execute(query).all()
 
-    def add(self, company_id: str, slug: str) -> SlugReservation:
+    def mark_synced(self, rows: List[Row]):
         """
-        Creates a new slug reservation and adds it to the database
-        :param company_id: the company id that will be linked to the slug
-        :param slug: the slug that is being reserved
-        :return: the created instance from the database
+        Marks the exported reservations as synced, in one UPDATE. A reservation that changed owner or became
+        permanent after it was read keeps synced = false, a refresh of the expiry alone is not exported again.
+        :param rows: the rows returned by unsynced_batch
         """
-        new_reservation = SlugReservation(slug, company_id, False, app=self.app)
-        self.db.session.add(new_reservation)
+        table = SlugReservation.__table__
+        self.db.session.execute(table.update().where(
+            tuple_(table.c.slug, table.c.by, table.c.permanent).in_([(x.slug, x.by, x.permanent) for x in rows])
+        ).values(synced=True))
         self.db.session.commit()
-        return new_reservation
 
-    def refresh(self, slug_reservation: SlugReservation):
+    def delete_expired(self, limit: int) -> int:
         """
-        Refreshes a reservation and commits it to the database
-        :param slug_reservation: the linked slug reservation instance
+        Deletes up to limit temporary reservations that have expired, oldest first, in one statement. The expiry
+        is checked again by the DELETE itself, so a reservation refreshed in the meantime is kept.
+        :param limit: the maximum number of reservations deleted
+        :return: the number of reservations deleted
         """
-        slug_reservation.refresh(self.app)
+        table = SlugReservation.__table__
+        expired = and_(_TEMPORARY, table.c.expires < datetime.now())
+        oldest = select(table.c.slug).where(expired).order_by(table.c.expires).limit(limit)
+        result = self.db.session.execute(table.delete().where(table.c.slug.in_(oldest)).where(expired))
         self.db.session.commit()
+        return result.rowcount
 
-    def reserve_permanently(self, slug_reservation: SlugReservation):
-        slug_reservation.permanent = True
-        slug_reservation.expires = None
-        self.db.session.commit()
+    def reserve(self, company_id: str, slug: str, permanent: bool = False) -> bool:
+        """
+        Reserves the slug for the company in one INSERT ... ON CONFLICT DO UPDATE, so that two companies reserving
+        the same slug at once cannot both get it. The conflicting reservation is only updated if it belongs to the
+        company (its expiry is refreshed, unless it is permanent), or if it is temporary and has expired (the company
+        takes it over); otherwise it is left as it is.
+        :param company_id: the company id that will be linked to the slug
+        :param slug: the slug that is being reserved
+        :param permanent: whether the reservation becomes permanent, before urls are shortened with the slug
+        :return: whether the slug is reserved by the company
+        """
+        table = SlugReservation.__table__
+        now = datetime.now()
+        expires = None if permanent else now + timedelta(seconds=self.app.config["ReservationDuration"])
+        dialect_name = self._dialect_name()
+        insert = (postgresql if dialect_name == "postgresql" else sqlite).insert(table).values(
+            slug=slug, by=company_id, permanent=permanent, created=now, expires=expires, synced=False)
+        if permanent:
+            values = {"by": insert.excluded.by, "permanent": True, "expires": None, "synced": False}
+        else:
+            # a permanent reservation of the company is kept as it is. The columns are qualified with the table in
+            # the statement: "permanent" alone would be ambiguous with excluded.permanent
+            kept = table.c.permanent.is_(True)
+            values = {"by": insert.excluded.by, "expires": case((kept, table.c.expires), else_=insert.excluded.expires),
+                      "synced": case((kept, table.c.synced), else_=False)}
+        upsert = insert.on_conflict_do_update(index_elements=[table.c.slug], set_=values, where=or_(
+            table.c.by == insert.excluded.by, and_(table.c.permanent.is_not(True), table.c.expires < now)))
 
-    def change_reservation(self, slug_reservation: SlugReservation, by: str):
-        slug_reservation.by = by
-        slug_reservation.refresh(self.app)
-        self.db.session.commit()
+        with self.db.get_engine(self.app).begin() as connection:
+            if dialect_name == "postgresql":
+                # no row is returned when the reservation of another company is left as it is
+                owner = connection.execute(upsert.returning(table.c.by)).scalar()
+            else:
+                # the upsert holds the write lock of the database until the end of the transaction
+                connection.execute(upsert)
+                owner = connection.execute(select(table.c.by).where(table.c.slug == slug)).scalar()
+        return owner == company_id
+
+
+class CodeCounterRepo(Repo):
+
+    def lease(self, size: int, name: str = "short_url") -> int:
+        """
+        Leases a range of values from the counter, in its own transaction
+        :param size: the number of values to lease
+        :param name: the name of the counter
+        :return: the first value of the leased range [start, start + size)
+        """
+        table = CodeCounter.__table__
+        for _ in range(2):
+            try:
+                with self.db.get_engine(self.app).begin() as connection:
+                    # the update takes the row lock, so the select reads the value that was set by this transaction
+                    updated = connection.execute(table.update().where(table.c.name == name).values(
+                        value=table.c.value + size)).rowcount
+                    if updated == 0:
+                        connection.execute(table.insert().values(name=name, value=size))
+                    return connection.execute(select(table.c.value).where(table.c.name == name)).scalar() - size
+            except IntegrityError:
+                # another worker created the counter at the same time, the update will find it now
+                continue
+        raise RuntimeError(f"Could not lease a range from the counter {name}")
+
+
+class ClickRollupRepo(Repo):
+    """
+    Hourly aggregates of the click event log, per url (click_rollup_code) and per company slug
+    (click_rollup_company). The events are added to the rollups in id order, and rollup_state keeps the id of the
+    last event added, so every event is counted once.
+    """
+    name = "clicks"
+
+    def _hour(self, dialect_name: str, column):
+        if dialect_name == "postgresql":
+            return func.date_trunc("hour", column)
+        if dialect_name == "sqlite":
+            # in the format of the sqlite DATETIME of SQLAlchemy, so that the hours compare with the bound datetimes
+            return func.strftime("%Y-%m-%d %H:00:00.000000", column)
+        raise ValueError(f"Unsupported database: {dialect_name}")
+
+    @staticmethod
+    def _upsert_counts(dialect_name: str, table: Table, query, keys: List[str]):
+        # INSERT .. SELECT, adding the counts to the existing rows
+        insert = (postgresql if dialect_name == "postgresql" else sqlite).insert(table)
+        insert = insert.from_select(keys + ["clicks", "previews"], query)
+        return insert.on_conflict_do_update(index_elements=keys, set_={
+            "clicks": table.c.clicks + insert.excluded.clicks,
+            "previews": table.c.previews + insert.excluded.previews,
+        })
+
+    def rollup(self, limit: int, lag: float) -> int:
+        """
+        Adds up to limit events to the rollups, in one transaction
+        :param limit: the maximum number of events added
+        :param lag: the events of the last lag seconds are left for the next run, and so are the events after them,
+            so that the batches of the log that are still being committed are not skipped
+        :return: the number of events added
+        """
+        dialect_name = self._dialect_name()
+        events, state = ClickEvent.__table__, RollupState.__table__
+        with self.db.get_engine(self.app).begin() as connection:
+            # the state row is locked until the commit, so that concurrent runs do not count the events twice
+            connection.execute(insert_ignore(dialect_name, state).values(name=self.name, lastEventId=0))
+            last = connection.execute(select(state.c.lastEventId).where(state.c.name == self.name)
+                                      .with_for_update()).scalar()
+
+            pending = events.c.id > last
+            first_recent = connection.execute(select(func.min(events.c.id)).where(
+                pending, events.c.at >= datetime.now() - timedelta(seconds=lag))).scalar()
+            if first_recent is not None:
+                pending = and_(pending, events.c.id < first_recent)
+            batch = select(events.c.id).where(pending).order_by(events.c.id).limit(limit).subquery()
+            upper, count = connection.execute(select(func.max(batch.c.id), func.count())).one()
+            if count == 0:
+                return 0
+
+            window = and_(events.c.id > last, events.c.id <= upper)
+            hour = self._hour(dialect_name, events.c.at).label("hour")
+            clicks = func.sum(case((events.c.preview, 0), else_=1))
+            previews = func.sum(case((events.c.preview, 1), else_=0))
+            connection.execute(self._upsert_counts(
+                dialect_name, ClickRollupCode.__table__,
+                select(events.c.companySlug, events.c.code, hour, clicks, previews).where(window).group_by(
+                    events.c.companySlug, events.c.code, hour), ["companySlug", "code", "hour"]))
+            connection.execute(self._upsert_counts(
+                dialect_name, ClickRollupCompany.__table__,
+                select(events.c.companySlug, hour, clicks, previews).where(window).group_by(
+                    events.c.companySlug, hour), ["companySlug", "hour"]))
+            connection.execute(state.update().where(state.c.name == self.name).values(lastEventId=upper))
+        return count
+
+    def hourly(self, company_slug: str, code: Optional[str], start: datetime, end: datetime) -> List[Row]:
+        """
+        Reads the rollups of a url, or of a company slug if code is None
+        :return: the (hour, clicks, previews) rows of the hours in [start, end), in hour order
+        """
+        table = ClickRollupCompany.__table__ if code is None else ClickRollupCode.__table__
+        query = select(table.c.hour, table.c.clicks, table.c.previews).where(
+            table.c.companySlug == company_slug, table.c.hour >= start, table.c.hour < end)
+        if code is not None:
+            query = query.where(table.c.code == code)
+        return self.db.session.execute(query.order_by(table.c.hour)).all()
@@ -0,0 +1,31 @@
+import time
+
+import click
+from flask import Flask
+
+from api.repos import ClickRollupRepo
+
+
+def register_rollup_command(flask_app: Flask, rollup_repo: ClickRollupRepo):
+    """
+    Adds the command: flask rollup-clicks [--batch-size N] [--interval SECONDS]
+    """
+
+    @flask_app.cli.command("rollup-clicks")
+    @click.option("--batch-size", type=int, default=100_000, help="the number of events per transaction")
+    @click.option("--interval", type=float, help="roll up again every this many seconds, instead of once")
+    def rollup_clicks_command(batch_size: int, interval: float):
+        """
+        Adds the new click events to the hourly rollups read by /api/stats.
+        """
+        while True:
+            added = 0
+            while True:
+                batch = rollup_repo.rollup(batch_size, flask_app.config["ClickRollupLagInSeconds"])
+                added += batch
+                if batch < batch_size:
+                    break
+            click.echo(f"Rolled up {added} click events", err=True)
+            if interval is None:
+                break
+            time.sleep(interval)
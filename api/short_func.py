@@ -1,8 +1,10 @@
 import datetime
+import hashlib
+import os
+import threading
 import uuid
 from abc import abstractmethod
-
-import numpy as np
+from typing import Callable, List
 
 
 class URLShortener:
@@ -15,6 +17,22 @@ class URLShortener:
     @abstractmethod
     def get_shorter_url_for(url: str) -> str: pass
 
+    @classmethod
+    def get_shorter_urls_for(cls, count: int) -> List[str]:
+        """
+        Generates a batch of codes, the codes do not depend on the urls
+        :param count: the number of codes to generate
+        :return: the list of codes
+        """
+        return [cls.get_shorter_url_for("") for _ in range(count)]
+
+    @staticmethod
+    def is_collision_free() -> bool:
+        """
+        :return: True if the generated urls never repeat, so they do not have to be checked against the database
+        """
+        return False
+
 
 def alphabet_indexed(val: int) -> str:
     if val < 26:
@@ -25,10 +43,19 @@ def alphabet_indexed(val: int) -> str:
         return chr(ord('0') + val - 52)
 
 
+# the alphabet of alphabet_indexed, as a lookup table
+_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+# the random bytes >= _UNBIASED_LIMIT are discarded, so that byte % 62 is uniform
+_UNBIASED_LIMIT = 62 * 4
+
+
 class UUID4BasedURLShortener(URLShortener):
 
     @staticmethod
     def get_shorter_url_for(url: str) -> str:
+        # imported on the first use, so that the workers that only serve redirects never load numpy
+        import numpy as np
+
         rv = datetime.datetime.now().strftime("%Y-%m-%d") + str(uuid.uuid4()) + url
 
         digitNumber = np.array([ord(i) for i in rv])
@@ -41,6 +68,127 @@ class UUID4BasedURLShortener(URLShortener):
 
         return finalString
 
+    @staticmethod
+    def get_shorter_urls_for(count: int) -> List[str]:
+        """
+        Generates count codes in one vectorized pass over random bytes, with the same alphabet and length as
+        get_shorter_url_for
+        """
+        import numpy as np
+
+        length = UUID4BasedURLShortener.get_max_url_length()
+        needed = count * length
+        values = np.empty(0, dtype=np.uint8)
+        while len(values) < needed:
+            # ~3% of the bytes are discarded, draw a few more to avoid a second pass
+            random_bytes = np.frombuffer(os.urandom((needed - len(values)) * 17 // 16 + 16), dtype=np.uint8)
+            values = np.concatenate((values, random_bytes[random_bytes < _UNBIASED_LIMIT]))
+        codes = np.frombuffer(_ALPHABET, dtype=np.uint8)[values[:needed] % 62]
+        return codes.view(f"S{length}").astype(f"U{length}").tolist()
+
+    @staticmethod
+    def get_max_url_length() -> int:
+        return 6
+
+
+class BlockLeasedURLShortener(URLShortener):
+    """
+    Generates the urls from a counter: each worker leases blocks of counter values from the database, and the
+    values are mapped to base62 codes by a keyed permutation of the 62^6 keyspace, so consecutive values give
+    unrelated codes. The codes never repeat, and no database check is needed to generate them.
+    """
+    _HALF_SIZE = 62 ** 3
+    _KEYSPACE_SIZE = _HALF_SIZE * _HALF_SIZE
+    _ROUNDS = 4
+
+    def __init__(self, lease: Callable[[int], int], key: str, block_size: int = 1000):
+        """
+        :param lease: function that leases block_size values from the counter, returning the first one
+        :param key: the secret key of the permutation, changing it changes the codes of all the future values
+        :param block_size: the number of values leased at once
+        """
+        self.lease = lease
+        self.block_size = block_size
+        digest = hashlib.blake2b(key.encode(), digest_size=4 * self._ROUNDS).digest()
+        self._round_keys = [int.from_bytes(digest[4 * i:4 * (i + 1)], "big") for i in range(self._ROUNDS)]
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._pid = None
+
+    @staticmethod
+    def _round(value: int, round_key: int) -> int:
+        value = ((value ^ round_key) * 0x45d9f3b) & 0xffffffff
+        value ^= value >> 16
+        value = (value * 0x45d9f3b) & 0xffffffff
+        value ^= value >> 16
+        return value
+
+    def permute(self, value: int) -> int:
+        """
+        Feistel network over the keyspace, seen as pairs of numbers in [0, 62^3)
+        """
+        left, right = divmod(value, self._HALF_SIZE)
+        for round_key in self._round_keys:
+            left, right = right, (left + self._round(right, round_key)) % self._HALF_SIZE
+        return left * self._HALF_SIZE + right
+
+    def inverse_permute(self, value: int) -> int:
+        left, right = divmod(value, self._HALF_SIZE)
+        for round_key in reversed(self._round_keys):
+            left, right = (right - self._round(left, round_key)) % self._HALF_SIZE, left
+        return left * self._HALF_SIZE + right
+
+    @staticmethod
+    def encode(value: int) -> str:
+        chars = []
+        for _ in range(BlockLeasedURLShortener.get_max_url_length()):
+            value, index = divmod(value, 62)
+            chars.append(alphabet_indexed(index))
+        return "".join(reversed(chars))
+
+    @staticmethod
+    def decode(code: str) -> int:
+        value = 0
+        for char in code:
+            if "A" <= char <= "Z":
+                index = ord(char) - ord("A")
+            elif "a" <= char <= "z":
+                index = ord(char) - ord("a") + 26
+            else:
+                index = ord(char) - ord("0") + 52
+            value = value * 62 + index
+        return value
+
+    def counter_value_of(self, code: str) -> int:
+        """
+        :return: the counter value that generated the code
+        """
+        return self.inverse_permute(self.decode(code))
+
+    def _next_value(self) -> int:
+        with self._lock:
+            # a forked worker must not reuse the block of its parent
+            if self._next >= self._end or self._pid != os.getpid():
+                self._next = self.lease(self.block_size)
+                self._end = self._next + self.block_size
+                self._pid = os.getpid()
+            value = self._next
+            self._next += 1
+        if value >= self._KEYSPACE_SIZE:
+            raise RuntimeError("The keyspace of the BlockLeasedURLShortener is exhausted")
+        return value
+
+    def get_shorter_url_for(self, url: str) -> str:
+        return self.encode(self.permute(self._next_value()))
+
+    def get_shorter_urls_for(self, count: int) -> List[str]:
+        return [self.encode(self.permute(self._next_value())) for _ in range(count)]
+
+    @staticmethod
+    def is_collision_free() -> bool:
+        return True
+
     @staticmethod
     def get_max_url_length() -> int:
         return 6
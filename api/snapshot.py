@@ -0,0 +1,267 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from typing import Optional, Iterable, Tuple, Dict, TYPE_CHECKING
+
+import click
+from flask import Flask
+
+if TYPE_CHECKING:
+    # api.repos reads the snapshot
+    from api.repos import UrlEntryRepo
+
+# file layout: header | slot table (slot_count uint64) | records
+# a slot holds 1 + the offset of its record in the records section, 0 for an empty slot (linear probing)
+# a record is: key length (uint16), url length (uint32), key ("companySlug\0id"), long url, all utf-8
+_MAGIC = b"URLSNAP1"
+_HEADER = struct.Struct("<8sQQ")
+_SLOT = struct.Struct("<Q")
+_RECORD = struct.Struct("<HI")
+
+
+def _key(company_slug: str, short_url: str) -> bytes:
+    return (company_slug + "\0" + short_url).encode()
+
+
+def _hash(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def write_snapshot(rows: Iterable[Tuple[str, str, str]], path: str) -> int:
+    """
+    Writes the snapshot of the mappings next to path, and atomically replaces path with it, so that the readers
+    see either the previous snapshot or the new one
+    :param rows: the (companySlug, id, longUrl) of the entries
+    :param path: the snapshot file
+    :return: the number of entries written
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    hashes, offsets = array("Q"), array("Q")
+    with tempfile.TemporaryFile(dir=directory) as records:
+        offset = 0
+        for company_slug, short_url, long_url in rows:
+            key, url = _key(company_slug, short_url), long_url.encode()
+            record = _RECORD.pack(len(key), len(url)) + key + url
+            records.write(record)
+            hashes.append(_hash(key))
+            offsets.append(offset)
+            offset += len(record)
+
+        # a load factor of at most 1/2 keeps the probe sequences short
+        slot_count = 1 << max(1, (2 * len(hashes) - 1).bit_length())
+        mask = slot_count - 1
+        slots = array("Q", bytes(_SLOT.size * slot_count))
+        for h, record_offset in zip(hashes, offsets):
+            i = h & mask
+            while slots[i]:
+                i = (i + 1) & mask
+            slots[i] = record_offset + 1
+        if sys.byteorder != "little":
+            slots.byteswap()
+
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as output:
+                output.write(_HEADER.pack(_MAGIC, len(hashes), slot_count))
+                output.write(slots.tobytes())
+                records.seek(0)
+                shutil.copyfileobj(records, output, 1 << 20)
+                output.flush()
+                os.fsync(output.fileno())
+            os.chmod(temporary_path, 0o644)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+    return len(hashes)
+
+
+class _MappedSnapshot:
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.identity = os.fstat(file.fileno())
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.slot_count = _HEADER.unpack_from(self.map)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a redirect snapshot")
+        self.records = _HEADER.size + _SLOT.size * self.slot_count
+
+    def get(self, key: bytes) -> Optional[str]:
+        mask = self.slot_count - 1
+        i = _hash(key) & mask
+        while True:
+            slot, = _SLOT.unpack_from(self.map, _HEADER.size + _SLOT.size * i)
+            if slot == 0:
+                return None
+            position = self.records + slot - 1
+            key_length, url_length = _RECORD.unpack_from(self.map, position)
+            position += _RECORD.size
+            if self.map[position:position + key_length] == key:
+                position += key_length
+                return self.map[position:position + url_length].decode()
+            i = (i + 1) & mask
+
+
+class RedirectSnapshot:
+    """
+    Read-only, memory-mapped (companySlug, id) -> longUrl mapping, written by write_snapshot. The pages are shared
+    by all the processes that map the file. A replaced file is mapped again on the first lookup after
+    check_interval seconds; a missing file answers every lookup with None.
+    """
+    path: str
+    check_interval: float
+
+    def __init__(self, path: str, check_interval: float = 5):
+        self.path = path
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._mapped: Optional[_MappedSnapshot] = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _current(self) -> Optional[_MappedSnapshot]:
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self._mapped
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                self._checked_at = time.monotonic()
+                try:
+                    identity = os.stat(self.path)
+                    mapped = self._mapped
+                    if mapped is None or (mapped.identity.st_ino, mapped.identity.st_mtime_ns) != \
+                            (identity.st_ino, identity.st_mtime_ns):
+                        # the previous map is released once the lookups still using it are done
+                        self._mapped = _MappedSnapshot(self.path)
+                except (OSError, ValueError):
+                    self._mapped = None
+        return self._mapped
+
+    def get(self, company_slug: str, short_url: str) -> Optional[str]:
+        """
+        :return: the long url, None if the entry is not in the snapshot
+        """
+        mapped = self._current()
+        long_url = mapped.get(_key(company_slug, short_url)) if mapped is not None else None
+        if long_url is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return long_url
+
+    def preload(self) -> int:
+        """
+        Maps the snapshot and asks the kernel to read it ahead, so that the first lookups do not wait for the disk
+        :return: the number of entries in the snapshot, 0 if there is none
+        """
+        mapped = self._current()
+        if mapped is None:
+            return 0
+        if hasattr(mmap, "MADV_WILLNEED"):
+            mapped.map.madvise(mmap.MADV_WILLNEED)
+        return mapped.count
+
+    def stats(self) -> Dict[str, float]:
+        mapped = self._current()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": mapped.count if mapped is not None else 0,
+            "age_seconds": time.time() - mapped.identity.st_mtime if mapped is not None else 0,
+        }
+
+
+class SnapshotBuilder:
+    """
+    Rebuilds the snapshot every interval seconds, in a daemon thread of each worker. The workers of a machine
+    coordinate through a lock file and the age of the snapshot, so that it is rebuilt once per interval.
+    """
+    app: Flask
+    url_entry_repo: "UrlEntryRepo"
+    path: str
+    interval: float
+
+    def __init__(self, app: Flask, url_entry_repo: "UrlEntryRepo", path: str, interval: float):
+        self.app = app
+        self.url_entry_repo = url_entry_repo
+        self.path = path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def build(self) -> int:
+        """
+        :return: the number of entries in the new snapshot
+        """
+        started = time.perf_counter()
+        with self.app.app_context():
+            count = write_snapshot(self.url_entry_repo.all_mappings(), self.path)
+        self.app.logger.info(f"Redirect snapshot of {count} urls written in {time.perf_counter() - started:.1f}s")
+        return count
+
+    def build_if_stale(self):
+        with open(self.path + ".lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # another worker is building it
+                return
+            try:
+                if time.time() - os.stat(self.path).st_mtime < self.interval:
+                    return
+            except FileNotFoundError:
+                pass
+            self.build()
+
+    def ensure_started(self):
+        # started by the first request, so that processes that never serve one do not spawn the thread
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.build_if_stale()
+            except Exception:
+                self.app.logger.exception("Failed to build the redirect snapshot")
+            time.sleep(self.interval)
+
+
+def register_snapshot(flask_app: Flask, url_entry_repo: "UrlEntryRepo"):
+    """
+    Adds the command: flask build-snapshot [--output FILE] [--interval SECONDS]
+    and, if RedirectSnapshotRebuildIntervalInSeconds is set, the background builder of each worker
+    """
+
+    @flask_app.cli.command("build-snapshot")
+    @click.option("--output", default=flask_app.config["RedirectSnapshotPath"] or None, required=True,
+                  help="the snapshot file, RedirectSnapshotPath by default")
+    @click.option("--interval", type=float, help="rebuild every this many seconds, instead of once")
+    def build_snapshot_command(output: str, interval: float):
+        """
+        Writes the (companySlug, id) -> longUrl snapshot read by the redirect routes.
+        """
+        builder = SnapshotBuilder(flask_app, url_entry_repo, output, interval)
+        while True:
+            click.echo(f"Wrote {builder.build()} urls to {output}", err=True)
+            if interval is None:
+                break
+            time.sleep(interval)
+
+    if flask_app.config["RedirectSnapshotPath"] and flask_app.config["RedirectSnapshotRebuildIntervalInSeconds"] > 0:
+        builder = SnapshotBuilder(flask_app, url_entry_repo, flask_app.config["RedirectSnapshotPath"],
+                                  flask_app.config["RedirectSnapshotRebuildIntervalInSeconds"])
+        flask_app.before_request(builder.ensure_started)
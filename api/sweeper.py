@@ -0,0 +1,156 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import click
+from flask import Flask
+
+from api.metrics import RESERVATIONS_SWEPT, EXPIRED_URLS_PURGED, Histogram
+from api.repos import SlugReservationRepo, UrlEntryRepo
+
+
+class Sweeper(ABC):
+    """
+    Deletes expired rows in batches of batch_size, so that a table only grows with the rows in use. Runs every
+    interval seconds in a daemon thread of each worker, or from a command.
+    """
+    app: Flask
+    interval: float
+    batch_size: int
+    # what is deleted, for the logs
+    description: str
+    # observes the number of rows deleted per sweep
+    histogram: Histogram
+
+    def __init__(self, app: Flask, interval: float, batch_size: int):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_started(self):
+        # started by the first request, so that processes that never serve one (flask db ..., pre-fork masters)
+        # do not spawn the thread
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception:
+                self.app.logger.exception(f"Failed to delete the {self.description}")
+
+    @abstractmethod
+    def _delete_batch(self, limit: int) -> int:
+        """
+        Deletes up to limit rows, in one transaction
+        :return: the number of rows deleted
+        """
+
+    def sweep(self) -> int:
+        """
+        Deletes all the expired rows, one transaction per batch, so that the locks are held briefly
+        :return: the number of rows deleted
+        """
+        deleted = 0
+        with self.app.app_context():
+            while True:
+                batch = self._delete_batch(self.batch_size)
+                deleted += batch
+                if batch < self.batch_size:
+                    break
+        self.histogram.observe(deleted)
+        if deleted:
+            self.app.logger.info(f"Deleted {deleted} {self.description}")
+        return deleted
+
+
+class ReservationSweeper(Sweeper):
+    """
+    Deletes the expired temporary slug reservations, from the sweep-reservations command or every
+    ReservationSweepIntervalInSeconds
+    """
+    slug_repo: SlugReservationRepo
+    description = "expired slug reservations"
+    histogram = RESERVATIONS_SWEPT
+
+    def __init__(self, app: Flask, slug_repo: SlugReservationRepo, interval: float, batch_size: int):
+        super().__init__(app, interval, batch_size)
+        self.slug_repo = slug_repo
+
+    def _delete_batch(self, limit: int) -> int:
+        return self.slug_repo.delete_expired(limit)
+
+
+class ExpiredUrlPurger(Sweeper):
+    """
+    Deletes the expired url entries, so that their codes can be issued again, from the purge-expired command or
+    every ExpiredUrlPurgeIntervalInSeconds
+    """
+    url_entry_repo: UrlEntryRepo
+    description = "expired urls"
+    histogram = EXPIRED_URLS_PURGED
+
+    def __init__(self, app: Flask, url_entry_repo: UrlEntryRepo, interval: float, batch_size: int):
+        super().__init__(app, interval, batch_size)
+        self.url_entry_repo = url_entry_repo
+
+    def _delete_batch(self, limit: int) -> int:
+        return self.url_entry_repo.delete_expired(limit)
+
+
+def _register_sweeper_command(flask_app: Flask, name: str, help_text: str, make_sweeper, default_batch_size: int):
+    """
+    Adds the command: flask <name> [--batch-size N] [--interval SECONDS]
+    :param make_sweeper: (interval, batch_size) -> Sweeper
+    """
+
+    @flask_app.cli.command(name, help=help_text)
+    @click.option("--batch-size", type=int, default=default_batch_size)
+    @click.option("--interval", type=float, help="delete again every this many seconds, instead of once")
+    def sweep_command(batch_size: int, interval: float):
+        sweeper = make_sweeper(interval, batch_size)
+        while True:
+            click.echo(f"Deleted {sweeper.sweep()} {sweeper.description}", err=True)
+            if interval is None:
+                break
+            time.sleep(interval)
+
+
+def register_sweeper(flask_app: Flask, slug_repo: SlugReservationRepo):
+    """
+    Adds the command: flask sweep-reservations [--batch-size N] [--interval SECONDS]
+    and, if ReservationSweepIntervalInSeconds is set, the background sweeper of each worker
+    """
+    _register_sweeper_command(
+        flask_app, "sweep-reservations", "Deletes the expired temporary slug reservations.",
+        lambda interval, batch_size: ReservationSweeper(flask_app, slug_repo, interval, batch_size),
+        flask_app.config["ReservationSweepBatchSize"])
+
+    if flask_app.config["ReservationSweepIntervalInSeconds"] > 0:
+        sweeper = ReservationSweeper(flask_app, slug_repo, flask_app.config["ReservationSweepIntervalInSeconds"],
+                                     flask_app.config["ReservationSweepBatchSize"])
+        flask_app.before_request(sweeper.ensure_started)
+
+
+def register_purger(flask_app: Flask, url_entry_repo: UrlEntryRepo):
+    """
+    Adds the command: flask purge-expired [--batch-size N] [--interval SECONDS]
+    and, if ExpiredUrlPurgeIntervalInSeconds is set, the background purger of each worker
+    """
+    _register_sweeper_command(
+        flask_app, "purge-expired", "Deletes the expired urls, so that their codes can be issued again.",
+        lambda interval, batch_size: ExpiredUrlPurger(flask_app, url_entry_repo, interval, batch_size),
+        flask_app.config["ExpiredUrlPurgeBatchSize"])
+
+    if flask_app.config["ExpiredUrlPurgeIntervalInSeconds"] > 0:
+        purger = ExpiredUrlPurger(flask_app, url_entry_repo, flask_app.config["ExpiredUrlPurgeIntervalInSeconds"],
+                                  flask_app.config["ExpiredUrlPurgeBatchSize"])
+        flask_app.before_request(purger.ensure_started)
@@ -0,0 +1,259 @@
+import json
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+OPENAPI_PATH = Path(__file__).parent.parent / "docs" / "openapi.json"
+
+# raises a SchemaError if the value does not match the schema it was compiled from
+Validator = Callable[[Any], None]
+
+# the exact python types of the json schema types, a bool is not an integer
+_TYPES: Dict[str, Tuple[type, ...]] = {
+    "string": (str,),
+    "object": (dict,),
+    "array": (list,),
+    "boolean": (bool,),
+    "integer": (int,),
+    "number": (int, float),
+    "null": (type(None),),
+}
+
+
+class SchemaError(ValueError):
+    """
+    A value of a request that does not match its schema
+    kind: "type" (the value has the wrong type), "missing" (a required property is missing) or "unknown" (a
+        property that is not in the schema, only reported by the closed validators)
+    path: where the value is in the request, "" for the root, as in urls_to_shorten[3].original_url
+    expected: the expected json type, or the name of the property
+    value: the value of the wrong type, or of the unknown property
+    """
+
+    def __init__(self, kind: str, path: str, expected: str, value: Any = None):
+        super().__init__(f"{path or 'the root'}: {kind} {expected}")
+        self.kind = kind
+        self.path = path
+        self.expected = expected
+        self.value = value
+
+    @property
+    def found(self) -> type:
+        return type(self.value)
+
+    @property
+    def nested(self) -> bool:
+        """
+        :return: whether the error is below a property or an item of the root
+        """
+        return "." in self.path or "[" in self.path
+
+    def within(self, key: str) -> "SchemaError":
+        """
+        :param key: the property name, or the "[index]" of the item, in which the error was found
+        """
+        if not self.path:
+            self.path = key
+        else:
+            self.path = key + (self.path if self.path.startswith("[") else "." + self.path)
+        return self
+
+
+def resolve_ref(document: dict, schema: dict) -> dict:
+    """
+    :return: the schema, or the schema referenced by its $ref ("#/components/...")
+    """
+    while "$ref" in schema:
+        target = document
+        for part in schema["$ref"].lstrip("#/").split("/"):
+            target = target[part]
+        schema = target
+    return schema
+
+
+def _simple_types(document: dict, schema: dict) -> Optional[Tuple[type, ...]]:
+    """
+    :return: the python types of a schema that only constrains the type, None if it needs a validator
+    """
+    schema = resolve_ref(document, schema)
+    if schema.get("type") in _TYPES and schema["type"] not in ("object", "array"):
+        return _TYPES[schema["type"]]
+    return None
+
+
+def _compile_explainer(document: dict, schema: dict, closed: bool = False) -> Validator:
+    """
+    Compiles the schema into nested validators, that find the first error of a value and raise it with its path
+    """
+    schema = resolve_ref(document, schema)
+    schema_type = schema.get("type")
+
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        required = schema.get("required", [])
+        # in the order of the schema: (name, the types of a scalar property, the validator of the others)
+        checks = []
+        for name, property_schema in properties.items():
+            types = _simple_types(document, property_schema)
+            checks.append((name, types, None if types is not None else _compile_explainer(
+                document, property_schema, closed)))
+
+        def validate_object(value: Any):
+            if type(value) is not dict:
+                raise SchemaError("type", "", "object", value)
+            if closed:
+                for key in value:
+                    if key not in properties:
+                        raise SchemaError("unknown", key, key, value[key])
+            for name in required:
+                if name not in value:
+                    raise SchemaError("missing", name, name)
+            for name, types, validator in checks:
+                if name not in value:
+                    continue
+                if types is not None:
+                    if type(value[name]) not in types:
+                        raise SchemaError("type", name, resolve_ref(document, properties[name])["type"],
+                                          value[name])
+                    continue
+                try:
+                    validator(value[name])
+                except SchemaError as e:
+                    raise e.within(name)
+
+        return validate_object
+
+    if schema_type == "array":
+        items = schema.get("items", {})
+        item_types = _simple_types(document, items)
+        item_type_name = resolve_ref(document, items).get("type")
+        validate_item = _compile_explainer(document, items, closed) if item_types is None else None
+
+        def validate_array(value: Any):
+            if type(value) is not list:
+                raise SchemaError("type", "", "array", value)
+            if item_types is not None:
+                for index, item in enumerate(value):
+                    if type(item) not in item_types:
+                        raise SchemaError("type", f"[{index}]", item_type_name, item)
+                return
+            for index, item in enumerate(value):
+                try:
+                    validate_item(item)
+                except SchemaError as e:
+                    raise e.within(f"[{index}]")
+
+        return validate_array
+
+    if schema_type in _TYPES:
+        types = _TYPES[schema_type]
+
+        def validate_scalar(value: Any):
+            if type(value) not in types:
+                raise SchemaError("type", "", schema_type, value)
+
+        return validate_scalar
+
+    # no type: anything is valid
+    return lambda value: None
+
+
+def _generate_check(document: dict, schema: dict, closed: bool, value: str, indent: int, lines: List[str],
+                    constants: Dict[str, Any]):
+    """
+    Appends to lines the python statements that return False if value (the name of a local variable) does not
+    match the schema
+    """
+    schema = resolve_ref(document, schema)
+    schema_type = schema.get("type")
+    if schema_type not in _TYPES:
+        return
+    pad = "    " * indent
+    types = _TYPES[schema_type]
+    name = f"_c{len(constants)}"
+    constants[name] = types[0] if len(types) == 1 else types
+    lines.append(f"{pad}if type({value}) {'is not' if len(types) == 1 else 'not in'} {name}: return False")
+
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        required = schema.get("required", [])
+        if closed:
+            name = f"_c{len(constants)}"
+            constants[name] = frozenset(properties)
+            lines.append(f"{pad}if not {value}.keys() <= {name}: return False")
+        for property_name in required:
+            lines.append(f"{pad}if {property_name!r} not in {value}: return False")
+        for property_name, property_schema in properties.items():
+            local = f"_v{len(lines)}"
+            if property_name in required:
+                lines.append(f"{pad}{local} = {value}[{property_name!r}]")
+                _generate_check(document, property_schema, closed, local, indent, lines, constants)
+            else:
+                lines.append(f"{pad}{local} = {value}.get({property_name!r}, _MISSING)")
+                lines.append(f"{pad}if {local} is not _MISSING:")
+                checks = len(lines)
+                _generate_check(document, property_schema, closed, local, indent + 1, lines, constants)
+                if len(lines) == checks:
+                    lines.append(f"{pad}    pass")
+
+    elif schema_type == "array":
+        local = f"_v{len(lines)}"
+        lines.append(f"{pad}for {local} in {value}:")
+        checks = len(lines)
+        _generate_check(document, schema.get("items", {}), closed, local, indent + 1, lines, constants)
+        if len(lines) == checks:
+            lines.append(f"{pad}    break")
+
+
+def compile_schema(document: dict, schema: dict, closed: bool = False) -> Validator:
+    """
+    Compiles the schema into a validator, once: the $refs are resolved, and the checks of the whole schema are
+    generated as the source of a single python function, without a call per value. When it fails, the value is
+    checked again by nested validators, which find the error and its path.
+    Supports type, properties, required and items, the other keywords (format, description...) are ignored.
+    :param document: the openapi document, in which the $refs are resolved
+    :param closed: whether the objects reject the properties that are not in their schema
+    """
+    lines: List[str] = []
+    constants: Dict[str, Any] = {"_MISSING": object()}
+    _generate_check(document, schema, closed, "value", 1, lines, constants)
+    source = "def check(value):\n" + "\n".join(lines + ["    return True"]) + "\n"
+    exec(compile(source, "<schema validator>", "exec"), constants)
+    check = constants["check"]
+    explain = _compile_explainer(document, schema, closed)
+
+    def validate(value: Any):
+        if not check(value):
+            explain(value)
+
+    return validate
+
+
+def request_body_validator(document: dict, path: str, method: str = "post", closed: bool = False) -> Validator:
+    """
+    :return: the validator of the application/json request body of the route
+    """
+    body = resolve_ref(document, document["paths"][path][method]["requestBody"])
+    return compile_schema(document, body["content"]["application/json"]["schema"], closed)
+
+
+class RequestValidators:
+    """
+    The validators of the request bodies of the API routes, compiled once from the schemas of docs/openapi.json
+    """
+    shorten: Validator
+    shorten_entry: Validator
+    shorten_custom: Validator
+    reserve_slug: Validator
+    resolve: Validator
+
+    def __init__(self, openapi_path: Path = OPENAPI_PATH):
+        with open(openapi_path, "r") as f:
+            document = json.load(f)
+        # the entries of /api/shorten, and the NDJSON lines, have always been rejected with an unknown key
+        self.shorten = request_body_validator(document, "/api/shorten", closed=True)
+        self.shorten_entry = compile_schema(
+            document, resolve_ref(document, {"$ref": "#/components/schemas/shortened-url-request-array"})["items"],
+            closed=True)
+        self.shorten_custom = request_body_validator(document, "/api/shorten/custom")
+        self.reserve_slug = request_body_validator(document, "/api/reserve-slug")
+        self.resolve = request_body_validator(document, "/api/resolve")
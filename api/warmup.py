@@ -0,0 +1,31 @@
+import time
+
+from flask import Flask
+
+from api.repos import UrlEntryRepo
+
+
+def warm_up(flask_app: Flask, url_entry_repo: UrlEntryRepo):
+    """
+    Prepares a worker before its first request, instead of during it: opens WarmUpConnections connections of the
+    pool, builds the code filter, maps the redirect snapshot, and loads the WarmUpCacheEntries most recently used
+    urls in the url cache. Run when the application is created, so it must be created in the worker (no
+    gunicorn --preload), or the connections would be shared by the forked processes.
+    """
+    started = time.perf_counter()
+    with flask_app.app_context():
+        engine = url_entry_repo.db.get_engine(flask_app)
+        # the connections beyond the size of the pool would be closed as soon as they are returned
+        size = min(flask_app.config["WarmUpConnections"], getattr(engine.pool, "size", lambda: 1)())
+        connections = [engine.connect() for _ in range(size)]
+        for connection in connections:
+            connection.close()
+
+        if url_entry_repo.code_filter is not None and not url_entry_repo.code_filter.ready:
+            url_entry_repo.build_code_filter()
+        snapshot_entries = url_entry_repo.snapshot.preload() if url_entry_repo.snapshot is not None else 0
+        cached = url_entry_repo.preload_cache(flask_app.config["WarmUpCacheEntries"])
+        url_entry_repo.db.session.remove()
+
+    flask_app.logger.info(f"Warmed up in {time.perf_counter() - started:.2f}s: {size} connections, "
+                          f"{snapshot_entries} snapshot entries, {cached} cached urls")
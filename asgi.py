@@ -0,0 +1,4 @@
+from api.asgi_app import RedirectApp
+
+# serves only the redirect routes, run with: uvicorn asgi:app
+app = RedirectApp()
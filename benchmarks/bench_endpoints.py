@@ -0,0 +1,160 @@
+"""
+Load test of the HTTP endpoints against a seeded local database.
+
+run: migrates and seeds the database from DATABASE_URL (sqlite or postgres) with --rows url entries, starts
+    gunicorn wsgi:app (or targets --host/--port of a running server), drives each scenario with --concurrency
+    clients for --duration seconds, and writes the p50/p95/p99 latencies and the throughput to a JSON file
+    (benchmarks/results/<commit>.json by default).
+compare: prints the difference between two result files, and fails if a throughput dropped or a p99 latency grew
+    by more than --threshold percent.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/shortener_bench python -m benchmarks.bench_endpoints run --rows 5000000
+    python -m benchmarks.bench_endpoints compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Callable
+
+from benchmarks.http_client import run_load, percentile, wait_for_port, Request
+from benchmarks.seed import create_app, seed_database, seeded_url
+
+RESULTS_DIR = Path(__file__).parent / "results"
+TOKEN = "benchmark"
+
+
+def scenarios(rows: int, token: str) -> Dict[str, Callable[[], Request]]:
+    auth = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+    def redirect():
+        # the seeded urls without a company slug are the ones where i % 10 != 0
+        _, code = seeded_url(random.randrange(rows // 10) * 10 + random.randrange(1, 10))
+        return "GET", "/" + code, {"User-Agent": "benchmark"}, None
+
+    def company_redirect():
+        slug, code = seeded_url(random.randrange(rows // 10) * 10)
+        return "GET", f"/{slug}/{code}", {"User-Agent": "benchmark"}, None
+
+    def shorten():
+        body = [{"sms_record_id": uuid.uuid4().hex, "original_url": f"https://example.com/{i}"} for i in range(10)]
+        return "POST", "/api/shorten", auth, json.dumps(body).encode()
+
+    def reserve_slug():
+        body = {"companyId": f"company{random.randrange(1000)}", "slug": f"bench{random.randrange(100_000)}"}
+        return "POST", "/api/reserve-slug", auth, json.dumps(body).encode()
+
+    return {"redirect": redirect, "company_redirect": company_redirect, "shorten": shorten,
+            "reserve_slug": reserve_slug}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args):
+    if "DATABASE_URL" not in os.environ:
+        sys.exit("DATABASE_URL is not set")
+    with create_app().app_context():
+        dialect_name = seed_database(args.rows)
+
+    process = None
+    if args.port is None:
+        args.port = 8500
+        env = {"ReservationDurationInSeconds": "900", **os.environ, "UrlShortenerAllowedKey": args.token}
+        process = subprocess.Popen(["gunicorn", "-w", str(args.workers), "-b", f"{args.host}:{args.port}",
+                                    "wsgi:app"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await wait_for_port(args.host, args.port)
+        results = {}
+        for name, next_request in scenarios(args.rows, args.token).items():
+            if args.scenario and name not in args.scenario:
+                continue
+            latencies, statuses, errors = await run_load(args.host, args.port, next_request, args.concurrency,
+                                                         args.duration)
+            latencies.sort()
+            results[name] = {
+                "requests": len(latencies),
+                "throughput": len(latencies) / args.duration,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "statuses": statuses,
+                "errors": errors,
+            }
+            print(f"{name:<18} {results[name]['throughput']:>9,.0f} req/s   p50 {results[name]['p50_ms']:7.2f} ms   "
+                  f"p95 {results[name]['p95_ms']:7.2f} ms   p99 {results[name]['p99_ms']:7.2f} ms   "
+                  f"statuses {statuses}   errors {errors}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    commit = git_commit()
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "commit": commit, "date": datetime.now().isoformat(), "database": dialect_name, "rows": args.rows,
+        "workers": args.workers, "concurrency": args.concurrency, "duration": args.duration, "scenarios": results,
+    }, indent=2))
+    print(f"Results written to {output}")
+
+
+def compare(args):
+    old, new = (json.loads(Path(x).read_text()) for x in (args.old, args.new))
+    regressions = 0
+    print(f"{'scenario':<18} {'throughput':>24} {'p99 ms':>24}   ({old['commit']} -> {new['commit']})")
+    for name, new_result in new["scenarios"].items():
+        old_result = old["scenarios"].get(name)
+        if old_result is None:
+            continue
+        throughput_change = (new_result["throughput"] / old_result["throughput"] - 1) * 100
+        p99_change = (new_result["p99_ms"] / old_result["p99_ms"] - 1) * 100
+        regressed = throughput_change < -args.threshold or p99_change > args.threshold
+        regressions += regressed
+        print(f"{name:<18} {old_result['throughput']:>9,.0f} -> {new_result['throughput']:>9,.0f} "
+              f"({throughput_change:+5.1f}%) {old_result['p99_ms']:>7.2f} -> {new_result['p99_ms']:>7.2f} "
+              f"({p99_change:+5.1f}%){'   REGRESSION' if regressed else ''}")
+    if regressions:
+        sys.exit(f"{regressions} scenarios regressed by more than {args.threshold}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--rows", type=int, default=1_000_000, help="the number of seeded url entries")
+    run_parser.add_argument("--workers", type=int, default=4, help="the number of gunicorn workers")
+    run_parser.add_argument("--concurrency", type=int, default=32, help="the number of concurrent clients")
+    run_parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    run_parser.add_argument("--scenario", action="append", help="run only this scenario (repeatable)")
+    run_parser.add_argument("--host", default="127.0.0.1")
+    run_parser.add_argument("--port", type=int, help="port of a running server, gunicorn is started otherwise")
+    run_parser.add_argument("--token", default=TOKEN, help="the UrlShortenerAllowedKey of the server")
+    run_parser.add_argument("--output", help="the result file")
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10, help="allowed regression, in percent")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(run(args))
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
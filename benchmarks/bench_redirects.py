@@ -0,0 +1,72 @@
+"""
+Redirect throughput of the WSGI application (gunicorn wsgi:app) against the ASGI redirect server (uvicorn asgi:app),
+with the same number of worker processes and concurrent keep-alive connections.
+
+The database from DATABASE_URL is migrated and seeded with --rows url entries (see benchmarks/seed.py).
+
+Usage: DATABASE_URL=postgresql://localhost/shortener python -m benchmarks.bench_redirects \
+    [--workers 4] [--concurrency 64] [--duration 10] [--rows 100000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+
+from benchmarks.http_client import run_load, percentile, wait_for_port
+from benchmarks.seed import create_app, seed_database, seeded_url
+
+HOST = "127.0.0.1"
+SERVERS = {
+    "wsgi (gunicorn)": lambda port, workers: ["gunicorn", "-w", str(workers), "-b", f"{HOST}:{port}", "wsgi:app"],
+    "asgi (uvicorn)": lambda port, workers: ["uvicorn", "asgi:app", "--workers", str(workers), "--host", HOST,
+                                             "--port", str(port), "--log-level", "warning", "--no-access-log"],
+}
+
+
+async def bench_server(name: str, port: int, args, codes) -> float:
+    env = {"ReservationDurationInSeconds": "900", "UrlShortenerAllowedKey": "benchmark", **os.environ}
+    process = subprocess.Popen(SERVERS[name](port, args.workers), env=env, stdout=subprocess.DEVNULL)
+    try:
+        await wait_for_port(HOST, port)
+
+        def next_request():
+            return "GET", "/" + random.choice(codes), {"User-Agent": "benchmark"}, None
+
+        latencies, statuses, errors = await run_load(HOST, port, next_request, args.concurrency, args.duration)
+        latencies.sort()
+        throughput = len(latencies) / args.duration
+        print(f"{name:<16} {throughput:>10,.0f} req/s   p50 {percentile(latencies, 0.5) * 1000:7.2f} ms   "
+              f"p99 {percentile(latencies, 0.99) * 1000:7.2f} ms   statuses {statuses}   errors {errors}")
+        return throughput
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10, help="seconds per server")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--port", type=int, default=8400)
+    args = parser.parse_args()
+
+    if "DATABASE_URL" not in os.environ:
+        sys.exit("DATABASE_URL is not set")
+    with create_app().app_context():
+        seed_database(args.rows)
+    # the seeded urls without a company slug
+    codes = [seeded_url(i)[1] for i in range(args.rows) if i % 10 != 0]
+
+    results = {}
+    for offset, name in enumerate(SERVERS):
+        results[name] = await bench_server(name, args.port + offset, args, codes)
+    wsgi, asgi = results.values()
+    print(f"asgi / wsgi throughput: {asgi / wsgi:.2f}x")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,32 @@
+"""
+Codes per second of the per-call and the batch code generation.
+
+Usage: python -m benchmarks.bench_short_func [--count 100000]
+"""
+import argparse
+import time
+
+from api.short_func import UUID4BasedURLShortener
+
+
+def codes_per_second(generate, count: int) -> float:
+    start = time.perf_counter()
+    generate(count)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100_000, help="the number of codes generated per run")
+    args = parser.parse_args()
+
+    per_call = codes_per_second(lambda n: [UUID4BasedURLShortener.get_shorter_url_for("https://example.com/")
+                                           for _ in range(n)], args.count)
+    batch = codes_per_second(UUID4BasedURLShortener.get_shorter_urls_for, args.count)
+
+    print(f"get_shorter_url_for:  {per_call:>12,.0f} codes/s")
+    print(f"get_shorter_urls_for: {batch:>12,.0f} codes/s ({batch / per_call:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Time spent parsing, validating and serializing a shorten batch, with the standard library json module and with
+orjson (if installed), outside of Flask and the database.
+
+Usage: python -m benchmarks.bench_validation [--entries 10000] [--repeat 20]
+"""
+import argparse
+import json
+import time
+
+from api.json_provider import orjson
+from api.validation import RequestValidators
+
+
+def best_of(function, repeat: int) -> float:
+    """
+    :return: the fastest of repeat runs, in milliseconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=10_000, help="the number of entries of the batch")
+    parser.add_argument("--repeat", type=int, default=20, help="the number of runs, the fastest one is reported")
+    args = parser.parse_args()
+
+    entries = [{"sms_record_id": f"{i:015d}", "original_url": f"https://example.com/campaign/{i}?utm_source=sms"}
+               for i in range(args.entries)]
+    body = json.dumps(entries).encode()
+    response = [dict(entry, shortened_url=f"c{i:05d}") for i, entry in enumerate(entries)]
+    validators = RequestValidators()
+
+    codecs = {"json": (json.loads, lambda value: json.dumps(value, separators=(",", ":"), sort_keys=True).encode())}
+    if orjson is not None:
+        codecs["orjson"] = (orjson.loads, lambda value: orjson.dumps(value, option=orjson.OPT_SORT_KEYS))
+
+    validate = best_of(lambda: validators.shorten(entries), args.repeat)
+    print(f"{args.entries:,} entries, request of {len(body) / 1e6:.1f} MB")
+    print(f"{'':8} {'parse':>10} {'validate':>10} {'serialize':>10} {'total':>10}")
+    for name, (loads, dumps) in codecs.items():
+        parse = best_of(lambda: loads(body), args.repeat)
+        serialize = best_of(lambda: dumps(response), args.repeat)
+        print(f"{name:8} {parse:>8.2f}ms {validate:>8.2f}ms {serialize:>8.2f}ms {parse + validate + serialize:>8.2f}ms")
+    if orjson is None:
+        print("orjson is not installed, pip install orjson to compare")
+
+
+if __name__ == '__main__':
+    main()
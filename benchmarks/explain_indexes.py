@@ -0,0 +1,104 @@
+"""
+Checks that every repository query is answered with an index, on a seeded database.
+
+The database from DATABASE_URL (postgres or sqlite) is migrated to the latest revision, seeded up to --rows url entries
+(and --rows / 100 slug reservations), then the repository methods are called and each SELECT/UPDATE/DELETE they send
+is run again under EXPLAIN. The check fails if a plan scans url_entry_model or slug_reservation sequentially.
+Seeding is incremental, so the check can be repeated on the same database.
+
+Usage: DATABASE_URL=postgresql://localhost/shortener python -m benchmarks.explain_indexes [--rows 10000000]
+"""
+import argparse
+import sys
+from typing import List, Tuple, Callable
+
+from sqlalchemy import event
+
+from api.models import db
+from api.repos import UrlEntryRepo, SlugReservationRepo
+from benchmarks.seed import create_app, seed_database
+
+_TABLES = ("url_entry_model", "slug_reservation")
+
+
+def repo_queries(url_repo: UrlEntryRepo, slug_repo: SlugReservationRepo) -> List[Tuple[str, Callable]]:
+    return [
+        ("UrlEntryRepo.by_company_slug_and_shorten_url",
+         lambda: url_repo.by_company_slug_and_shorten_url("", "c12341", True)),
+        ("UrlEntryRepo.existing_short_urls", lambda: url_repo.existing_short_urls(["c12341", "c12342", "zzzzzz"])),
+        ("UrlEntryRepo.resolve_many", lambda: url_repo.resolve_many([("", "c12341"), ("slug0", "c10"), ("", "zz")])),
+        ("UrlEntryRepo.existing_codes", lambda: url_repo.existing_codes("", [("r12341", "https://example.com/")])),
+        ("UrlEntryRepo.add", lambda: url_repo.add("explain", "https://example.com/", "explain", "")),
+        ("SlugReservationRepo.reserve", lambda: slug_repo.reserve("company1234", "s1234")),
+        ("SlugReservationRepo.by_company_not_expired", lambda: slug_repo.by_company_not_expired("company1234")),
+        ("UrlEntryRepo.unsynced_batch", lambda: url_repo.unsynced_batch(("slug1", "c1"), 1000)),
+        ("SlugReservationRepo.unsynced_batch", lambda: slug_repo.unsynced_batch("s1", 1000)),
+        ("UrlEntryRepo.delete_expired", lambda: url_repo.delete_expired(1000)),
+        ("SlugReservationRepo.delete_expired", lambda: slug_repo.delete_expired(1000)),
+    ]
+
+
+def sequential_scans(connection, dialect_name: str, statement: str, parameters) -> Tuple[List[str], str]:
+    """
+    :return: the sequentially scanned tables, and the plan as text
+    """
+    if dialect_name == "postgresql":
+        plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()[0]["Plan"]
+        nodes, scans, lines = [(plan, 0)], [], []
+        while nodes:
+            node, depth = nodes.pop()
+            lines.append("  " * depth + f"{node['Node Type']} {node.get('Index Name', node.get('Relation Name', ''))}")
+            if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in _TABLES:
+                scans.append(node["Relation Name"])
+            nodes.extend((child, depth + 1) for child in reversed(node.get("Plans", [])))
+        return scans, "\n".join(lines)
+
+    details = [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+    partial_indexes = {row[0] for row in connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'")}
+    # sqlite: SEARCH uses an index to find the rows, SCAN reads the whole table (or the whole index), which is
+    # only acceptable for a partial index
+    scans = [table for detail in details for table in _TABLES
+             if detail.startswith(f"SCAN {table}") and detail.rsplit(" ", 1)[-1] not in partial_indexes]
+    return scans, "\n".join(details)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="the number of url entries to seed")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        dialect_name = seed_database(args.rows)
+
+        captured = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().split(None, 1)[0].upper() in ("SELECT", "UPDATE", "DELETE"):
+                captured.append((statement, parameters))
+
+        failures = 0
+        url_repo, slug_repo = UrlEntryRepo(app, db), SlugReservationRepo(app, db)
+        for name, query in repo_queries(url_repo, slug_repo):
+            captured.clear()
+            event.listen(db.engine, "before_cursor_execute", capture)
+            try:
+                query()
+                db.session.rollback()
+            finally:
+                event.remove(db.engine, "before_cursor_execute", capture)
+
+            with db.engine.connect() as connection:
+                for statement, parameters in captured:
+                    scans, plan = sequential_scans(connection, dialect_name, statement, parameters)
+                    failures += bool(scans)
+                    print(f"[{'FAIL' if scans else ' OK '}] {name}\n    " + plan.replace("\n", "\n    "))
+
+    if failures:
+        sys.exit(f"{failures} queries scan the tables sequentially")
+    print("All the repository queries use an index")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Minimal asyncio HTTP/1.1 load generator, so that the benchmarks do not need a third party client.
+"""
+import asyncio
+import time
+from typing import Callable, Tuple, List, Optional, Dict
+
+# (method, path, headers, body)
+Request = Tuple[str, str, Dict[str, str], Optional[bytes]]
+
+
+class Connection:
+    """
+    A keep-alive connection, reopened when the server closes it (gunicorn sync workers close after every response)
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method: str, path: str, headers: Dict[str, str], body: Optional[bytes]) -> int:
+        """
+        :return: the status code, the body is read and discarded
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+
+        head = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        status = int(head[0].split(" ", 2)[1])
+        response_headers = {k.lower(): v.strip() for k, _, v in (x.partition(":") for x in head[1:] if x)}
+        if "content-length" in response_headers:
+            await self.reader.readexactly(int(response_headers["content-length"]))
+        elif response_headers.get("transfer-encoding") == "chunked":
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.read()
+            response_headers["connection"] = "close"
+
+        if response_headers.get("connection", "").lower() == "close":
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run_load(host: str, port: int, next_request: Callable[[], Request], concurrency: int,
+                   duration: float) -> Tuple[List[float], Dict[int, int], int]:
+    """
+    Runs concurrency clients, each sending requests back to back for duration seconds
+    :param next_request: returns the next request to send
+    :return: the latencies in seconds, the number of responses per status code, and the number of failed requests
+    """
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        connection = Connection(host, port)
+        while time.perf_counter() < deadline:
+            method, path, headers, body = next_request()
+            start = time.perf_counter()
+            try:
+                status = await connection.request(method, path, headers, body)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                connection.close()
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+        connection.close()
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, statuses, errors
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def wait_for_port(host: str, port: int, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
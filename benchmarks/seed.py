@@ -0,0 +1,88 @@
+"""
+Seeding of a local database for the benchmarks, generated by the database itself so that millions of rows take
+seconds. Seeding is incremental: rows 0..n-1 always get the same values, and only the missing rows are inserted.
+"""
+import time
+from pathlib import Path
+from typing import Tuple
+
+from flask import Flask
+from flask_migrate import Migrate, upgrade
+from sqlalchemy import text
+
+from api.models import db
+from api.repos import config_app_with_db
+
+_SEED_CHUNK = 1_000_000
+
+# i is bound to the row number by the dialect specific row generators below
+_URL_ENTRY = ('"companySlug", id, "recordId", "longUrl", used, "lastUsed", synced', """
+    CASE WHEN i % 10 = 0 THEN 'slug' || (i % 1000) ELSE '' END, 'c' || i, 'r' || i,
+    'https://example.com/campaign?utm_source=sms&recipient=' || i, i % 50, {last_used}, i % 100 <> 0
+""")
+_SLUG_RESERVATION = ('slug, "by", permanent, created, expires, synced', """
+    's' || i, 'company' || (i % 5000), i % 3 = 0, {now}, CASE WHEN i % 3 = 0 THEN NULL ELSE {expires} END, i % 100 <> 0
+""")
+_DIALECT_SQL = {
+    "postgresql": {
+        "rows": "FROM generate_series(:start, :end) AS i",
+        "last_used": "now() - (i % 1000) * interval '1 hour'",
+        "now": "now()",
+        "expires": "now() + ((i % 60) - 30) * interval '1 minute'",
+    },
+    "sqlite": {
+        "rows": "FROM (WITH RECURSIVE seq(i) AS (SELECT :start UNION ALL SELECT i + 1 FROM seq WHERE i < :end) "
+                "SELECT i FROM seq)",
+        "last_used": "datetime('now', '-' || (i % 1000) || ' hours')",
+        "now": "datetime('now')",
+        "expires": "datetime('now', ((i % 60) - 30) || ' minutes')",
+    },
+}
+
+
+def seeded_url(i: int) -> Tuple[str, str]:
+    """
+    :return: the (companySlug, id) of the seeded url entry number i
+    """
+    return ("slug" + str(i % 1000) if i % 10 == 0 else ""), "c" + str(i)
+
+
+def create_app() -> Flask:
+    """
+    :return: a bare application on the DATABASE_URL database, with Flask-Migrate configured
+    """
+    app = Flask(__name__)
+    app.config["ReservationDuration"] = 900
+    config_app_with_db(app, db)
+    Migrate(app, db, directory=str(Path(__file__).parent.parent / "migrations"))
+    return app
+
+
+def _seed_table(table: str, columns: Tuple[str, str], target: int, dialect: dict):
+    names, values = columns
+    existing = db.session.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+    for start in range(existing, target, _SEED_CHUNK):
+        end = min(start + _SEED_CHUNK, target) - 1
+        started = time.perf_counter()
+        db.session.execute(text(f"INSERT INTO {table} ({names}) SELECT {values.format(**dialect)} {dialect['rows']}"),
+                           {"start": start, "end": end})
+        db.session.commit()
+        print(f"seeded {table} rows {start}..{end} in {time.perf_counter() - started:.1f}s")
+
+
+def seed_database(rows: int) -> str:
+    """
+    Migrates the database to the latest revision, and seeds it with rows url entries and rows / 100 slug
+    reservations. Must be called inside the application context of create_app().
+    :return: the name of the database dialect
+    """
+    upgrade()
+    dialect_name = db.engine.dialect.name
+    if dialect_name not in _DIALECT_SQL:
+        raise ValueError(f"Unsupported database: {dialect_name}")
+
+    _seed_table("url_entry_model", _URL_ENTRY, rows, _DIALECT_SQL[dialect_name])
+    _seed_table("slug_reservation", _SLUG_RESERVATION, rows // 100, _DIALECT_SQL[dialect_name])
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+    return dialect_name
@@ -0,0 +1,32 @@
+"""unique short urls across the company slugs
+
+Revision ID: 4c2d9e7f1a63
+Revises: 2f190a354f79
+Create Date: 2026-10-18 09:12:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c2d9e7f1a63'
+down_revision = '2f190a354f79'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the application checked the uniqueness before inserting, so duplicates can only come from concurrent inserts
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT id FROM url_entry_model GROUP BY id HAVING COUNT(*) > 1 LIMIT 10')).scalars().all()
+    if duplicates:
+        raise RuntimeError(f"url_entry_model has short urls used under several company slugs: {duplicates}. Give "
+                           f"them a new code before running this migration again.")
+    op.drop_index('ix_url_entry_model_id', table_name='url_entry_model')
+    op.create_index('ix_url_entry_model_id', 'url_entry_model', ['id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_url_entry_model_id', table_name='url_entry_model')
+    op.create_index('ix_url_entry_model_id', 'url_entry_model', ['id'], unique=False)
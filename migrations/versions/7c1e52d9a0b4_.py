@@ -0,0 +1,29 @@
+"""index of the expiry of the temporary slug reservations
+
+Revision ID: 7c1e52d9a0b4
+Revises: e66fa35cd290
+Create Date: 2026-10-18 13:41:05.218377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e52d9a0b4'
+down_revision = 'e66fa35cd290'
+branch_labels = None
+depends_on = None
+
+TEMPORARY = sa.text('permanent IS NOT TRUE')
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_slug_reservation_expires', 'slug_reservation', ['expires'], unique=False,
+                        postgresql_where=TEMPORARY, sqlite_where=TEMPORARY, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_slug_reservation_expires', table_name='slug_reservation', postgresql_concurrently=True)
@@ -0,0 +1,39 @@
+"""indexes for the repository queries
+
+Revision ID: e66fa35cd290
+Revises: 48f20796c933
+Create Date: 2026-10-18 10:03:17.482913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e66fa35cd290'
+down_revision = '48f20796c933'
+branch_labels = None
+depends_on = None
+
+UNSYNCED = sa.text('synced IS NOT TRUE')
+
+
+def upgrade():
+    # the indexes are built without locking the tables for writes on postgres, which cannot happen in a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_url_entry_model_id', 'url_entry_model', ['id'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_url_entry_model_unsynced', 'url_entry_model', ['companySlug', 'id'], unique=False,
+                        postgresql_where=UNSYNCED, sqlite_where=UNSYNCED, postgresql_concurrently=True)
+        op.create_index('ix_slug_reservation_by', 'slug_reservation', ['by', 'permanent', 'expires'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_slug_reservation_unsynced', 'slug_reservation', ['slug'], unique=False,
+                        postgresql_where=UNSYNCED, sqlite_where=UNSYNCED, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_slug_reservation_unsynced', table_name='slug_reservation', postgresql_concurrently=True)
+        op.drop_index('ix_slug_reservation_by', table_name='slug_reservation', postgresql_concurrently=True)
+        op.drop_index('ix_url_entry_model_unsynced', table_name='url_entry_model', postgresql_concurrently=True)
+        op.drop_index('ix_url_entry_model_id', table_name='url_entry_model', postgresql_concurrently=True)
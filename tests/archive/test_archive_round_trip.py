@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from api.models import UrlEntryModel, ArchiveIndex
+from tests.database import DatabaseTestCase, HEADERS
+
+LAST_USED = datetime(2026, 1, 15, 12, 0)
+
+
+class ArchiveRoundTripTest(DatabaseTestCase):
+    """
+    Entries archived by the archive-entries command, then resolved and redirected
+    """
+    config = {"UrlCacheSize": 0}
+
+    def setUp(self):
+        super().setUp()
+        self.repo = self.services.url_entry_repo
+        self.repo.add_many([("r1", "https://a/1"), ("r2", "https://a/2")], ["AAAAAA", "BBBBBB"])
+        self.repo.add_many([("r3", "https://a/3")], ["CCCCCC"], "company")
+        self.repo.add_many([("r4", "https://a/4")], ["RECENT"])
+        table = UrlEntryModel.__table__
+        self.execute(table.update().where(table.c.id != "RECENT").values(lastUsed=LAST_USED, used=3, synced=True))
+        self.execute(table.update().where(table.c.id == "RECENT").values(synced=True))
+
+    def archive(self):
+        result = self.app.test_cli_runner().invoke(args=["archive-entries", "--batch-size", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+    def entries(self) -> dict:
+        table = UrlEntryModel.__table__
+        return {(x.companySlug, x.id): x.used for x in self.execute(select(table.c.companySlug, table.c.id,
+                                                                            table.c.used))}
+
+    def archived(self) -> list:
+        return sorted((x.companySlug, x.id) for x in self.execute(select(ArchiveIndex.__table__)))
+
+    def test_archive(self):
+        self.archive()
+        self.assertEqual(self.archived(), [("", "AAAAAA"), ("", "BBBBBB"), ("company", "CCCCCC")])
+        self.assertEqual(list(self.entries()), [("", "RECENT")])
+        # the archived codes are not issued again
+        self.assertEqual(self.repo.existing_short_urls(["AAAAAA", "CCCCCC", "DDDDDD"]), {"AAAAAA", "CCCCCC"})
+
+    def test_resolve_keeps_the_entries_archived(self):
+        self.archive()
+        response = self.client.post("/api/resolve", json=["AAAAAA", "company/CCCCCC", "RECENT", "ZZZZZZ"],
+                                    headers=HEADERS)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(x["original_url"], x["used"]) for x in response.json],
+                         [("https://a/1", 3), ("https://a/3", 3), ("https://a/4", 0), (None, None)])
+        self.assertEqual(response.json[0]["lastUsed"], LAST_USED.isoformat())
+        self.assertEqual(len(self.archived()), 3)
+
+    def test_redirect_moves_the_entry_back(self):
+        self.archive()
+        response = self.client.get("/company/CCCCCC")
+        self.assertEqual((response.status_code, response.location), (302, "https://a/3"))
+        self.assertEqual(self.entries()[("company", "CCCCCC")], 4)
+        self.assertEqual(self.archived(), [("", "AAAAAA"), ("", "BBBBBB")])
+        # moved back once
+        self.client.get("/company/CCCCCC")
+        self.assertEqual(self.entries()[("company", "CCCCCC")], 5)
+
+
+class ArchiveWriteBehindTest(ArchiveRoundTripTest):
+    """
+    The same, with the clicks written behind
+    """
+    config = {"UrlCacheSize": 0, "ClickWriteBehind": True, "ClickFlushIntervalInSeconds": 3600}
+
+    def test_redirect_moves_the_entry_back(self):
+        self.archive()
+        self.client.get("/company/CCCCCC")
+        self.services.click_counter.flush()
+        self.assertEqual(self.entries()[("company", "CCCCCC")], 4)
+        self.assertEqual(self.archived(), [("", "AAAAAA"), ("", "BBBBBB")])
+
+    def test_clicks_buffered_before_the_archiving(self):
+        for _ in range(2):
+            self.client.get("/AAAAAA")
+        self.client.get("/RECENT")
+        self.archive()
+        self.assertIn(("", "AAAAAA"), self.archived())
+
+        self.services.click_counter.flush()
+        entries = self.entries()
+        self.assertEqual((entries[("", "AAAAAA")], entries[("", "RECENT")]), (5, 1))
+        self.assertNotIn(("", "AAAAAA"), self.archived())
+        self.assertEqual(self.services.click_counter.pending_size(), 0)
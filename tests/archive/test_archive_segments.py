@@ -0,0 +1,21 @@
+from datetime import datetime
+from unittest import TestCase
+
+from api.archive import ArchivedEntry, decode_segment, encode_segment, segment_month
+
+
+class ArchiveSegmentTest(TestCase):
+
+    def test_round_trip(self):
+        entries = [ArchivedEntry("", f"code{i}", str(i), f"https://example.com/{i % 10}", i,
+                                 datetime(2026, 3, 1 + i % 28, 12, 30, 15, 123456), True) for i in range(1000)]
+        entries.append(ArchivedEntry("slug", "code0", None, "https://example.com/é", 0, None, False))
+        data = encode_segment(entries)
+
+        decoded = decode_segment(data)
+        self.assertEqual(decoded, {(x.companySlug, x.id): x for x in entries})
+        self.assertLess(len(data), len(repr(entries)) // 5)
+
+    def test_segment_month(self):
+        self.assertEqual(segment_month(datetime(2026, 2, 28, 23, 59, 59)), datetime(2026, 2, 1))
+        self.assertEqual(segment_month(datetime(2026, 12, 1)), datetime(2026, 12, 1))
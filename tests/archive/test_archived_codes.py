@@ -0,0 +1,94 @@
+import time
+from datetime import datetime
+
+from sqlalchemy import event, select
+
+from api.models import UrlEntryModel, ArchiveIndex, db
+from tests.database import DatabaseTestCase
+
+LAST_USED = datetime(2026, 1, 15, 12, 0)
+
+
+class ArchivedCodesTest(DatabaseTestCase):
+    """
+    The redirects to the missing urls, with the Bloom filter of the archived codes
+    """
+    config = {"UrlCacheSize": 0, "ArchiveFilterCapacity": 1000, "ArchiveFilterCheckIntervalInSeconds": 3600}
+
+    def setUp(self):
+        super().setUp()
+        self.repo = self.services.url_entry_repo
+        self.archived_codes = self.services.archived_codes
+        self.repo.add_many([("r1", "https://a/1")], ["AAAAAA"])
+        self.repo.add_many([("r2", "https://a/2")], ["CCCCCC"], "company")
+        self.archive()
+
+    def archive(self):
+        table = UrlEntryModel.__table__
+        self.execute(table.update().values(lastUsed=LAST_USED, synced=True))
+        result = self.app.test_cli_runner().invoke(args=["archive-entries"])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+    def load(self):
+        self.archived_codes.check_interval = 0
+        self.repo.load_archived_codes(self.archived_codes.start_load())
+
+    def archive_lookups(self, path: str) -> int:
+        """
+        :return: the number of statements on archive_index run by the redirect to path
+        """
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", capture)
+        try:
+            self.client.get(path)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", capture)
+        return sum("archive_index" in x for x in statements)
+
+    def test_missing_url_skips_the_archive_once_loaded(self):
+        # not loaded yet: the archive is looked up, and the load starts in the background
+        self.assertEqual(self.archive_lookups("/ZZZZZZ"), 1)
+        deadline = time.monotonic() + 5
+        while not self.archived_codes.codes.ready and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(self.archived_codes.codes.ready)
+
+        self.assertEqual(self.archive_lookups("/ZZZZZZ"), 0)
+        self.assertEqual(self.archive_lookups("/company/ZZZZZZ"), 0)
+        response = self.client.get("/company/CCCCCC")
+        self.assertEqual((response.status_code, response.location), (302, "https://a/2"))
+
+    def test_unarchived_entry(self):
+        self.load()
+        response = self.client.get("/AAAAAA")
+        self.assertEqual((response.status_code, response.location), (302, "https://a/1"))
+        # its archive_index row is deleted, the code stays in the filter
+        self.assertEqual([x.id for x in self.execute(select(ArchiveIndex.__table__))], ["CCCCCC"])
+        self.assertIn("AAAAAA", self.archived_codes)
+        self.assertEqual(self.archive_lookups("/AAAAAA"), 0)
+
+    def test_next_load_reads_the_new_segments(self):
+        self.load()
+        last_segment_id = self.archived_codes.last_segment_id
+        self.repo.add_many([("r3", "https://a/3")], ["NEWARC"])
+        self.archive()
+        # archived since the last load
+        self.archived_codes.check_interval = 3600
+        self.assertEqual(self.client.get("/NEWARC").status_code, 404)
+
+        self.load()
+        self.assertGreater(self.archived_codes.last_segment_id, last_segment_id)
+        response = self.client.get("/NEWARC")
+        self.assertEqual((response.status_code, response.location), (302, "https://a/3"))
+
+    def test_failed_load(self):
+        self.execute(db.text("DROP TABLE archive_segment"))
+        with self.assertLogs(self.app.logger, "WARNING"):
+            self.load()
+        # still looked up in the archive
+        self.assertFalse(self.archived_codes.codes.ready)
+        self.assertIn("ZZZZZZ", self.archived_codes)
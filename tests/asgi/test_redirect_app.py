@@ -0,0 +1,208 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+from unittest import IsolatedAsyncioTestCase, mock
+
+from sqlalchemy import event, select, create_engine
+
+import api.asgi_app
+from api.asgi_app import RedirectApp
+from api.metrics import REDIRECTS
+from api.models import UrlEntryModel, ClickEvent, LongUrl, long_url_hash, db
+from api.replicas import write_heartbeat
+from tests.database import DatabaseTestCase, ENVIRONMENT
+
+LONG_CODE = "x" * 11
+
+
+def redirects(kind: str) -> float:
+    return next((float(x.rsplit(" ", 1)[1]) for x in REDIRECTS.samples() if f'kind="{kind}"' in x), 0)
+
+
+class RedirectAppTestCase(DatabaseTestCase, IsolatedAsyncioTestCase):
+    """
+    The ASGI redirect server, on the sqlite file of the Flask application of DatabaseTestCase
+    """
+    # the environment of the ASGI application, on top of ENVIRONMENT and DATABASE_URL
+    environment: dict = {}
+
+    def setUp(self):
+        super().setUp()
+        environment = {**ENVIRONMENT, "DATABASE_URL": f"sqlite:///{self.database_path}", "UrlCacheSize": "0",
+                       **self.environment}
+        self.environment_patch = mock.patch.dict(os.environ, environment, clear=True)
+        self.environment_patch.start()
+        self.asgi = RedirectApp()
+        repo = self.services.url_entry_repo
+        repo.add_many([("r1", "https://a/1")], ["AAAAAA"])
+        repo.add_many([("r2", "https://a/2")], ["BBBBBB"], "acme")
+        past = datetime.now() - timedelta(seconds=1)
+        repo.add_many([("r3", "https://a/3")], ["EXPIRD"], expires=[past])
+        repo.add_many([("r4", "https://a/4")], ["EXPIRC"], "acme", expires=[past])
+
+    async def asyncTearDown(self):
+        await self.asgi.shutdown()
+
+    def tearDown(self):
+        self.environment_patch.stop()
+        super().tearDown()
+
+    async def request(self, path: str, method: str = "GET", user_agent: str = "Mozilla/5.0"):
+        """
+        :return: the status, the headers and the body of the response of the ASGI application
+        """
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.asgi({"type": "http", "method": method, "path": path,
+                         "headers": [(b"user-agent", user_agent.encode())]}, receive, send)
+        headers = {k.decode(): v.decode() for k, v in messages[0]["headers"]}
+        return messages[0]["status"], headers, b"".join(x.get("body", b"") for x in messages[1:])
+
+    async def lifespan(self, *messages: str):
+        """
+        Sends the lifespan messages to the ASGI application
+        :return: the messages it sent back
+        """
+        received = asyncio.Queue()
+        for message in messages:
+            received.put_nowait({"type": message})
+        sent = []
+
+        async def send(message):
+            sent.append(message["type"])
+
+        task = asyncio.create_task(self.asgi({"type": "lifespan"}, received.get, send))
+        while len(sent) < len(messages):
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return sent
+
+    def used(self) -> dict:
+        table = UrlEntryModel.__table__
+        return {(x.companySlug, x.id): x.used for x in self.execute(select(table.c.companySlug, table.c.id,
+                                                                            table.c.used))}
+
+
+class RedirectAppTest(RedirectAppTestCase):
+
+    async def test_same_responses_as_the_flask_routes(self):
+        paths = ["/AAAAAA", "/acme/BBBBBB", "/ZZZZZZ", "/acme/ZZZZZZ", "/acme/AAAAAA", "/EXPIRD", "/acme/EXPIRC",
+                 "/" + LONG_CODE, "/acme/" + LONG_CODE, "/acme/" + "x" * 51, "/api/AAAAAA", "/shorten", "/a/b/c"]
+        for path in paths:
+            with self.subTest(path=path):
+                flask_response = self.client.get(path)
+                status, headers, body = await self.request(path)
+                self.assertEqual(status, flask_response.status_code)
+                self.assertEqual(headers.get("location"), flask_response.headers.get("Location"))
+                if flask_response.is_json:
+                    self.assertEqual(json.loads(body), flask_response.json)
+        # one counted redirect by each server
+        self.assertEqual(self.used(), {("", "AAAAAA"): 2, ("acme", "BBBBBB"): 2, ("", "EXPIRD"): 0,
+                                       ("acme", "EXPIRC"): 0})
+
+    async def test_methods(self):
+        for method in ("POST", "DELETE"):
+            self.assertEqual(self.client.open("/AAAAAA", method=method).status_code, 405)
+            self.assertEqual((await self.request("/AAAAAA", method))[0], 405)
+        status, headers, body = await self.request("/AAAAAA", "HEAD")
+        self.assertEqual((status, headers["location"], body), (302, "https://a/1", b""))
+
+    async def test_previews_are_not_counted(self):
+        counted, previews = redirects("counted"), redirects("preview")
+        for user_agent in ("WhatsApp", "Mozilla/5.0", "WhatsApp"):
+            self.assertEqual((await self.request("/acme/BBBBBB", user_agent=user_agent))[0], 302)
+        self.assertEqual(self.used()[("acme", "BBBBBB")], 1)
+        self.assertEqual((redirects("counted") - counted, redirects("preview") - previews), (1, 2))
+
+    async def test_concurrent_first_requests_build_one_engine(self):
+        with mock.patch.object(api.asgi_app, "create_async_engine",
+                               wraps=api.asgi_app.create_async_engine) as create_engine:
+            responses = await asyncio.gather(*(self.request("/AAAAAA") for _ in range(8)))
+        self.assertEqual({x[0] for x in responses}, {302})
+        self.assertEqual(create_engine.call_count, 1)
+        self.assertEqual(self.used()[("", "AAAAAA")], 8)
+
+    async def test_lifespan(self):
+        self.assertEqual(await self.lifespan("lifespan.startup", "lifespan.shutdown"),
+                         ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+
+
+class RedirectAppWriteBehindTest(RedirectAppTestCase):
+    environment = {"ClickWriteBehind": "true", "ClickFlushIntervalInSeconds": "3600", "ClickEventLog": "true"}
+
+    async def test_clicks_are_written_behind(self):
+        await self.lifespan("lifespan.startup")
+        updates = []
+        event.listen(self.asgi.repo.engine.sync_engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: updates.append(statement.startswith("UPDATE")))
+        for path in ("/AAAAAA", "/AAAAAA", "/acme/BBBBBB"):
+            self.assertEqual((await self.request(path))[0], 302)
+        self.assertEqual((await self.request("/AAAAAA", user_agent="WhatsApp"))[0], 302)
+        self.assertEqual(self.asgi.repo.click_counter.pending_size(), 2)
+        self.assertEqual(self.used()[("", "AAAAAA")], 0)
+
+        self.assertEqual(await self.lifespan("lifespan.shutdown"), ["lifespan.shutdown.complete"])
+        used = self.used()
+        self.assertEqual((used[("", "AAAAAA")], used[("acme", "BBBBBB")]), (2, 1))
+        # one batched UPDATE for the clicks
+        self.assertEqual(updates.count(True), 1)
+        self.assertEqual(len(self.execute(select(ClickEvent.__table__))), 4)
+
+
+class RedirectAppArchivedCodesTest(RedirectAppTestCase):
+    environment = {"ArchiveFilterCapacity": "1000", "ArchiveFilterCheckIntervalInSeconds": "3600"}
+
+    async def test_missing_url_skips_the_archive_once_loaded(self):
+        table = UrlEntryModel.__table__
+        self.execute(table.update().where(table.c.companySlug == "acme").values(lastUsed=datetime(2026, 1, 15),
+                                                                                 synced=True))
+        result = self.app.test_cli_runner().invoke(args=["archive-entries"])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        # not loaded yet: the archive is looked up, and the load starts in a task
+        self.assertEqual((await self.request("/ZZZZZZ"))[0], 404)
+        await self.asgi.repo.archived_codes_load
+        self.assertTrue(self.asgi.repo.archived_codes.codes.ready)
+
+        statements = []
+        event.listen(self.asgi.repo.engine.sync_engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        self.assertEqual((await self.request("/acme/ZZZZZZ"))[0], 404)
+        self.assertFalse([x for x in statements if "archive_index" in x])
+        status, headers, _ = await self.request("/acme/BBBBBB")
+        self.assertEqual((status, headers["location"]), (302, "https://a/2"))
+        self.assertTrue([x for x in statements if "archive_index" in x])
+
+
+class RedirectAppReplicaTest(RedirectAppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # the replica has an entry that the primary does not have, and misses the entries of the primary
+        self.replica_path = os.path.join(self.directory.name, "replica.db")
+        os.environ["DATABASE_REPLICA_URLS"] = f"sqlite:///{self.replica_path}"
+        engine = create_engine(f"sqlite:///{self.replica_path}")
+        db.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(LongUrl.__table__.insert().values(hash=long_url_hash("https://replica"),
+                                                                 url="https://replica"))
+            connection.execute(UrlEntryModel.__table__.insert().values(
+                companySlug="", id="REPLIC", longUrlHash=long_url_hash("https://replica"), used=0, synced=True))
+        write_heartbeat(engine)
+        engine.dispose()
+
+    async def test_previews_read_the_replica(self):
+        status, headers, _ = await self.request("/REPLIC", user_agent="WhatsApp")
+        self.assertEqual((status, headers["location"]), (302, "https://replica"))
+        # a miss on the replica is read from the primary
+        status, headers, _ = await self.request("/AAAAAA", user_agent="WhatsApp")
+        self.assertEqual((status, headers["location"]), (302, "https://a/1"))
+        # a counted redirect reads the primary only
+        self.assertEqual((await self.request("/REPLIC"))[0], 404)
@@ -0,0 +1,23 @@
+from unittest import TestCase
+
+from api.bloom import BloomFilter
+
+
+class BloomFilterTest(TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(10_000, 0.01)
+        keys = [f"code{i}" for i in range(10_000)]
+        for key in keys:
+            bloom.add(key)
+
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_false_positive_rate_near_target(self):
+        bloom = BloomFilter(10_000, 0.01)
+        for i in range(10_000):
+            bloom.add(f"code{i}")
+
+        false_positives = sum(f"other{i}" in bloom for i in range(10_000))
+        self.assertLess(false_positives / 10_000, 0.02)
+        self.assertAlmostEqual(bloom.estimated_false_positive_rate(), 0.01, delta=0.005)
@@ -0,0 +1,34 @@
+import time
+from unittest import TestCase
+
+from api.cache import LRUCache
+
+
+class LRUCacheTest(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertEqual(cache.get("a"), (True, 1))
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("c"), (True, 3))
+
+    def test_negative_entries_expire(self):
+        cache = LRUCache(10, negative_ttl=0.05)
+        cache.put("missing", None)
+        self.assertEqual(cache.get("missing"), (True, None))
+
+        time.sleep(0.1)
+        self.assertEqual(cache.get("missing"), (False, None))
+
+    def test_stats(self):
+        cache = LRUCache(10)
+        cache.put("a", 1)
+        cache.get("a")
+        cache.get("b")
+
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "size": 1, "max_size": 10})
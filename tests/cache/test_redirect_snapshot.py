@@ -0,0 +1,44 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from api.snapshot import RedirectSnapshot, write_snapshot
+
+
+class RedirectSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "redirects.snapshot")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lookup(self):
+        rows = [("slug" if i % 3 == 0 else "", f"c{i}", f"https://example.com/{i}?q=ü") for i in range(5000)]
+        self.assertEqual(write_snapshot(rows, self.path), 5000)
+
+        snapshot = RedirectSnapshot(self.path)
+        for company_slug, short_url, long_url in rows:
+            self.assertEqual(snapshot.get(company_slug, short_url), long_url)
+        self.assertIsNone(snapshot.get("", "c0"))
+        self.assertIsNone(snapshot.get("slug", "missing"))
+        self.assertEqual(snapshot.stats()["entries"], 5000)
+
+    def test_missing_file(self):
+        snapshot = RedirectSnapshot(self.path)
+        self.assertIsNone(snapshot.get("", "c1"))
+        self.assertEqual(snapshot.stats()["entries"], 0)
+
+    def test_replaced_file_is_mapped_again(self):
+        write_snapshot([("", "c1", "https://old.example.com")], self.path)
+        snapshot = RedirectSnapshot(self.path, check_interval=0)
+        self.assertEqual(snapshot.get("", "c1"), "https://old.example.com")
+
+        write_snapshot([("", "c1", "https://old.example.com"), ("", "c2", "https://new.example.com")], self.path)
+        self.assertEqual(snapshot.get("", "c2"), "https://new.example.com")
+        self.assertEqual(snapshot.stats()["entries"], 2)
+
+    def test_empty_snapshot(self):
+        write_snapshot([], self.path)
+        self.assertIsNone(RedirectSnapshot(self.path).get("", "c1"))
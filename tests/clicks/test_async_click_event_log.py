@@ -0,0 +1,77 @@
+import asyncio
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine, select, func, event
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from api.clicks import AsyncClickEventLog
+from api.models import ClickEvent, UrlEntryModel, LongUrl
+from api.repos import AsyncUrlEntryRepo
+
+
+class AsyncClickEventLogTest(TestCase):
+    """
+    The click events of the ASGI redirect server, inserted in batches into a sqlite file
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "clicks.db")
+        self.engine = create_engine(f"sqlite:///{path}")
+        for model in (ClickEvent, UrlEntryModel, LongUrl):
+            model.__table__.create(self.engine)
+        self.async_url = f"sqlite+aiosqlite:///{path}"
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def events(self) -> int:
+        with self.engine.connect() as connection:
+            return connection.execute(select(func.count()).select_from(ClickEvent.__table__)).scalar()
+
+    def test_batches(self):
+        statements = []
+
+        async def run():
+            engine = create_async_engine(self.async_url)
+            event.listen(engine.sync_engine, "before_cursor_execute",
+                         lambda conn, cursor, statement, *args: statements.append(statement))
+            click_log = AsyncClickEventLog(engine, max_pending=3, flush_interval=3600)
+            for i in range(3):
+                click_log.record("", f"code{i}", False)
+            # the third event wakes the flush task up
+            await asyncio.sleep(0.2)
+            self.assertEqual((self.events(), click_log.pending_size()), (3, 0))
+            click_log.record("slug", "code", True)
+            self.assertEqual(self.events(), 3)
+            await click_log.stop()
+            await engine.dispose()
+
+        asyncio.run(run())
+        self.assertEqual(self.events(), 4)
+        # one insert per batch
+        self.assertEqual(len([x for x in statements if x.startswith("INSERT INTO click_event")]), 2)
+
+    def test_redirects_are_not_inserted_one_by_one(self):
+        with self.engine.begin() as connection:
+            connection.execute(LongUrl.__table__.insert().values(hash=b"h", url="https://a/1"))
+            connection.execute(UrlEntryModel.__table__.insert().values(companySlug="", id="AAAAAA", longUrlHash=b"h",
+                                                                       used=0, synced=False))
+
+        async def run():
+            engine = create_async_engine(self.async_url)
+            click_log = AsyncClickEventLog(engine, max_pending=1000, flush_interval=3600)
+            repo = AsyncUrlEntryRepo(engine, click_log=click_log)
+            for count in (True, True, False):
+                self.assertEqual(await repo.by_company_slug_and_shorten_url(None, "AAAAAA", count), "https://a/1")
+            self.assertEqual((self.events(), click_log.pending_size()), (0, 3))
+            await click_log.stop()
+            await engine.dispose()
+
+        asyncio.run(run())
+        self.assertEqual(self.events(), 3)
+        with self.engine.connect() as connection:
+            self.assertEqual(connection.execute(select(UrlEntryModel.__table__.c.used)).scalar(), 2)
@@ -0,0 +1,89 @@
+import time
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy import event, select
+
+from api.models import UrlEntryModel, db
+from tests.database import DatabaseTestCase
+
+
+class ClickCounterTest(DatabaseTestCase):
+    """
+    The clicks of the redirects, written behind by the ClickCounter
+    """
+    config = {"ClickWriteBehind": True, "ClickFlushIntervalInSeconds": 3600, "UrlCacheSize": 0}
+
+    def setUp(self):
+        super().setUp()
+        self.counter = self.services.click_counter
+        self.services.url_entry_repo.add_many([("r1", "https://a/1"), ("r2", "https://a/2")], ["AAAAAA", "BBBBBB"])
+        self.services.url_entry_repo.add_many([("r3", "https://a/3")], ["CCCCCC"], "acme")
+        table = UrlEntryModel.__table__
+        self.execute(table.update().values(synced=True, lastUsed=None))
+
+    def entries(self) -> dict:
+        table = UrlEntryModel.__table__
+        return {x.id: (x.used, x.lastUsed, x.synced)
+                for x in self.execute(select(table.c.id, table.c.used, table.c.lastUsed, table.c.synced))}
+
+    def redirect(self, *paths):
+        for path in paths:
+            self.assertEqual(self.client.get(path).status_code, 302)
+
+    def test_flush_in_one_batched_update(self):
+        with mock.patch("api.clicks.atexit.register") as register:
+            self.redirect("/AAAAAA", "/AAAAAA", "/acme/CCCCCC")
+        # flushed at exit, registered once
+        register.assert_called_once_with(self.counter.flush)
+        # previews are not counted
+        self.assertEqual(self.client.get("/AAAAAA", headers={"User-Agent": "WhatsApp"}).status_code, 302)
+        started = datetime.now()
+        self.redirect("/AAAAAA")
+        self.assertEqual(self.counter.pending_size(), 2)
+        self.assertEqual(self.entries()["AAAAAA"], (0, None, True))
+
+        updates = []
+
+        def count_updates(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("UPDATE"):
+                updates.append(len(parameters) if executemany else 1)
+
+        engine = db.get_engine(self.app)
+        event.listen(engine, "before_cursor_execute", count_updates)
+        try:
+            self.counter.flush()
+        finally:
+            event.remove(engine, "before_cursor_execute", count_updates)
+        self.assertEqual(updates, [2])
+
+        entries = self.entries()
+        self.assertEqual((entries["AAAAAA"][0], entries["AAAAAA"][2]), (3, False))
+        self.assertGreaterEqual(entries["AAAAAA"][1], started)
+        self.assertEqual((entries["CCCCCC"][0], entries["CCCCCC"][2]), (1, False))
+        self.assertEqual(entries["BBBBBB"], (0, None, True))
+        self.assertEqual(self.counter.pending_size(), 0)
+
+    def test_counts_survive_a_failed_flush(self):
+        self.redirect("/AAAAAA", "/BBBBBB")
+        with mock.patch.object(self.counter, "_write", side_effect=RuntimeError("database down")), \
+                self.assertLogs(self.app.logger, "ERROR"):
+            self.counter.flush()
+        self.assertEqual(self.counter.pending_size(), 2)
+        self.assertEqual(self.entries()["AAAAAA"][0], 0)
+
+        # added to the restored counts
+        last_click = datetime.now()
+        self.redirect("/AAAAAA")
+        self.counter.flush()
+        entries = self.entries()
+        self.assertEqual((entries["AAAAAA"][0], entries["BBBBBB"][0]), (2, 1))
+        self.assertGreaterEqual(entries["AAAAAA"][1], last_click)
+
+    def test_full_buffer_wakes_the_flush_thread(self):
+        self.counter.max_pending = 2
+        self.redirect("/AAAAAA", "/BBBBBB")
+        deadline = time.monotonic() + 5
+        while self.entries()["BBBBBB"][0] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual((self.entries()["AAAAAA"][0], self.entries()["BBBBBB"][0]), (1, 1))
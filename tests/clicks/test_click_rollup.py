@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from api.models import ClickEvent, RollupState
+from tests.database import DatabaseTestCase, HEADERS
+
+HOUR = datetime(2026, 1, 15, 10, 0)
+
+
+class ClickRollupTest(DatabaseTestCase):
+    """
+    The hourly rollups of the click event log, and the /api/stats route that reads them
+    """
+    config = {"ClickRollupLagInSeconds": 60}
+
+    def setUp(self):
+        super().setUp()
+        self.rollup_repo = self.services.click_rollup_repo
+
+    def add_events(self, *events):
+        """
+        :param events: (minutes after HOUR, company slug, code, preview)
+        """
+        self.execute(ClickEvent.__table__.insert(), [
+            {"at": HOUR + timedelta(minutes=minutes), "companySlug": slug, "code": code, "preview": preview}
+            for minutes, slug, code, preview in events])
+
+    def watermark(self):
+        return self.execute(select(RollupState.__table__.c.lastEventId))[0].lastEventId
+
+    def stats(self, **args) -> dict:
+        response = self.client.get("/api/stats", query_string={"from": HOUR.isoformat(),
+                                                               "to": (HOUR + timedelta(days=1)).isoformat(), **args},
+                                   headers=HEADERS)
+        self.assertEqual(response.status_code, 200)
+        return response.json
+
+    def hours(self, **args) -> list:
+        return [(x["hour"], x["clicks"], x["previews"]) for x in self.stats(**args)["hours"]]
+
+    def test_rollup(self):
+        self.add_events((5, "", "AAAAAA", False), (10, "", "AAAAAA", True), (20, "", "BBBBBB", False),
+                        (70, "", "AAAAAA", False), (75, "acme", "AAAAAA", False))
+        self.assertEqual(self.rollup_repo.rollup(1000, 60), 5)
+        self.assertEqual(self.watermark(), 5)
+
+        ten, eleven = HOUR.isoformat(), (HOUR + timedelta(hours=1)).isoformat()
+        self.assertEqual(self.hours(code="AAAAAA"), [(ten, 1, 1), (eleven, 1, 0)])
+        self.assertEqual(self.hours(), [(ten, 2, 1), (eleven, 1, 0)])
+        self.assertEqual(self.hours(slug="acme"), [(eleven, 1, 0)])
+        self.assertEqual(self.stats(), {"slug": "", "code": None, "clicks": 3, "previews": 1,
+                                        "hours": self.stats()["hours"]})
+        # [from, to)
+        self.assertEqual(self.hours(to=eleven), [(ten, 2, 1)])
+        self.assertEqual(self.hours(code="CCCCCC"), [])
+
+    def test_batches_count_every_event_once(self):
+        self.add_events(*((minutes, "", "AAAAAA", False) for minutes in range(5)))
+        self.assertEqual([self.rollup_repo.rollup(2, 60) for _ in range(4)], [2, 2, 1, 0])
+        self.assertEqual(self.watermark(), 5)
+        self.add_events((30, "", "AAAAAA", False))
+        self.assertEqual(self.rollup_repo.rollup(2, 60), 1)
+        self.assertEqual(self.hours(), [(HOUR.isoformat(), 6, 0)])
+
+    def test_lag_holds_back_the_recent_events(self):
+        self.add_events((0, "", "AAAAAA", False))
+        # a recent event, then an old one committed after it
+        self.execute(ClickEvent.__table__.insert(), {"at": datetime.now(), "companySlug": "", "code": "AAAAAA",
+                                                     "preview": False})
+        self.add_events((1, "", "AAAAAA", False))
+        self.assertEqual(self.rollup_repo.rollup(1000, 60), 1)
+        self.assertEqual(self.watermark(), 1)
+        self.assertEqual(self.rollup_repo.rollup(1000, 60), 0)
+        # without the lag, the rest is added
+        self.assertEqual(self.rollup_repo.rollup(1000, 0), 2)
+        self.assertEqual(self.watermark(), 3)
+        self.assertEqual(self.hours(), [(HOUR.isoformat(), 2, 0)])
+
+    def test_rollup_clicks_command(self):
+        self.add_events(*((minutes, "", "AAAAAA", False) for minutes in range(5)))
+        result = self.app.test_cli_runner().invoke(args=["rollup-clicks", "--batch-size", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Rolled up 5 click events", result.output)
+        self.assertEqual(self.hours(), [(HOUR.isoformat(), 5, 0)])
+
+    def test_bad_requests(self):
+        response = self.client.get("/api/stats", query_string={"from": "yesterday"}, headers=HEADERS)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get("/api/stats").status_code, 401)
+        # the last 7 days by default
+        self.assertEqual(self.client.get("/api/stats", headers=HEADERS).json["hours"], [])
+
+
+class ClickEventLogRollupTest(DatabaseTestCase):
+    """
+    From the redirects to the stats
+    """
+    config = {"ClickEventLog": True, "ClickFlushIntervalInSeconds": 3600, "ClickRollupLagInSeconds": 0}
+
+    def test_redirects_are_rolled_up(self):
+        self.services.url_entry_repo.add_many([("r1", "https://a/1")], ["AAAAAA"], "acme")
+        for user_agent in ("Mozilla/5.0", "Mozilla/5.0", "WhatsApp"):
+            response = self.client.get("/acme/AAAAAA", headers={"User-Agent": user_agent})
+            self.assertEqual(response.status_code, 302)
+        self.services.click_log.flush()
+        self.assertEqual(self.services.click_rollup_repo.rollup(1000, 0), 3)
+
+        stats = self.client.get("/api/stats", query_string={"slug": "acme", "code": "AAAAAA"}, headers=HEADERS).json
+        self.assertEqual((stats["clicks"], stats["previews"]), (2, 1))
+        self.assertEqual(len(stats["hours"]), 1)
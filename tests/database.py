@@ -0,0 +1,45 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from api.app import create_app, EXTENSION_NAME, Services
+from api.models import db
+
+# the environment variables required by create_app, the others take their defaults
+ENVIRONMENT = {"ReservationDurationInSeconds": "900", "UrlShortenerAllowedKey": "test", "LogQueueSize": "0"}
+HEADERS = {"Authorization": "Bearer test"}
+
+
+class DatabaseTestCase(TestCase):
+    """
+    Creates the application on a new sqlite database for each test, with the tables of the models
+    """
+    # the configuration of the application, overriding the environment
+    config: dict = {}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.directory.name, "test.db")
+        with mock.patch.dict(os.environ, {**ENVIRONMENT, "DATABASE_URL": f"sqlite:///{self.database_path}"},
+                             clear=True):
+            self.app = create_app(self.config)
+        self.services: Services = self.app.extensions[EXTENSION_NAME]
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.get_engine(self.app).dispose()
+        self.context.pop()
+        self.directory.cleanup()
+
+    def execute(self, statement, parameters=None):
+        """
+        Runs a statement in its own transaction
+        :return: the rows of a select, None otherwise
+        """
+        with db.get_engine(self.app).begin() as connection:
+            result = connection.execute(statement, parameters or {})
+            return result.all() if result.returns_rows else None
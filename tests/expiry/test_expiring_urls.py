@@ -0,0 +1,71 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from api.errors import LinkExpired
+from api.models import UrlEntryModel, db
+from api.repos import UrlEntryRepo
+from tests.database import DatabaseTestCase
+
+
+class ExpiringUrlsTest(DatabaseTestCase):
+    config = {"UrlCacheSize": 10000}
+
+    def setUp(self):
+        super().setUp()
+        self.repo = self.services.url_entry_repo
+
+    def codes(self) -> list:
+        return sorted(x.id for x in self.execute(select(UrlEntryModel.__table__.c.id)))
+
+    def test_expired_link_answers_410(self):
+        past, future = datetime.now() - timedelta(seconds=1), datetime.now() + timedelta(hours=1)
+        self.repo.add_many([("r1", "https://a/1"), ("r2", "https://a/2")], ["EXPIRD", "ACTIVE"], expires=[past, future])
+        self.repo.add_many([("r3", "https://a/3")], ["SLUGGD"], "company", expires=[past])
+
+        response = self.client.get("/EXPIRD")
+        self.assertEqual((response.status_code, response.json), (410, "url has expired"))
+        response = self.client.get("/company/SLUGGD")
+        self.assertEqual((response.status_code, response.json), (410, "url/company combination has expired"))
+        response = self.client.get("/ACTIVE")
+        self.assertEqual((response.status_code, response.location), (302, "https://a/2"))
+
+    def test_cached_entry_expires(self):
+        self.repo.add_many([("r1", "https://a/1")], ["SOONEX"], expires=[datetime.now() + timedelta(seconds=0.3)])
+        self.assertEqual(self.repo.by_company_slug_and_shorten_url("", "SOONEX", True), "https://a/1")
+        time.sleep(0.4)
+        with self.assertRaises(LinkExpired):
+            self.repo.by_company_slug_and_shorten_url("", "SOONEX", True)
+
+    def test_delete_expired(self):
+        now = datetime.now()
+        expires = [now - timedelta(hours=3), now - timedelta(hours=2), now - timedelta(hours=1),
+                   now + timedelta(hours=1), None]
+        self.repo.add_many([(f"r{i}", f"https://a/{i}") for i in range(5)],
+                           ["OLDEST", "OLDER1", "OLDER2", "FUTURE", "NEVERX"], expires=expires)
+        # oldest first
+        self.assertEqual(self.repo.delete_expired(2), 2)
+        self.assertEqual(self.codes(), ["FUTURE", "NEVERX", "OLDER2"])
+        self.assertEqual(self.repo.delete_expired(2), 1)
+        self.assertEqual(self.repo.delete_expired(2), 0)
+        self.assertEqual(self.codes(), ["FUTURE", "NEVERX"])
+
+    def test_purge_expired_command(self):
+        self.repo.add_many([("r1", "https://a/1")], ["EXPIRD"], expires=[datetime.now() - timedelta(seconds=1)])
+        result = self.app.test_cli_runner().invoke(args=["purge-expired"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.codes(), [])
+
+    def test_code_reissued_after_purge(self):
+        # two workers: the first one caches the entries, the second one shortens
+        other_worker = UrlEntryRepo(self.app, db)
+        self.repo.add_many([("r1", "https://old")], ["ZZZZZZ"], expires=[datetime.now() - timedelta(seconds=1)])
+        with self.assertRaises(LinkExpired):
+            self.repo.by_company_slug_and_shorten_url("", "ZZZZZZ", True)
+
+        self.assertEqual(self.repo.delete_expired(1000), 1)
+        self.assertTrue(other_worker.add_many([("r2", "https://new")], ["ZZZZZZ"]))
+        self.assertEqual(self.repo.by_company_slug_and_shorten_url("", "ZZZZZZ", True), "https://new")
+        response = self.client.get("/ZZZZZZ")
+        self.assertEqual((response.status_code, response.location), (302, "https://new"))
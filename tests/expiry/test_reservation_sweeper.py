@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy import select
+
+from api.models import SlugReservation
+from api.sweeper import ReservationSweeper
+from tests.database import DatabaseTestCase
+
+
+class ReservationSweeperTest(DatabaseTestCase):
+    """
+    The batched delete of the expired temporary slug reservations
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.slug_repo = self.services.slug_repo
+        now = datetime.now()
+        self.execute(SlugReservation.__table__.insert(), [
+            # expired, in the reverse order of their slugs
+            *({"slug": f"expired{i}", "by": "c1", "permanent": False, "created": now - timedelta(hours=2),
+               "expires": now - timedelta(minutes=i + 1), "synced": True} for i in range(5)),
+            {"slug": "future", "by": "c1", "permanent": False, "created": now,
+             "expires": now + timedelta(minutes=5), "synced": True},
+            {"slug": "permanent", "by": "c2", "permanent": True, "created": now - timedelta(hours=2),
+             "expires": now - timedelta(hours=1), "synced": True},
+            {"slug": "claimed", "by": "c2", "permanent": True, "created": now, "expires": None, "synced": True},
+        ])
+
+    def slugs(self) -> list:
+        return sorted(x.slug for x in self.execute(select(SlugReservation.__table__.c.slug)))
+
+    def test_delete_expired_oldest_first(self):
+        self.assertEqual(self.slug_repo.delete_expired(2), 2)
+        self.assertEqual(self.slugs(), ["claimed", "expired0", "expired1", "expired2", "future", "permanent"])
+        self.assertEqual(self.slug_repo.delete_expired(10), 3)
+        self.assertEqual(self.slug_repo.delete_expired(10), 0)
+        self.assertEqual(self.slugs(), ["claimed", "future", "permanent"])
+
+    def test_sweep_in_batches(self):
+        sweeper = ReservationSweeper(self.app, self.slug_repo, 60, 2)
+        with mock.patch.object(self.slug_repo, "delete_expired", wraps=self.slug_repo.delete_expired) as delete:
+            self.assertEqual(sweeper.sweep(), 5)
+        # 2 + 2 + 1: the short batch ends the sweep
+        self.assertEqual([x.args for x in delete.call_args_list], [(2,), (2,), (2,)])
+        self.assertEqual(self.slugs(), ["claimed", "future", "permanent"])
+        self.assertEqual(sweeper.sweep(), 0)
+
+    def test_refreshed_reservation_is_kept(self):
+        # reserved again by its company before the sweep
+        self.assertTrue(self.slug_repo.reserve("c1", "expired4"))
+        self.assertEqual(self.slug_repo.delete_expired(10), 4)
+        self.assertEqual(self.slugs(), ["claimed", "expired4", "future", "permanent"])
+
+    def test_swept_slug_can_be_reserved_again(self):
+        ReservationSweeper(self.app, self.slug_repo, 60, 1000).sweep()
+        self.assertTrue(self.slug_repo.reserve("c3", "expired0"))
+        self.assertFalse(self.slug_repo.reserve("c3", "future"))
+        self.assertEqual(self.slug_repo.by_company_not_expired("c3"), ["expired0"])
+
+    def test_sweep_reservations_command(self):
+        result = self.app.test_cli_runner().invoke(args=["sweep-reservations", "--batch-size", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Deleted 5 expired slug reservations", result.output)
+        self.assertEqual(self.slugs(), ["claimed", "future", "permanent"])
@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+import os
+import threading
+
+from sqlalchemy import select
+
+from api.models import UrlEntryModel
+from tests.database import DatabaseTestCase
+
+
+class ExportCommandTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.services.url_entry_repo.add_many([("r1", "https://a/1"), ("r2", "https://a/2"), ("r3", "https://a/3")],
+                                              ["AAAAAA", "BBBBBB", "CCCCCC"])
+        self.services.slug_repo.reserve("company", "slug")
+
+    def export(self, *args: str) -> str:
+        result = self.app.test_cli_runner().invoke(args=["export-unsynced", *args])
+        self.assertEqual(result.exit_code, 0, result.output + repr(result.exception))
+        # before click 8.2, the summary written to stderr is mixed with the output
+        return "".join(x for x in result.output.splitlines(keepends=True) if not x.startswith("Exported "))
+
+    def unsynced(self) -> int:
+        return len(self.execute(select(UrlEntryModel.__table__.c.id).where(UrlEntryModel.__table__.c.synced == False)))
+
+    def test_ndjson_to_stdout(self):
+        rows = [json.loads(x) for x in self.export("urls", "--batch-size", "2").splitlines()]
+        self.assertEqual([x["id"] for x in rows], ["AAAAAA", "BBBBBB", "CCCCCC"])
+        self.assertEqual(rows[0]["longUrl"], "https://a/1")
+        self.assertEqual(self.unsynced(), 0)
+        # exported once
+        self.assertEqual(self.export("urls"), "")
+
+    def test_csv_to_stdout(self):
+        rows = list(csv.DictReader(io.StringIO(self.export("urls", "--format", "csv", "--batch-size", "2"))))
+        # a single header, before the first batch
+        self.assertEqual([x["id"] for x in rows], ["AAAAAA", "BBBBBB", "CCCCCC"])
+        rows = list(csv.DictReader(io.StringIO(self.export("reservations", "--format", "csv"))))
+        self.assertEqual([(x["slug"], x["by"]) for x in rows], [("slug", "company")])
+
+    def test_csv_appended_to_a_file(self):
+        path = os.path.join(self.directory.name, "urls.csv")
+        self.export("urls", "--format", "csv", "--batch-size", "2", "--output", path)
+        self.services.url_entry_repo.add_many([("r4", "https://a/4")], ["DDDDDD"])
+        self.export("urls", "--format", "csv", "--output", path)
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        # the second export is appended without a header
+        self.assertEqual([x["id"] for x in rows], ["AAAAAA", "BBBBBB", "CCCCCC", "DDDDDD"])
+
+    def test_to_a_pipe(self):
+        for sink_format in ["csv", "ndjson"]:
+            with self.subTest(sink_format):
+                self.execute(UrlEntryModel.__table__.update().values(synced=False))
+                read, write = os.pipe()
+                received = []
+                # read while the command writes, so that it never blocks on a full pipe
+                reader = threading.Thread(target=lambda: received.append(os.fdopen(read).read()))
+                reader.start()
+                try:
+                    self.export("urls", "--format", sink_format, "--output", f"/dev/fd/{write}")
+                finally:
+                    os.close(write)
+                    reader.join()
+                lines = received[0].splitlines()
+                self.assertEqual(len(lines), 4 if sink_format == "csv" else 3)
+                self.assertEqual(self.unsynced(), 0)
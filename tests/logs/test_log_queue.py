@@ -0,0 +1,64 @@
+import io
+import json
+import logging
+from unittest import TestCase
+
+from api.logs import BoundedQueueHandler, JSONFormatter, SamplingFilter, parse_sample_rates
+from api.metrics import LOG_RECORDS_DROPPED
+
+
+class LogQueueTest(TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.target = logging.StreamHandler(self.stream)
+        self.target.setFormatter(JSONFormatter())
+        self.logger = logging.getLogger(f"tests.logs.{self.id()}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def lines(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_records_are_written_as_json(self):
+        handler = BoundedQueueHandler(self.target, 100)
+        self.logger.addHandler(handler)
+        self.logger.info("shortened %d urls", 3, extra={"slug": "company"})
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            self.logger.exception("failed")
+        handler.stop()
+
+        shortened, failed = self.lines()
+        self.assertEqual((shortened["level"], shortened["message"], shortened["slug"]), ("INFO", "shortened 3 urls",
+                                                                                        "company"))
+        self.assertEqual(failed["message"], "failed")
+        self.assertIn("ValueError: bad", failed["exception"])
+
+    def test_full_queue_drops_and_counts(self):
+        handler = BoundedQueueHandler(self.target, 1)
+        # the writer thread is not started, so the queue stays full
+        handler._ensure_started = lambda: None
+        self.logger.addHandler(handler)
+        before = LOG_RECORDS_DROPPED._values.get(("WARNING", "queue_full"), 0)
+        for i in range(5):
+            self.logger.warning("record %d", i)
+        self.assertEqual(LOG_RECORDS_DROPPED._values[("WARNING", "queue_full")] - before, 4)
+        self.assertEqual(handler.queue.qsize(), 1)
+
+    def test_sampling(self):
+        handler = BoundedQueueHandler(self.target, 1000)
+        handler.addFilter(SamplingFilter(parse_sample_rates("INFO=0, debug=0.5")))
+        self.logger.addHandler(handler)
+        for i in range(200):
+            self.logger.info("sampled out %d", i)
+        self.logger.error("kept")
+        handler.stop()
+        self.assertEqual([line["message"] for line in self.lines()], ["kept"])
+
+    def test_parse_sample_rates(self):
+        self.assertEqual(parse_sample_rates(""), {})
+        self.assertEqual(parse_sample_rates("INFO=0.1,DEBUG=0"), {logging.INFO: 0.1, logging.DEBUG: 0.0})
+        with self.assertRaises(ValueError):
+            parse_sample_rates("LOUD=1")
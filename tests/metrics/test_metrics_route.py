@@ -0,0 +1,39 @@
+from api.metrics import REQUESTS
+from tests.database import DatabaseTestCase, HEADERS
+
+
+def requests_total(route: str, status: str) -> float:
+    return next((float(x.rsplit(" ", 1)[1]) for x in REQUESTS.samples()
+                 if f'route="{route}"' in x and f'status="{status}"' in x), 0)
+
+
+class MetricsRouteTest(DatabaseTestCase):
+
+    def test_requires_the_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", headers={"Authorization": "Bearer other"}).status_code, 401)
+
+    def test_metrics(self):
+        self.services.url_entry_repo.add_many([("r1", "https://a/1")], ["AAAAAA"])
+        self.client.get("/AAAAAA")
+        response = self.client.get("/metrics", headers=HEADERS)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        body = response.get_data(as_text=True)
+        self.assertIn("# TYPE http_requests_total counter", body)
+        self.assertIn('http_requests_total{route="/<url>",method="GET",status="302"}', body)
+        self.assertIn('redirects_total{kind="counted"}', body)
+
+    def test_unhandled_errors(self):
+        @self.app.route("/failing")
+        def failing():
+            raise RuntimeError("failed")
+
+        # answered by the error handler of Flask
+        self.assertEqual(self.client.get("/failing").status_code, 500)
+        self.assertEqual(requests_total("/failing", "500"), 1)
+        # propagated to the WSGI server
+        self.app.config["PROPAGATE_EXCEPTIONS"] = True
+        with self.assertRaises(RuntimeError):
+            self.client.get("/failing")
+        self.assertEqual(requests_total("/failing", "500"), 2)
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from api.ignored_headers import PreviewClassifier
+
+
+class PreviewClassifierTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "ignored-headers.json")
+        self.version = 0
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_rules(self, rules):
+        with open(self.path, "w") as f:
+            json.dump(rules, f)
+        # a distinct mtime for each version, whatever the resolution of the file system
+        self.version += 1
+        os.utime(self.path, ns=(self.version * 10 ** 9, self.version * 10 ** 9))
+
+    def test_rule_types(self):
+        self.write_rules([
+            "WhatsApp",
+            {"type": "prefix", "pattern": "facebookexternalhit/"},
+            {"type": "substring", "pattern": "Slackbot", "name": "slack"},
+            {"type": "regex", "pattern": r"[Tt]elegram(Bot)?\b"},
+        ])
+        classifier = PreviewClassifier(self.path)
+        self.assertEqual(classifier.match("WhatsApp"), "exact:WhatsApp")
+        self.assertIsNone(classifier.match("WhatsApp/2.23"))
+        self.assertEqual(classifier.match("facebookexternalhit/1.1"), "prefix:facebookexternalhit/")
+        self.assertIsNone(classifier.match("Mozilla facebookexternalhit/1.1"))
+        self.assertEqual(classifier.match("Slackbot-LinkExpanding 1.0"), "slack")
+        self.assertEqual(classifier.match("TelegramBot (like TwitterBot)"), r"regex:[Tt]elegram(Bot)?\b")
+        self.assertFalse(classifier.is_preview("Mozilla/5.0"))
+        self.assertFalse(classifier.is_preview(None))
+        # the memoized results are counted too
+        self.assertTrue(classifier.is_preview("Slackbot-LinkExpanding 1.0"))
+        self.assertEqual(classifier.rule_hits["slack"], 2)
+
+    def test_invalid_rules_are_skipped(self):
+        self.write_rules(["Test", 3, None, {"type": "glob", "pattern": "*"}, {"type": "regex", "pattern": "("},
+                          {"type": "regex", "pattern": "(?i)bot"}, {"type": "regex", "pattern": "(?P<r0>x)"}])
+        classifier = PreviewClassifier(self.path)
+        self.assertEqual(classifier.rules, [("exact:Test", "exact", "Test")])
+        self.assertTrue(classifier.is_preview("Test"))
+
+    def test_group_references(self):
+        self.write_rules([
+            {"type": "regex", "pattern": r"[Tt]elegram(Bot)?\b"},
+            {"type": "regex", "pattern": r"(\w)\1Bot/", "name": "repeated"},
+            {"type": "regex", "pattern": r"\A(<)?link(?(1)>)\Z", "name": "conditional"},
+            {"type": "regex", "pattern": r"[\1](x)\1", "name": "octal"},
+        ])
+        classifier = PreviewClassifier(self.path)
+        self.assertEqual(len(classifier.rules), 4)
+        self.assertEqual(classifier.match("GooBot/1.0"), "repeated")
+        self.assertIsNone(classifier.match("GoBot/1.0"))
+        self.assertEqual(classifier.match("<link>"), "conditional")
+        self.assertEqual(classifier.match("link"), "conditional")
+        self.assertIsNone(classifier.match("<link"))
+        self.assertEqual(classifier.match("\x01xx"), "octal")
+        self.assertIsNone(classifier.match("1xx"))
+
+    def test_too_many_groups(self):
+        self.write_rules(["WhatsApp"])
+        classifier = PreviewClassifier(self.path, check_interval=0)
+        # valid alone, but its reference would be \100 after the groups of the first rule
+        self.write_rules([{"type": "regex", "pattern": "(a)" * 98}, {"type": "regex", "pattern": r"(b)\1"}])
+        with self.assertLogs("api.ignored_headers", "ERROR"):
+            self.assertTrue(classifier.is_preview("WhatsApp"))
+        self.assertEqual(classifier.rules, [("exact:WhatsApp", "exact", "WhatsApp")])
+
+    def test_missing_file(self):
+        classifier = PreviewClassifier(self.path)
+        self.assertFalse(classifier.is_preview("WhatsApp"))
+
+    def test_reload(self):
+        self.write_rules(["WhatsApp"])
+        classifier = PreviewClassifier(self.path, check_interval=0)
+        self.assertTrue(classifier.is_preview("WhatsApp"))
+        self.assertFalse(classifier.is_preview("Twitterbot/1.0"))
+
+        self.write_rules([{"type": "prefix", "pattern": "Twitterbot"}])
+        self.assertFalse(classifier.is_preview("WhatsApp"))
+        self.assertTrue(classifier.is_preview("Twitterbot/1.0"))
+
+        # a broken file keeps the previous rules
+        with open(self.path, "w") as f:
+            f.write("[")
+        os.utime(self.path, ns=(10 ** 12, 10 ** 12))
+        self.assertTrue(classifier.is_preview("Twitterbot/1.0"))
@@ -0,0 +1,59 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from api.models import db, LongUrl, UrlEntryModel, SlugReservation, long_url_hash
+from api.replicas import ReplicaSet, write_heartbeat
+from api.repos import UrlEntryRepo, SlugReservationRepo
+from tests.database import DatabaseTestCase
+
+
+class ReplicaReadsTest(DatabaseTestCase):
+    """
+    The repositories on a primary and a replica in two sqlite files, that hold different rows
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.replica = create_engine(f"sqlite:///{os.path.join(self.directory.name, 'replica.db')}")
+        db.metadata.create_all(self.replica)
+        write_heartbeat(self.replica)
+        replicas = ReplicaSet([self.replica], max_lag=5, check_interval=0)
+        self.url_repo = UrlEntryRepo(self.app, db, replicas=replicas)
+        self.slug_repo = SlugReservationRepo(self.app, db, replicas=replicas)
+
+        self.url_repo.add_many([("r1", "https://primary")], ["PRIMRY"])
+        with self.replica.begin() as connection:
+            connection.execute(LongUrl.__table__.insert().values(hash=long_url_hash("https://replica"),
+                                                                 url="https://replica"))
+            connection.execute(UrlEntryModel.__table__.insert().values(
+                companySlug="", id="REPLIC", longUrlHash=long_url_hash("https://replica"), used=0, synced=True))
+            connection.execute(SlugReservation.__table__.insert().values(
+                slug="replica-slug", by="company", permanent=True, created=datetime.now(), synced=True))
+
+    def tearDown(self):
+        self.replica.dispose()
+        super().tearDown()
+
+    def test_redirect_lookups(self):
+        # only on the replica: served from it, without counting the redirect
+        self.assertEqual(self.url_repo.by_company_slug_and_shorten_url("", "REPLIC", False), "https://replica")
+        # only on the primary: a miss on the replica falls back to the primary
+        self.assertEqual(self.url_repo.by_company_slug_and_shorten_url("", "PRIMRY", False), "https://primary")
+        self.assertIsNone(self.url_repo.by_company_slug_and_shorten_url("", "NOWHER", False))
+        # a counted redirect updates the primary, so it reads it
+        self.assertIsNone(self.url_repo.by_company_slug_and_shorten_url("", "REPLIC", True))
+
+    def test_lagging_replica_is_not_read(self):
+        write_heartbeat(self.replica, datetime.now() - timedelta(seconds=60))
+        self.assertIsNone(self.url_repo.by_company_slug_and_shorten_url("", "REPLIC", False))
+        self.assertEqual(self.slug_repo.by_company_not_expired("company"), [])
+
+    def test_slugs_of_the_company(self):
+        self.slug_repo.reserve("company", "primary-slug")
+        self.assertEqual(self.slug_repo.by_company_not_expired("company"), ["replica-slug"])
+        self.replica.dispose()
+        os.remove(self.replica.url.database)
+        # the replica lost its heartbeat: read from the primary
+        self.assertEqual(self.slug_repo.by_company_not_expired("company"), ["primary-slug"])
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from api.models import ReplicaHeartbeat
+from api.replicas import ReplicaSet, write_heartbeat
+
+
+class ReplicaSetTest(TestCase):
+    """
+    A primary and two replicas in sqlite files, replicated by copying the file of the primary
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.primary_path = os.path.join(self.directory.name, "primary.db")
+        self.primary = create_engine(f"sqlite:///{self.primary_path}")
+        ReplicaHeartbeat.__table__.create(self.primary)
+        self.replica_paths = [os.path.join(self.directory.name, f"replica{i}.db") for i in range(2)]
+        for path in self.replica_paths:
+            shutil.copy(self.primary_path, path)
+        self.replicas = [create_engine(f"sqlite:///{path}") for path in self.replica_paths]
+
+    def tearDown(self):
+        for engine in [self.primary] + self.replicas:
+            engine.dispose()
+        self.directory.cleanup()
+
+    def replicate(self, index: int):
+        shutil.copy(self.primary_path, self.replica_paths[index])
+
+    def test_without_heartbeat_the_primary_is_read(self):
+        replica_set = ReplicaSet(self.replicas, max_lag=5, check_interval=0)
+        self.assertIsNone(replica_set.engine())
+        self.assertEqual(replica_set.lags(), {"0": float("inf"), "1": float("inf")})
+
+    def test_round_robin_over_the_fresh_replicas(self):
+        write_heartbeat(self.primary)
+        self.replicate(0)
+        self.replicate(1)
+        replica_set = ReplicaSet(self.replicas, max_lag=5, check_interval=0)
+        self.assertEqual({replica_set.engine() for _ in range(4)}, set(self.replicas))
+
+    def test_lagging_replica_is_skipped(self):
+        write_heartbeat(self.primary, datetime.now() - timedelta(seconds=60))
+        self.replicate(0)
+        write_heartbeat(self.primary)
+        self.replicate(1)
+        replica_set = ReplicaSet(self.replicas, max_lag=5, check_interval=0)
+        self.assertEqual([replica_set.engine() for _ in range(3)], [self.replicas[1]] * 3)
+        self.assertGreater(replica_set.lags()["0"], 59)
+
+        # the failed replica is skipped until its next check
+        replica_set.check_interval = 60
+        replica_set.failed(self.replicas[1])
+        self.assertIsNone(replica_set.engine())
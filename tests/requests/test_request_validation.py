@@ -0,0 +1,68 @@
+from unittest import TestCase
+
+from api.validation import RequestValidators, SchemaError, compile_schema
+
+
+class RequestValidationTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.validators = RequestValidators()
+
+    def assertSchemaError(self, validator, value, kind: str, path: str):
+        with self.assertRaises(SchemaError) as raised:
+            validator(value)
+        self.assertEqual((raised.exception.kind, raised.exception.path), (kind, path))
+
+    def test_valid_requests(self):
+        entries = [{"sms_record_id": str(i), "original_url": f"https://example.com/{i}"} for i in range(100)]
+        self.validators.shorten(entries)
+        self.validators.shorten_custom({"custom_url": "slug", "custom_url_token": "company",
+                                        "urls_to_shorten": entries, "extra": True})
+        self.validators.reserve_slug({"companyId": "company", "slug": "slug"})
+        self.validators.resolve(["code", "slug/code"])
+
+    def test_shorten(self):
+        self.assertSchemaError(self.validators.shorten, {}, "type", "")
+        self.assertSchemaError(self.validators.shorten, [{"sms_record_id": "1", "original_url": "u"}, 3],
+                               "type", "[1]")
+        self.assertSchemaError(self.validators.shorten, [{"sms_record_id": "1", "original_url": "u", "x": 1}],
+                               "unknown", "[0].x")
+        self.assertSchemaError(self.validators.shorten, [{"sms_record_id": "1"}], "missing", "[0].original_url")
+        self.assertSchemaError(self.validators.shorten, [{"sms_record_id": 1, "original_url": "u"}],
+                               "type", "[0].sms_record_id")
+
+    def test_expires_at(self):
+        entry = {"sms_record_id": "1", "original_url": "u", "expires_at": "2030-01-01T00:00:00+00:00"}
+        self.validators.shorten([entry])
+        self.validators.shorten_entry(entry)
+        self.validators.shorten_custom({"custom_url": "s", "custom_url_token": "t", "urls_to_shorten": [entry]})
+        self.assertSchemaError(self.validators.shorten, [{**entry, "expires_at": 1}], "type", "[0].expires_at")
+        self.assertSchemaError(self.validators.shorten_entry, {**entry, "expires_at": None}, "type", "expires_at")
+
+    def test_shorten_custom(self):
+        self.assertSchemaError(self.validators.shorten_custom, [], "type", "")
+        self.assertSchemaError(self.validators.shorten_custom, {"custom_url": "s", "urls_to_shorten": []},
+                               "missing", "custom_url_token")
+        self.assertSchemaError(self.validators.shorten_custom,
+                               {"custom_url": "s", "custom_url_token": "t", "urls_to_shorten": {}},
+                               "type", "urls_to_shorten")
+        with self.assertRaises(SchemaError) as raised:
+            self.validators.shorten_custom({"custom_url": "s", "custom_url_token": "t",
+                                            "urls_to_shorten": [{"sms_record_id": "1", "original_url": True}]})
+        self.assertEqual(raised.exception.path, "urls_to_shorten[0].original_url")
+        self.assertEqual(raised.exception.found, bool)
+        self.assertTrue(raised.exception.nested)
+
+    def test_reserve_slug_and_resolve(self):
+        self.assertSchemaError(self.validators.reserve_slug, {"slug": "s"}, "missing", "companyId")
+        self.assertSchemaError(self.validators.reserve_slug, {"companyId": "c", "slug": 1}, "type", "slug")
+        self.assertSchemaError(self.validators.resolve, ["code", None], "type", "[1]")
+
+    def test_optional_and_numeric_properties(self):
+        validate = compile_schema({}, {"type": "object", "properties": {"n": {"type": "integer"},
+                                                                        "x": {"type": "number"}}})
+        validate({})
+        validate({"n": 1, "x": 1.5})
+        self.assertSchemaError(validate, {"n": True}, "type", "n")
+        self.assertSchemaError(validate, {"x": "1"}, "type", "x")
@@ -1,2 +1,101 @@
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from unittest import TestCase
 
-import pytest
+from flask import Flask
+
+from api.handlers import handle_slug_reservation, claim_custom_slug
+from api.models import db, SlugReservation
+from api.repos import SlugReservationRepo
+
+# the number of companies reserving the same slug at once
+THREADS = 16
+
+
+class ReservationSlugTest(TestCase):
+    """
+    The reservations of a sqlite file, reserved from concurrent threads
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(self.directory.name, 'slugs.db')}"
+        self.app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        self.app.config["ReservationDuration"] = 900
+        db.init_app(self.app)
+        with self.app.app_context():
+            SlugReservation.__table__.create(db.get_engine(self.app))
+        self.repo = SlugReservationRepo(self.app, db)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.get_engine(self.app).dispose()
+        self.directory.cleanup()
+
+    def reservation(self, slug: str) -> SlugReservation:
+        with self.app.app_context():
+            reservation = db.session.get(SlugReservation, slug)
+            db.session.expunge_all()
+            return reservation
+
+    def reserve_concurrently(self, slug: str, reserve) -> dict:
+        """
+        :param reserve: (company_id) -> the result, called by every thread at once
+        :return: company_id -> the result
+        """
+        barrier = threading.Barrier(THREADS)
+        results = {}
+
+        def run(company_id: str):
+            with self.app.app_context():
+                barrier.wait()
+                results[company_id] = reserve(company_id)
+
+        threads = [threading.Thread(target=run, args=(f"company{i}",)) for i in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_exactly_one_owner_wins(self):
+        results = self.reserve_concurrently("slug", lambda x: handle_slug_reservation(self.repo, x, "slug"))
+        winners = [company_id for company_id, result in results.items() if result == (True, 204)]
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(sorted(results.values()), [(False, 409)] * (THREADS - 1) + [(True, 204)])
+        self.assertEqual(self.reservation("slug").by, winners[0])
+
+    def test_exactly_one_owner_claims_an_expired_reservation(self):
+        with self.app.app_context():
+            db.session.add(SlugReservation("slug", "previous", False, expires=datetime.now() - timedelta(seconds=1)))
+            db.session.commit()
+        results = self.reserve_concurrently("slug", lambda x: claim_custom_slug(self.repo, x, "slug"))
+        self.assertEqual(sorted(results.values()), [200] + [403] * (THREADS - 1))
+        reservation = self.reservation("slug")
+        self.assertEqual(results[reservation.by], 200)
+        self.assertTrue(reservation.permanent)
+        self.assertIsNone(reservation.expires)
+
+    def test_refresh_and_take_over(self):
+        with self.app.app_context():
+            self.assertEqual(handle_slug_reservation(self.repo, "a", "slug"), (True, 204))
+            expires = db.session.get(SlugReservation, "slug").expires
+            db.session.expunge_all()
+            # refreshed by its owner, refused to the others
+            self.assertEqual(handle_slug_reservation(self.repo, "a", "slug"), (True, 204))
+            self.assertEqual(handle_slug_reservation(self.repo, "b", "slug"), (False, 409))
+            self.assertGreaterEqual(db.session.get(SlugReservation, "slug").expires, expires)
+            db.session.expunge_all()
+
+            # a permanent reservation is kept by its owner, and never taken over
+            self.assertEqual(claim_custom_slug(self.repo, "a", "slug"), 200)
+            self.assertEqual(handle_slug_reservation(self.repo, "a", "slug"), (True, 204))
+            self.assertIsNone(db.session.get(SlugReservation, "slug").expires)
+            self.assertEqual(claim_custom_slug(self.repo, "b", "slug"), 403)
+
+            # claimed without a reservation
+            self.assertEqual(claim_custom_slug(self.repo, "b", "other"), 200)
+            self.assertTrue(db.session.get(SlugReservation, "other").permanent)
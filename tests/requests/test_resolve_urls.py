@@ -0,0 +1,79 @@
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy import select
+
+from api.models import UrlEntryModel
+from tests.database import DatabaseTestCase, HEADERS
+
+LAST_USED = datetime(2026, 1, 15, 12, 0)
+
+
+class ResolveUrlsTest(DatabaseTestCase):
+    """
+    The /api/resolve route, read from the entries and from the archive
+    """
+    config = {"UrlCacheSize": 0}
+
+    def setUp(self):
+        super().setUp()
+        self.repo = self.services.url_entry_repo
+        self.repo.add_many([("r1", "https://a/1"), ("r2", "https://a/2")], ["AAAAAA", "BBBBBB"])
+        self.repo.add_many([("r3", "https://a/3"), ("r4", "https://a/4")], ["DDDDDD", "CCCCCC"], "company")
+        table = UrlEntryModel.__table__
+        self.execute(table.update().where(table.c.id == "BBBBBB").values(used=2, lastUsed=LAST_USED))
+
+    def resolve(self, urls) -> list:
+        response = self.client.post("/api/resolve", json=urls, headers=HEADERS)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([x["shortened_url"] for x in response.json], urls)
+        return response.json
+
+    def original_urls(self, urls) -> list:
+        return [x["original_url"] for x in self.resolve(urls)]
+
+    def test_code_and_slug_code(self):
+        self.assertEqual(self.original_urls(["AAAAAA", "company/DDDDDD", "company/CCCCCC", "CCCCCC", "other/DDDDDD",
+                                             "company/AAAAAA", "company/DDDDDD/x", "/AAAAAA"]),
+                         ["https://a/1", "https://a/3", "https://a/4", None, None, None, None, "https://a/1"])
+
+    def test_stats(self):
+        results = self.resolve(["BBBBBB", "ZZZZZZ", "AAAAAA"])
+        self.assertEqual(results[:2], [
+            {"shortened_url": "BBBBBB", "original_url": "https://a/2", "used": 2, "lastUsed": LAST_USED.isoformat()},
+            {"shortened_url": "ZZZZZZ", "original_url": None, "used": None, "lastUsed": None},
+        ])
+        # not counted as a click
+        self.assertEqual(self.resolve(["AAAAAA"]), results[2:])
+        self.assertEqual(results[2]["used"], 0)
+
+    def test_order_and_duplicates(self):
+        urls = ["company/CCCCCC", "AAAAAA", "company/CCCCCC", "ZZZZZZ", "BBBBBB", "company/DDDDDD"]
+        expected = ["https://a/4", "https://a/1", "https://a/4", None, "https://a/2", "https://a/3"]
+        self.assertEqual(self.original_urls(urls), expected)
+        # read in several chunks
+        with mock.patch("api.repos._IN_CHUNK_SIZE", 2):
+            self.assertEqual(self.original_urls(urls), expected)
+        self.assertEqual(self.resolve([]), [])
+
+    def test_archived_entries(self):
+        table = UrlEntryModel.__table__
+        self.execute(table.update().where(table.c.companySlug == "company").values(lastUsed=LAST_USED, synced=True))
+        result = self.app.test_cli_runner().invoke(args=["archive-entries"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(sorted(x.id for x in self.execute(select(table.c.id))), ["AAAAAA", "BBBBBB"])
+
+        urls = ["company/DDDDDD", "AAAAAA", "company/CCCCCC", "CCCCCC", "company/AAAAAA", "DDDDDD"]
+        expected = ["https://a/3", "https://a/1", "https://a/4", None, None, None]
+        self.assertEqual(self.original_urls(urls), expected)
+        with mock.patch("api.repos._IN_CHUNK_SIZE", 1):
+            self.assertEqual(self.original_urls(urls), expected)
+        self.assertEqual(self.resolve(["company/CCCCCC"])[0]["lastUsed"], LAST_USED.isoformat())
+        # still archived
+        self.assertEqual(len(self.execute(select(table.c.id))), 2)
+
+    def test_bad_requests(self):
+        for body in ({"urls": ["AAAAAA"]}, "AAAAAA", ["AAAAAA", 1]):
+            response = self.client.post("/api/resolve", json=body, headers=HEADERS)
+            self.assertEqual(response.status_code, 400, body)
+        self.assertEqual(self.client.post("/api/resolve", json=["AAAAAA"]).status_code, 401)
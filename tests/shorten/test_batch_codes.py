@@ -0,0 +1,19 @@
+import string
+from unittest import TestCase
+
+from api.short_func import UUID4BasedURLShortener
+
+
+class BatchCodesTest(TestCase):
+
+    def test_batch_matches_single_code_format(self):
+        codes = UUID4BasedURLShortener.get_shorter_urls_for(10_000)
+        alphabet = set(string.ascii_letters + string.digits)
+
+        self.assertEqual(len(codes), 10_000)
+        self.assertTrue(all(len(code) == UUID4BasedURLShortener.get_max_url_length() for code in codes))
+        self.assertTrue(all(set(code) <= alphabet for code in codes))
+        self.assertGreater(len(set(codes)), 9_990)
+
+    def test_empty_batch(self):
+        self.assertEqual(UUID4BasedURLShortener.get_shorter_urls_for(0), [])
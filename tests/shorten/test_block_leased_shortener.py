@@ -0,0 +1,28 @@
+from unittest import TestCase
+
+from api.short_func import BlockLeasedURLShortener
+
+
+class BlockLeasedShortenerTest(TestCase):
+
+    def setUp(self):
+        self.leases = []
+
+        def lease(size: int) -> int:
+            start = len(self.leases) * size
+            self.leases.append(start)
+            return start
+
+        self.shortener = BlockLeasedURLShortener(lease, "test-key", block_size=100)
+
+    def test_codes_are_unique_and_reversible(self):
+        codes = [self.shortener.get_shorter_url_for("https://example.com") for _ in range(1000)]
+
+        self.assertEqual(len(set(codes)), 1000)
+        self.assertTrue(all(len(code) == 6 and code.isalnum() for code in codes))
+        self.assertEqual([self.shortener.counter_value_of(code) for code in codes], list(range(1000)))
+        self.assertEqual(len(self.leases), 10)
+
+    def test_permutation_is_keyed(self):
+        other = BlockLeasedURLShortener(lambda size: 0, "other-key")
+        self.assertNotEqual(self.shortener.get_shorter_url_for(""), other.get_shorter_url_for(""))
@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from sqlalchemy import select
+
+from api.bloom import BloomFilter
+from api.handlers import shorten_urls_collision_check
+from api.models import UrlEntryModel, db
+from api.repos import UrlEntryRepo
+from tests.database import DatabaseTestCase
+from tests.shorten.test_collision_check import ScriptedShortener
+
+
+class CodeFilterWorkersTest(DatabaseTestCase):
+    """
+    Two workers with their own code filter: the codes inserted by one after the other built its filter
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.worker = UrlEntryRepo(self.app, db, code_filter=BloomFilter(1000))
+        self.other_worker = UrlEntryRepo(self.app, db, code_filter=BloomFilter(1000))
+        self.worker.build_code_filter()
+        self.other_worker.build_code_filter()
+        self.assertTrue(self.other_worker.add_many([("r1", "https://a/1")], ["SHARED"], "acme"))
+
+    def entries(self) -> list:
+        table = UrlEntryModel.__table__
+        return sorted((x.companySlug, x.id) for x in self.execute(select(table.c.companySlug, table.c.id)))
+
+    def test_code_of_another_worker_is_not_inserted_again(self):
+        # unknown to the filter of the worker
+        self.assertEqual(self.worker.existing_short_urls(["SHARED"]), set())
+        self.assertFalse(self.worker.add_many([("r2", "https://a/2")], ["SHARED"]))
+        self.assertFalse(self.worker.add("r2", "https://a/2", "SHARED", "other"))
+        self.assertEqual(self.entries(), [("acme", "SHARED")])
+
+    def test_batch_is_shortened_again(self):
+        codes = shorten_urls_collision_check(self.worker, "", [("r2", "https://a/2"), ("r3", "https://a/3")],
+                                             ScriptedShortener(["NEWONE", "SHARED", "NEWTWO", "NEWTRE"]))
+        self.assertEqual(codes, ["NEWTWO", "NEWTRE"])
+        self.assertEqual(self.entries(), [("", "NEWTRE"), ("", "NEWTWO"), ("acme", "SHARED")])
+
+    def test_archived_code_of_another_worker_is_not_issued(self):
+        table = UrlEntryModel.__table__
+        self.execute(table.update().values(lastUsed=datetime(2026, 1, 15), synced=True))
+        result = self.app.test_cli_runner().invoke(args=["archive-entries"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.entries(), [])
+        self.assertEqual(self.worker.existing_short_urls(["SHARED", "NEWONE"]), {"SHARED"})
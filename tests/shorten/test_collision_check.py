@@ -0,0 +1,94 @@
+from typing import List
+
+from sqlalchemy import select
+
+from api.handlers import shorten_urls_collision_check
+from api.metrics import COLLISION_RETRIES
+from api.models import UrlEntryModel, db
+from api.repos import UrlEntryRepo
+from api.short_func import URLShortener
+from tests.database import DatabaseTestCase, HEADERS
+
+
+class ScriptedShortener(URLShortener):
+    """
+    Returns the codes of the script, in order, repeated codes included
+    """
+
+    def __init__(self, codes: List[str]):
+        self.codes = iter(codes)
+
+    def get_max_url_length(self) -> int:
+        return 6
+
+    def get_shorter_url_for(self, url: str) -> str:
+        return next(self.codes)
+
+    def get_shorter_urls_for(self, count: int) -> List[str]:
+        return [next(self.codes) for _ in range(count)]
+
+
+class RacingUrlEntryRepo(UrlEntryRepo):
+    """
+    Another request inserts a code between the first collision check and the insert
+    """
+
+    def __init__(self, *args, taken_by_another_request: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.taken_by_another_request = taken_by_another_request
+
+    def existing_short_urls(self, short_urls: List[str]):
+        existing = super().existing_short_urls(short_urls)
+        if self.taken_by_another_request is not None:
+            UrlEntryRepo(self.app, self.db).add_many([("other", "https://other")], [self.taken_by_another_request])
+            self.taken_by_another_request = None
+        return existing
+
+
+class CollisionCheckTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.repo = self.services.url_entry_repo
+        self.repo.add_many([("old", "https://old")], ["TAKEN1"])
+        self.entries = [(f"r{i}", f"https://a/{i}") for i in range(4)]
+
+    def stored(self) -> dict:
+        table = UrlEntryModel.__table__
+        return {x.id: x.recordId for x in self.execute(select(table.c.id, table.c.recordId))}
+
+    def retries(self) -> float:
+        return sum(COLLISION_RETRIES._values.values())
+
+    def test_collisions_in_the_batch_and_in_the_database(self):
+        retries = self.retries()
+        # TAKEN1 is in the database, DUP111 twice in the batch; the first regenerated code repeats DUP111 again
+        shortener = ScriptedShortener(["TAKEN1", "DUP111", "DUP111", "FRESH1", "DUP111", "NEW002", "NEW001"])
+        short_urls = shorten_urls_collision_check(self.repo, "", self.entries, shortener)
+
+        self.assertEqual(short_urls, ["NEW001", "DUP111", "NEW002", "FRESH1"])
+        self.assertEqual(self.stored(), {"TAKEN1": "old", "NEW001": "r0", "DUP111": "r1", "NEW002": "r2",
+                                         "FRESH1": "r3"})
+        self.assertEqual(self.retries() - retries, 3)
+
+    def test_code_taken_by_another_request_after_the_check(self):
+        repo = RacingUrlEntryRepo(self.app, db, taken_by_another_request="RACED1")
+        shortener = ScriptedShortener(["RACED1", "OTHER1", "RETRY1", "RETRY2"])
+        short_urls = shorten_urls_collision_check(repo, "", self.entries[:2], shortener)
+
+        # the batch is inserted again with new codes, nothing was kept from the failed insert
+        self.assertEqual(short_urls, ["RETRY1", "RETRY2"])
+        self.assertEqual(self.stored(), {"TAKEN1": "old", "RACED1": "other", "RETRY1": "r0", "RETRY2": "r1"})
+
+    def test_results_in_entry_order(self):
+        self.services.url_shortener = ScriptedShortener(["TAKEN1", "CODE01", "CODE01", "CODE02", "CODE03",
+                                                         "CODE04"])
+        body = [{"sms_record_id": record_id, "original_url": long_url} for record_id, long_url in self.entries]
+        response = self.client.post("/api/shorten", json=body, headers=HEADERS)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(x["sms_record_id"], x["original_url"]) for x in response.json], self.entries)
+        codes = [x["shortened_url"] for x in response.json]
+        self.assertEqual(codes, ["CODE03", "CODE01", "CODE04", "CODE02"])
+        self.assertEqual({code: self.stored()[code] for code in codes},
+                         {code: record_id for code, (record_id, _) in zip(codes, self.entries)})
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from api.handlers import shorten_urls
+from api.models import UrlEntryModel, LongUrl
+from tests.database import DatabaseTestCase, HEADERS
+
+
+class IdempotentShorteningTest(DatabaseTestCase):
+    config = {"ShortenIdempotent": True}
+
+    def setUp(self):
+        super().setUp()
+        self.repo = self.services.url_entry_repo
+
+    def shorten(self, entries, expires=None):
+        return shorten_urls(self.repo, "slug", entries, idempotent=True, expires=expires)
+
+    def test_same_entries_get_the_same_codes(self):
+        first = self.shorten([("r1", "https://a/1"), ("r2", "https://a/2")])
+        # repeated in the batch, shortened once
+        again = self.shorten([("r2", "https://a/2"), ("r1", "https://a/1"), ("r1", "https://a/1"),
+                              ("r1", "https://a/other")])
+        self.assertEqual(again[:3], [first[1], first[0], first[0]])
+        self.assertNotIn(again[3], first)
+        self.assertEqual(len(self.execute(select(UrlEntryModel.__table__.c.id))), 3)
+        # under another slug, a new entry
+        self.assertNotEqual(shorten_urls(self.repo, "", [("r1", "https://a/1")], idempotent=True), first[:1])
+
+    def test_expired_entry_is_shortened_again(self):
+        past, future = datetime.now() - timedelta(seconds=1), datetime.now() + timedelta(hours=1)
+        first = self.shorten([("r1", "https://a/1"), ("r2", "https://a/2")], [past, future])
+        again = self.shorten([("r1", "https://a/1"), ("r2", "https://a/2")])
+        self.assertNotEqual(again[0], first[0])
+        self.assertEqual(again[1], first[1])
+        response = self.client.get(f"/slug/{again[0]}")
+        self.assertEqual((response.status_code, response.location), (302, "https://a/1"))
+        # the new entry is found from now on
+        self.assertEqual(self.shorten([("r1", "https://a/1")]), again[:1])
+
+    def test_route(self):
+        body = [{"sms_record_id": "r1", "original_url": "https://a/1"}]
+        codes = [self.client.post("/api/shorten", json=body, headers=HEADERS).json[0]["shortened_url"]
+                 for _ in range(2)]
+        self.assertEqual(codes[0], codes[1])
+
+
+class DedupeLongUrlsTest(DatabaseTestCase):
+
+    def test_dedupe_command(self):
+        table = UrlEntryModel.__table__
+        # created before the deduplication, with the url in the entry
+        self.execute(table.insert(), [{"companySlug": "", "id": f"LEGAC{i}", "recordId": f"r{i}",
+                                       "longUrl": f"https://a/{i % 2}", "used": 0, "synced": True}
+                                      for i in range(5)])
+        self.services.url_entry_repo.add_many([("r9", "https://a/1")], ["NEWONE"])
+
+        result = self.app.test_cli_runner().invoke(args=["dedupe-long-urls", "--batch-size", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Moved 5 long urls", result.output)
+        rows = self.execute(select(table.c.id, table.c.longUrl, table.c.longUrlHash, table.c.synced))
+        self.assertTrue(all(x.longUrl is None and x.longUrlHash is not None for x in rows))
+        self.assertEqual(sorted(x.url for x in self.execute(select(LongUrl.__table__))),
+                         ["https://a/0", "https://a/1"])
+        # still redirected, and found by the idempotent shortening
+        response = self.client.get("/LEGAC2")
+        self.assertEqual((response.status_code, response.location), (302, "https://a/0"))
+        self.assertEqual(shorten_urls(self.services.url_entry_repo, "", [("r3", "https://a/1")], idempotent=True),
+                         ["LEGAC3"])
+
+        # run again, nothing to move
+        result = self.app.test_cli_runner().invoke(args=["dedupe-long-urls"])
+        self.assertIn("Moved 0 long urls", result.output)
@@ -0,0 +1,122 @@
+import json
+
+from sqlalchemy import select
+
+from api.models import UrlEntryModel
+from tests.database import DatabaseTestCase, HEADERS
+
+NDJSON_HEADERS = {**HEADERS, "Content-Type": "application/x-ndjson"}
+
+
+def ndjson(*values) -> str:
+    return "".join(json.dumps(x) + "\n" for x in values)
+
+
+def entry(i: int) -> dict:
+    return {"sms_record_id": f"r{i}", "original_url": f"https://a/{i}"}
+
+
+class NDJSONShortenTest(DatabaseTestCase):
+    config = {"ShortenStreamChunkSize": 2}
+
+    def post(self, path, body):
+        return self.client.post(path, data=body, headers=NDJSON_HEADERS)
+
+    def entry_count(self):
+        return len(self.execute(select(UrlEntryModel.__table__.c.id)))
+
+    def lines(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        return [json.loads(x) for x in response.get_data(as_text=True).splitlines()]
+
+    def test_results_are_streamed_per_chunk(self):
+        response = self.post("/api/shorten", ndjson(*map(entry, range(5))) + "\n")
+        chunks = iter(response.response)
+        first = json.loads(next(chunks))
+        # only the first chunk is shortened before its results are sent
+        self.assertEqual(self.entry_count(), 2)
+        results = [first] + [json.loads(x) for x in chunks]
+        self.assertEqual(self.entry_count(), 5)
+        self.assertEqual([(x["sms_record_id"], x["original_url"]) for x in results],
+                         [(f"r{i}", f"https://a/{i}") for i in range(5)])
+        for result in results:
+            redirect = self.client.get("/" + result["shortened_url"])
+            self.assertEqual(redirect.location, result["original_url"])
+
+    def test_bad_line_ends_the_stream(self):
+        cases = [
+            ("[1, 2\n", "the line is not valid json"),
+            (ndjson([entry(9)]), "the entry is not a dictionary"),
+            (ndjson({"sms_record_id": "r9"}), "the entry needs exactly the keys sms_record_id and original_url, "
+                                              "and optionally expires_at"),
+            (ndjson({"sms_record_id": 9, "original_url": "https://a/9"}),
+             "sms_record_id, original_url and expires_at should be strings"),
+            (ndjson({**entry(9), "expires_at": "tomorrow"}), "expires_at should be an ISO 8601 time"),
+        ]
+        for bad_line, error in cases:
+            with self.subTest(error=error):
+                # the bad line is in the middle of the second chunk
+                body = ndjson(*map(entry, range(3))) + bad_line + ndjson(entry(4))
+                lines = self.lines(self.post("/api/shorten", body))
+                self.assertEqual([x.get("sms_record_id") for x in lines[:-1]], ["r0", "r1", "r2"])
+                self.assertEqual(lines[-1], {"error": error, "line": 4})
+
+    def test_bad_first_line(self):
+        before = self.entry_count()
+        lines = self.lines(self.post("/api/shorten", ndjson({}, entry(1))))
+        self.assertEqual(lines, [{"error": "the entry needs exactly the keys sms_record_id and original_url, "
+                                           "and optionally expires_at", "line": 1}])
+        self.assertEqual(self.entry_count(), before)
+
+    def test_empty_request(self):
+        self.assertEqual(self.lines(self.post("/api/shorten", "")), [])
+
+    def test_requires_auth(self):
+        response = self.client.post("/api/shorten", data=ndjson(entry(1)),
+                                    headers={"Content-Type": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 401)
+
+
+class NDJSONShortenCustomTest(DatabaseTestCase):
+    config = {"ShortenStreamChunkSize": 2}
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post("/api/reserve-slug", json={"companyId": "company", "slug": "acme"},
+                                    headers=HEADERS)
+        self.assertEqual(response.status_code, 204)
+        self.header = {"custom_url": "acme", "custom_url_token": "company"}
+
+    def post(self, *values, body=""):
+        return self.client.post("/api/shorten/custom", data=ndjson(*values) + body, headers=NDJSON_HEADERS)
+
+    def test_entries_are_shortened_with_the_slug(self):
+        response = self.post(self.header, *map(entry, range(3)))
+        self.assertEqual(response.status_code, 200)
+        results = [json.loads(x) for x in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([x["sms_record_id"] for x in results], ["r0", "r1", "r2"])
+        for result in results:
+            self.assertTrue(result["shortened_url"].startswith("acme/"))
+            self.assertEqual(self.client.get("/" + result["shortened_url"]).location, result["original_url"])
+
+    def test_bad_entry_line(self):
+        response = self.post(self.header, entry(0), entry(1), entry(2), body="{\n")
+        results = [json.loads(x) for x in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([x.get("sms_record_id") for x in results[:-1]], ["r0", "r1", "r2"])
+        # the header is line 1
+        self.assertEqual(results[-1], {"error": "the line is not valid json", "line": 5})
+
+    def test_bad_header(self):
+        cases = [
+            (self.post(), 400),
+            (self.post(body="{\n"), 400),
+            (self.post([self.header]), 400),
+            (self.post({"custom_url": "acme"}), 400),
+            (self.post({"custom_url": "acme", "custom_url_token": 1}), 400),
+            (self.post({"custom_url": "", "custom_url_token": "company"}), 400),
+            (self.post({"custom_url": "acme", "custom_url_token": "other"}, entry(1)), 403),
+        ]
+        for response, status in cases:
+            self.assertEqual(response.status_code, status, response.get_data(as_text=True))
+        self.assertEqual(self.execute(select(UrlEntryModel.__table__.c.id)), [])
@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+# time allowed to import the application and create it, in a fresh interpreter
+BUDGET_IN_SECONDS = float(os.environ.get("StartupBudgetInSeconds", "1.5"))
+# the modules that the serving path must not import
+HEAVY_MODULES = ("numpy", "pandas", "alembic")
+
+_STARTUP = """
+import json, sys, time
+started = time.perf_counter()
+from api.app import create_app
+create_app()
+print(json.dumps({"seconds": time.perf_counter() - started,
+                  "imported": [name for name in %r if name in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+class ImportTimeTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def start(self) -> dict:
+        env = {key: value for key, value in os.environ.items() if key != "FLASK_RUN_FROM_CLI"}
+        env.update({
+            "DATABASE_URL": f"sqlite:///{os.path.join(self.directory.name, 'startup.db')}",
+            "ReservationDurationInSeconds": "900",
+            "UrlShortenerAllowedKey": "startup",
+        })
+        output = subprocess.run([sys.executable, "-c", _STARTUP], env=env, cwd=Path(__file__).parent.parent.parent,
+                                capture_output=True, text=True, check=True).stdout
+        return json.loads(output.splitlines()[-1])
+
+    def test_heavy_modules_are_not_imported(self):
+        self.assertEqual(self.start()["imported"], [])
+
+    def test_cold_start_budget(self):
+        # the best of a few runs, so that a busy machine does not fail the test
+        seconds = min(self.start()["seconds"] for _ in range(3))
+        self.assertLess(seconds, BUDGET_IN_SECONDS)
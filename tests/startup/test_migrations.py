@@ -0,0 +1,28 @@
+from pathlib import Path
+
+from sqlalchemy import inspect
+
+from api.app import LazyMigrate
+from api.models import db
+from tests.database import DatabaseTestCase
+
+MIGRATIONS = str(Path(__file__).parent.parent.parent / "migrations")
+
+
+class MigrationsTest(DatabaseTestCase):
+    """
+    Flask-Migrate is registered by every application, not only the ones created by the flask command
+    """
+
+    def test_upgrade(self):
+        self.assertIsInstance(self.app.extensions["migrate"], LazyMigrate)
+        from flask_migrate import upgrade
+        db.drop_all()
+        upgrade(directory=MIGRATIONS)
+        # replaced by the extension on the first use
+        self.assertNotIsInstance(self.app.extensions["migrate"], LazyMigrate)
+        tables = set(inspect(db.get_engine(self.app)).get_table_names())
+        self.assertEqual(tables - {"alembic_version"}, set(db.metadata.tables))
+
+        self.services.url_entry_repo.add_many([("r1", "https://a/1")], ["AAAAAA"])
+        self.assertEqual(self.client.get("/AAAAAA").location, "https://a/1")